@@ -1,34 +1,330 @@
 import cv2
 import numpy as np
 import argparse
+import glob
+import multiprocessing
 import os
+import sys
+import time
+from collections import namedtuple
+
+from dnn_backends import BACKENDS, TARGETS, autotune
+from face_index import CALIBRATION_IMAGES, EMBEDDING_LAYER, FaceIndex, calibration_descriptors
+from face_tracker import FaceTracker
+from metrics import NO_TIMING, StageMetrics
+from model_registry import ModelRegistry, default_registry
+from result_cache import ResultCache, content_key, print_cache_stats
+from video_output import VideoOutput
+from multi_stream import MultiStreamProcessor
+from video_pipeline import VideoPipeline
+
+# Mean values used when the age model was trained
+AGE_MODEL_MEAN_VALUES = (78.4263377603, 87.7689143744, 114.895847746)
+
+# Mean values subtracted from images fed to the face detector
+FACE_MODEL_MEAN_VALUES = [104, 117, 123]
+
+# Smallest square input the face detector graph accepts
+MIN_DETECTOR_SIZE = 288
+
+# File patterns picked up when processing a directory of images
+IMAGE_EXTENSIONS = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff']
+
+# File name prefix of annotated images written for --dir and batch jobs
+RESULT_PREFIX = "result_"
+
+# In-memory result cache size used when only an on-disk cache is requested
+DEFAULT_CACHE_MB = 64
+
+# Bundled image used for the backend self-test when no input image is given
+AUTOTUNE_IMAGE = "sample_person1.jpg"
+
+# imdecode flags for decoding JPEGs at 1/scale resolution
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Age network input size and mean, laid out for writing straight into NCHW blobs
+AGE_INPUT_SIZE = (227, 227)
+AGE_MEAN_CHW = np.asarray(AGE_MODEL_MEAN_VALUES, dtype=np.float32).reshape(3, 1, 1)
+
+class FaceResult(namedtuple('FaceResult', ['box', 'confidence', 'age_index',
+                                           'age_range', 'probabilities', 'identity',
+                                           'identity_age_range'],
+                            defaults=(None, None))):
+    """Age prediction for one detected face
+    
+    box is (x1, y1, x2, y2) in image pixels, confidence is the face detector
+    score and probabilities is the age network output for all age ranges.
+    identity and identity_age_range, the most likely age range over every
+    face of that identity so far, are only set when the predictor has a
+    face index (see face_index). The other fields always describe this face.
+    """
+    __slots__ = ()
+    
+    @property
+    def age_confidence(self):
+        """Probability of the predicted age range"""
+        return float(self.probabilities[self.age_index])
+    
+    def as_dict(self):
+        """Plain-JSON view of the result"""
+        record = {
+            "box": [int(value) for value in self.box],
+            "confidence": float(self.confidence),
+            "age_range": self.age_range,
+            "age_confidence": self.age_confidence,
+            "probabilities": [float(p) for p in self.probabilities],
+        }
+        
+        if self.identity is not None:
+            record["identity"] = self.identity
+            record["identity_age_range"] = self.identity_age_range
+        
+        return record
+
+def decode_image(data, scale=1):
+    """Decode JPEG/PNG bytes into a BGR image, or return None if they are invalid
+    
+    data may be bytes, a memoryview, an mmap or a uint8 array; it is viewed
+    in place rather than copied. scale 2, 4 or 8 decodes JPEGs at that
+    fraction of their resolution, which is much cheaper than a full decode.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    
+    return cv2.imdecode(buffer, DECODE_FLAGS[scale])
+
+def jpeg_size(data):
+    """Read (width, height) from a JPEG header without decoding, or None if not a JPEG"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size < 4 or buffer[0] != 0xFF or buffer[1] != 0xD8:
+        return None
+    
+    offset = 2
+    while offset + 9 < buffer.size:
+        if buffer[offset] != 0xFF:
+            return None
+        
+        marker = int(buffer[offset + 1])
+        
+        # Fill bytes and markers without a length field
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        
+        # Start-of-frame segments hold the image size (C4, C8 and CC are not frames)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int(buffer[offset + 5]) << 8 | int(buffer[offset + 6])
+            width = int(buffer[offset + 7]) << 8 | int(buffer[offset + 8])
+            return width, height
+        
+        offset += 2 + (int(buffer[offset + 2]) << 8 | int(buffer[offset + 3]))
+    
+    return None
+
+def reduced_scale(data, min_size):
+    """Largest reduced JPEG decode scale that keeps the shorter side at least min_size
+    
+    Returns 1 for images that aren't JPEGs or are already small.
+    """
+    size = jpeg_size(data)
+    if size is None:
+        return 1
+    
+    shorter = min(size)
+    for scale in (8, 4, 2):
+        if shorter // scale >= min_size:
+            return scale
+    
+    return 1
+
+def decoded_size(data, image, scale):
+    """Full-resolution (width, height) of an image decoded at 1/scale"""
+    height, width = image.shape[:2]
+    if scale == 1:
+        return width, height
+    
+    full_width, full_height = jpeg_size(data)
+    
+    # imdecode applies EXIF rotation, which the header size doesn't include
+    if (width > height) != (full_width > full_height):
+        full_width, full_height = full_height, full_width
+    
+    return full_width, full_height
+
+def scale_results(results, scale, size):
+    """Map FaceResult boxes from a reduced decode back to full-resolution pixels"""
+    if scale == 1:
+        return results
+    
+    width, height = size
+    scaled = []
+    for result in results:
+        x1, y1, x2, y2 = result.box
+        box = (x1 * scale, y1 * scale, min(x2 * scale, width), min(y2 * scale, height))
+        scaled.append(result._replace(box=box))
+    
+    return scaled
 
 class AgePredictor:
-    def __init__(self):
+    def __init__(self, max_batch_size=32, nms_threshold=None, top_k=None,
+                 detector_size=300, letterbox=False, tile_size=None, tile_overlap=0.25,
+                 instrument=False, shared_models=True, backend=None, target=None,
+                 threads=None, cache_mb=None, cache_db=None, face_index=None):
         # Age ranges for classification
         self.age_ranges = ['(0-2)', '(4-6)', '(8-12)', '(15-20)', '(25-32)', 
                           '(38-43)', '(48-53)', '(60-100)']
         
-        # Initialize models
-        self.face_net = None
-        self.age_net = None
+        # Initialize models; they are loaded on first use
+        self._face_net = None
+        self._age_net = None
+        
+        # Nets are shared with other predictors in the process unless private
+        # copies are requested, e.g. to use them from several threads at once
+        self.registry = default_registry if shared_models else ModelRegistry()
+        
+        # DNN backend and target names (see dnn_backends); None keeps the
+        # OpenCV defaults
+        self.backend = backend
+        self.target = target
         
-        # Model paths
+        # OpenCV's thread count is process-wide, so this affects every predictor
+        if threads is not None:
+            cv2.setNumThreads(threads)
+        
+        # Model paths, or in-memory buffers holding the model files
         self.face_proto = "opencv_face_detector.pbtxt"
         self.face_model = "opencv_face_detector_uint8.pb"
         self.age_proto = "age_deploy.prototxt"
         self.age_model = "age_net.caffemodel"
         
+        # Maximum number of faces sent through the age network in one forward pass
+        self.max_batch_size = max_batch_size
+        
+        # Optional non-maximum suppression IoU threshold and cap on faces per image
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        
+        # Square input resolution of the face detector; smaller is faster,
+        # larger finds smaller faces
+        if detector_size < MIN_DETECTOR_SIZE:
+            print(f"Detector size {detector_size} is too small, using {MIN_DETECTOR_SIZE}")
+            detector_size = MIN_DETECTOR_SIZE
+        self.detector_size = detector_size
+        
+        # Pad images to a square before detection instead of stretching them
+        self.letterbox = letterbox
+        
+        # Images larger than tile_size are also searched in overlapping tiles
+        # of that size so small faces in high-resolution images are found
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        
+        # Age network input reused between forward passes, grown as needed
+        self._age_input = None
+        self._age_resized = np.empty(AGE_INPUT_SIZE + (3,), dtype=np.uint8)
+        
+        # Cleared if the face detector fails on multi-image blobs
+        self.batched_detection = True
+        
+        # Per-stage timings, only collected when instrumentation is enabled
+        self.metrics = StageMetrics() if instrument else None
+        
+        # Optional FaceIndex grouping faces into identities; when set, predict()
+        # also reports each face's identity and the age over all of its faces
+        self.face_index = face_index
+        self._calibrated_index = None
+        
+        # Optional cache of results keyed by image content, used by
+        # process_image() and process_batch() (see result_cache)
+        self.result_cache = None
+        self._model_version = None
+        if cache_mb is not None or cache_db is not None:
+            memory_mb = DEFAULT_CACHE_MB if cache_mb is None else cache_mb
+            self.result_cache = ResultCache(int(memory_mb * 1024 * 1024), cache_db)
+        
+    def _stage(self, name):
+        """Time a processing stage when instrumentation is enabled"""
+        if self.metrics is None:
+            return NO_TIMING
+        
+        return self.metrics.time(name)
+    
+    def _record_layers(self, name, net):
+        """Record the layer timings of a net's last forward pass when instrumented"""
+        if self.metrics is not None:
+            self.metrics.record_layers(name, net)
+    
+    def stats(self):
+        """Return per-stage and per-layer timing statistics
+        
+        Empty unless the predictor was created with instrument=True.
+        """
+        if self.metrics is None:
+            return {}
+        
+        return self.metrics.stats()
+    
+    def write_metrics(self, path):
+        """Write timing statistics to a file in the Prometheus text format"""
+        if self.metrics is None:
+            print("Instrumentation is disabled, no metrics to write")
+            return False
+        
+        self.metrics.write_prometheus(path)
+        return True
+    
+    @property
+    def face_net(self):
+        """Face detection network, loaded on first use"""
+        if self._face_net is None:
+            self._face_net = self._get_net("tensorflow", self.face_model, self.face_proto)
+        
+        return self._face_net
+    
+    @face_net.setter
+    def face_net(self, net):
+        self._face_net = net
+    
+    @property
+    def age_net(self):
+        """Age classification network, loaded on first use"""
+        if self._age_net is None:
+            self._age_net = self._get_net("caffe", self.age_model, self.age_proto)
+        
+        return self._age_net
+    
+    @age_net.setter
+    def age_net(self, net):
+        self._age_net = net
+    
+    def _get_net(self, framework, model, config):
+        """Fetch a net from the registry, configured for this predictor's backend"""
+        return self.registry.get(framework, model, config, backend=self.backend, target=self.target)
+    
     def load_models(self):
-        """Load pre-trained models for face detection and age prediction"""
+        """Load pre-trained models for face detection and age prediction
+        
+        Nets already loaded by another predictor in this process are reused.
+        """
         try:
+            start = time.perf_counter()
+            
             # Load face detection model
-            self.face_net = cv2.dnn.readNetFromTensorflow(self.face_model, self.face_proto)
+            self._face_net = self._get_net("tensorflow", self.face_model, self.face_proto)
             
             # Load age prediction model
-            self.age_net = cv2.dnn.readNetFromCaffe(self.age_proto, self.age_model)
+            self._age_net = self._get_net("caffe", self.age_model, self.age_proto)
             
-            print("Models loaded successfully!")
+            print(f"Models loaded successfully! ({(time.perf_counter() - start) * 1000:.0f} ms)")
             return True
             
         except Exception as e:
@@ -36,174 +332,1140 @@ class AgePredictor:
             print("Please ensure all model files are in the current directory")
             return False
     
-    def detect_faces(self, image, confidence_threshold=0.7):
-        """Detect faces in the input image"""
+    def detect_faces(self, image, confidence_threshold=0.7, return_confidences=False):
+        """Detect faces in the input image
+        
+        Returns an (N, 4) integer array of x1, y1, x2, y2 boxes clipped to the
+        image, best first. With return_confidences=True, returns
+        (faces, confidences) instead.
+        """
         height, width = image.shape[:2]
         
+        if self.tile_size and max(height, width) > self.tile_size:
+            faces, confidences = self._detect_tiled(image, confidence_threshold)
+        else:
+            detections = self._run_detector(image)
+            
+            with self._stage("detect_parse"):
+                faces, confidences = self._parse_detections(detections[0, 0], width, height,
+                                                            confidence_threshold)
+                faces, confidences = self._select_faces(faces, confidences, confidence_threshold)
+        
+        return (faces, confidences) if return_confidences else faces
+    
+    def _detector_input(self, image):
+        """Pad an image to a square with the mean colour when letterboxing"""
+        if not self.letterbox:
+            return image
+        
+        height, width = image.shape[:2]
+        side = max(height, width)
+        
+        return cv2.copyMakeBorder(image, 0, side - height, 0, side - width,
+                                  cv2.BORDER_CONSTANT, value=FACE_MODEL_MEAN_VALUES)
+    
+    def _run_detector(self, image):
+        """Run the face detector on one image and return its raw output"""
+        size = (self.detector_size, self.detector_size)
+        
         # Create blob from image
-        blob = cv2.dnn.blobFromImage(image, 1.0, (300, 300), [104, 117, 123])
+        with self._stage("detect_blob"):
+            blob = cv2.dnn.blobFromImage(self._detector_input(image), 1.0, size,
+                                         FACE_MODEL_MEAN_VALUES)
+        
+        return self._forward_detector(blob)
+    
+    def _forward_detector(self, blob):
+        """Run the face detector on an NCHW blob
         
+        Returns the detection output, shaped (1, 1, N, 7) with rows of
+        image index, class, confidence and normalized x1, y1, x2, y2.
+        """
         # Set input to the face detection model
         self.face_net.setInput(blob)
         
         # Run forward pass
-        detections = self.face_net.forward()
+        with self._stage("detect_forward"):
+            detections = self.face_net.forward()
+        
+        self._record_layers("face", self.face_net)
+        
+        return detections
+    
+    def _tile_windows(self, width, height):
+        """Yield overlapping (x, y, width, height) tiles covering an image"""
+        tile = self.tile_size
+        step = max(1, int(tile * (1.0 - self.tile_overlap)))
+        
+        # Make sure the last tile in each direction touches the image edge
+        xs = list(range(0, max(1, width - tile), step)) + [max(0, width - tile)]
+        ys = list(range(0, max(1, height - tile), step)) + [max(0, height - tile)]
         
-        faces = []
+        for y in sorted(set(ys)):
+            for x in sorted(set(xs)):
+                yield x, y, min(tile, width - x), min(tile, height - y)
+    
+    def _detect_tiled(self, image, confidence_threshold):
+        """Detect faces on the whole image and on overlapping tiles, merging the results"""
+        height, width = image.shape[:2]
+        
+        all_faces = []
+        all_confidences = []
         
-        # Process detections
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
+        # The whole image finds large faces, the tiles find small ones
+        windows = [(0, 0, width, height)] + list(self._tile_windows(width, height))
+        for x, y, tile_width, tile_height in windows:
+            detections = self._run_detector(image[y:y + tile_height, x:x + tile_width])
+            faces, confidences = self._parse_detections(detections[0, 0], tile_width, tile_height,
+                                                        confidence_threshold)
             
-            if confidence > confidence_threshold:
-                # Get bounding box coordinates
-                x1 = int(detections[0, 0, i, 3] * width)
-                y1 = int(detections[0, 0, i, 4] * height)
-                x2 = int(detections[0, 0, i, 5] * width)
-                y2 = int(detections[0, 0, i, 6] * height)
+            if (tile_width, tile_height) != (width, height):
+                # Faces cut by a tile edge inside the image are left to the
+                # neighbouring tile or the whole-image pass
+                edge = max(2, int(self.tile_size * 0.01))
+                cut = np.zeros(len(faces), dtype=bool)
+                if x > 0:
+                    cut |= faces[:, 0] <= edge
+                if y > 0:
+                    cut |= faces[:, 1] <= edge
+                if x + tile_width < width:
+                    cut |= faces[:, 2] >= tile_width - edge
+                if y + tile_height < height:
+                    cut |= faces[:, 3] >= tile_height - edge
+                faces, confidences = faces[~cut], confidences[~cut]
+            
+            all_faces.append(faces + np.array([x, y, x, y], dtype=np.int32))
+            all_confidences.append(confidences)
+        
+        # Faces seen by several windows are merged by non-maximum suppression
+        nms_threshold = 0.4 if self.nms_threshold is None else self.nms_threshold
+        return self._select_faces(np.concatenate(all_faces), np.concatenate(all_confidences),
+                                  confidence_threshold, nms_threshold)
+    
+    def _parse_detections(self, detections, width, height, confidence_threshold):
+        """Convert rows of raw detector output into face bounding boxes and their scores"""
+        # Keep confident detections only
+        detections = detections[detections[:, 2] > confidence_threshold]
+        confidences = detections[:, 2]
+        
+        # Letterboxed coordinates are relative to the padded square
+        bounds = np.array([width, height, width, height], dtype=np.float32)
+        scale = np.full(4, max(width, height), dtype=np.float32) if self.letterbox else bounds
+        
+        # Scale to pixel coordinates and clip to the image
+        faces = np.clip(detections[:, 3:7] * scale, 0, bounds).astype(np.int32)
+        
+        # Drop boxes that are empty after clipping
+        keep = (faces[:, 2] > faces[:, 0]) & (faces[:, 3] > faces[:, 1])
+        
+        return faces[keep], confidences[keep]
+    
+    def _select_faces(self, faces, confidences, confidence_threshold, nms_threshold=None):
+        """Apply non-maximum suppression and the top-K limit, best faces first"""
+        if nms_threshold is None:
+            nms_threshold = self.nms_threshold
+        
+        if nms_threshold is not None and len(faces) > 1:
+            # NMSBoxes expects x, y, width, height and returns indices best first
+            rects = np.column_stack([faces[:, :2], faces[:, 2:] - faces[:, :2]])
+            keep = cv2.dnn.NMSBoxes(rects.tolist(), confidences.tolist(),
+                                    confidence_threshold, nms_threshold)
+            keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+            faces, confidences = faces[keep], confidences[keep]
+        else:
+            order = np.argsort(-confidences, kind='stable')
+            faces, confidences = faces[order], confidences[order]
+        
+        if self.top_k is not None:
+            faces, confidences = faces[:self.top_k], confidences[:self.top_k]
+        
+        return faces, confidences
+    
+    def detect_faces_batch(self, images, confidence_threshold=0.7, return_confidences=False):
+        """Detect faces in several images with a single detector forward pass
+        
+        Returns one list of faces per image, or one (faces, confidences) tuple
+        per image with return_confidences=True.
+        """
+        # Tiled detection needs several forward passes per image anyway
+        if self.batched_detection and images and not self.tile_size:
+            try:
+                # Stack all images into one blob
+                size = (self.detector_size, self.detector_size)
+                with self._stage("detect_blob"):
+                    blob = cv2.dnn.blobFromImages([self._detector_input(image) for image in images],
+                                                  1.0, size, FACE_MODEL_MEAN_VALUES)
+                detections = self._forward_detector(blob)[0, 0]
+            except cv2.error:
+                # Some OpenCV builds cannot run the detector graph with a batch
+                # size above one, so detect image by image from now on
+                print("Batched face detection not supported, falling back to per-image detection")
+                self.batched_detection = False
+            else:
+                # The first column of each detection holds the index of its image
+                faces_per_image = []
+                for index, image in enumerate(images):
+                    height, width = image.shape[:2]
+                    rows = detections[detections[:, 0] == index]
+                    faces, confidences = self._parse_detections(rows, width, height,
+                                                                confidence_threshold)
+                    faces, confidences = self._select_faces(faces, confidences,
+                                                            confidence_threshold)
+                    faces_per_image.append((faces, confidences) if return_confidences else faces)
                 
-                faces.append([x1, y1, x2, y2])
+                return faces_per_image
         
-        return faces
+        return [self.detect_faces(image, confidence_threshold, return_confidences)
+                for image in images]
     
     def predict_age(self, face_image):
         """Predict age for a detected face"""
-        # Create blob from face image
-        blob = cv2.dnn.blobFromImage(face_image, 1.0, (227, 227), 
-                                   (78.4263377603, 87.7689143744, 114.895847746), 
-                                   swapRB=False)
+        predicted_age, confidence, _ = self.predict_ages([face_image])[0]
+        
+        return predicted_age, confidence
+    
+    def predict_ages(self, face_images, batch_size=None, return_embeddings=False):
+        """Predict ages for several faces, batching them into as few forward passes as possible
+        
+        Returns a list of (age range, confidence, probability vector) tuples,
+        one per input face and in the same order. With return_embeddings=True,
+        returns (predictions, embeddings) where embeddings holds one face
+        descriptor row per face, taken from the same forward passes.
+        """
+        if batch_size is None:
+            batch_size = self.max_batch_size
+        batch_size = max(1, int(batch_size))
+        
+        results = []
+        embeddings = []
         
+        for start in range(0, len(face_images), batch_size):
+            batch = face_images[start:start + batch_size]
+            
+            # Write the whole batch into one NCHW blob
+            with self._stage("age_blob"):
+                blob = self._age_blob(batch)
+            
+            if return_embeddings:
+                age_preds, batch_embeddings = self._forward_age_embeddings(blob)
+                embeddings.append(batch_embeddings.reshape(len(batch), -1))
+            else:
+                age_preds = self._forward_age(blob)
+            
+            # Get predicted age range for each face
+            for preds in age_preds:
+                age_index = preds.argmax()
+                results.append((self.age_ranges[age_index], preds[age_index], preds))
+        
+        if return_embeddings:
+            return results, (np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32))
+        
+        return results
+    
+    def _age_blob(self, face_images):
+        """Resize and mean-subtract faces into the reused age network input
+        
+        Matches cv2.dnn.blobFromImages(faces, 1.0, (227, 227), mean) without
+        allocating a new blob for every batch. The returned view is only
+        valid until the next call.
+        """
+        count = len(face_images)
+        if self._age_input is None or len(self._age_input) < count:
+            self._age_input = np.empty((count, 3) + AGE_INPUT_SIZE, dtype=np.float32)
+        
+        blob = self._age_input[:count]
+        for face, plane in zip(face_images, blob):
+            resized = cv2.resize(face, AGE_INPUT_SIZE, dst=self._age_resized)
+            np.subtract(resized.transpose(2, 0, 1), AGE_MEAN_CHW, out=plane)
+        
+        return blob
+
+    def _forward_age(self, blob):
+        """Run the age network on an NCHW blob of faces and return one probability row per face"""
         # Set input to age prediction model
         self.age_net.setInput(blob)
         
         # Run forward pass
-        age_preds = self.age_net.forward()
+        with self._stage("age_forward"):
+            age_preds = self.age_net.forward()
         
-        # Get predicted age range
-        age_index = age_preds[0].argmax()
-        predicted_age = self.age_ranges[age_index]
-        confidence = age_preds[0][age_index]
+        self._record_layers("age", self.age_net)
         
-        return predicted_age, confidence
+        return age_preds
+    
+    def _forward_age_embeddings(self, blob):
+        """Run the age network and return its probabilities and face descriptors"""
+        outputs = [EMBEDDING_LAYER, self.age_net.getUnconnectedOutLayersNames()[0]]
+        
+        self.age_net.setInput(blob)
+        
+        with self._stage("age_forward"):
+            embeddings, age_preds = self.age_net.forward(outputs)
+        
+        self._record_layers("age", self.age_net)
+        
+        return age_preds, embeddings
+    
+    def predict(self, image, confidence_threshold=0.7):
+        """Detect faces and predict their ages without drawing or copying the image
+        
+        Returns a list of FaceResult, one per detected face.
+        """
+        return self.predict_batch([image], confidence_threshold)[0]
+    
+    def predict_encoded(self, data, confidence_threshold=0.7, reduced_decode=False):
+        """Decode JPEG/PNG bytes and run predict() on them
+        
+        data is decoded in place (see decode_image). With reduced_decode=True,
+        large JPEGs are decoded at 1/2, 1/4 or 1/8 resolution as long as their
+        shorter side stays at least detector_size; faces are then cropped from
+        the smaller image too, so small faces lose detail. Boxes are always
+        in full-resolution pixels. Returns None if the data can't be decoded.
+        """
+        scale = reduced_scale(data, self.detector_size) if reduced_decode else 1
+        
+        with self._stage("decode"):
+            image = decode_image(data, scale)
+        
+        if image is None:
+            return None
+        
+        results = self.predict(image, confidence_threshold)
+        return scale_results(results, scale, decoded_size(data, image, scale))
+
+    def predict_batch(self, images, confidence_threshold=0.7):
+        """Run predict() on several images, batching both networks
+        
+        Returns one list of FaceResult per image, in the same order.
+        """
+        detections = self.detect_faces_batch(images, confidence_threshold, return_confidences=True)
+        
+        # Gather face regions from every image
+        owners = []
+        face_images = []
+        for index, (image, (faces, confidences)) in enumerate(zip(images, detections)):
+            for box, confidence in zip(faces, confidences):
+                x1, y1, x2, y2 = box.tolist()
+                face = image[y1:y2, x1:x2]
+                
+                if face.size == 0:
+                    continue
+                
+                owners.append((index, (x1, y1, x2, y2), float(confidence)))
+                face_images.append(face)
+        
+        # Predict ages for every face at once
+        if self.face_index is None:
+            predictions = self.predict_ages(face_images)
+            identities = [None] * len(predictions)
+        else:
+            predictions, embeddings = self.predict_ages(face_images, return_embeddings=True)
+            identities = self._assign_identities(predictions, embeddings)
+        
+        results = [[] for _ in images]
+        for (index, box, confidence), (predicted_age, _, probs), identity in zip(owners, predictions, identities):
+            results[index].append(FaceResult(box, confidence, int(probs.argmax()),
+                                             predicted_age, probs, identity,
+                                             self._identity_age_range(identity)))
+        
+        return results
+    
+    def _assign_identities(self, predictions, embeddings):
+        """Record faces in the face index and return the identity of each face"""
+        with self._stage("face_index"):
+            self._calibrate_face_index()
+            return self.face_index.assign(embeddings, [probs for _, _, probs in predictions])
+    
+    def _calibrate_face_index(self):
+        """Calibrate a new, uncalibrated face index on the bundled sample faces
+        
+        Without a fitted mean the index centers descriptors on the running
+        mean of the faces it has seen, which is unreliable for the first
+        faces. Calibration is attempted once per index.
+        """
+        index = self.face_index
+        if index is self._calibrated_index or index.mean is not None or len(index):
+            return
+        
+        self._calibrated_index = index
+        
+        embeddings, owners = calibration_descriptors(self, CALIBRATION_IMAGES)
+        try:
+            index.calibrate(embeddings, owners)
+        except ValueError:
+            print("Warning: Could not calibrate the face index on the sample images, "
+                  "using the running mean of the faces seen")
+    
+    def _identity_age_range(self, identity):
+        """Most likely age range over every face of an identity, or None"""
+        if identity is None:
+            return None
+        
+        probs = self.face_index.age_probabilities(identity)
+        return None if probs is None else self.age_ranges[probs.argmax()]
+    
+    def annotate(self, image, results, in_place=True):
+        """Draw face boxes and age labels for predict() results onto an image"""
+        with self._stage("draw"):
+            if not in_place:
+                image = image.copy()
+            
+            for result in results:
+                self._draw_face(image, result.box, result.age_range)
+        
+        return image
+    
+    def _model_keys(self):
+        """Registry keys identifying the model files in use"""
+        return [self.registry.key("tensorflow", self.face_model, self.face_proto),
+                self.registry.key("caffe", self.age_model, self.age_proto)]
+    
+    def _model_sources(self):
+        """Model sources and loaded nets; the model keys change only when one of these does"""
+        return (self.face_model, self.face_proto, self.age_model, self.age_proto,
+                self._face_net, self._age_net)
+    
+    def _model_keys_cached(self):
+        """_model_keys(), recomputed only when the models or the loaded nets change
+        
+        Buffer-loaded models are identified by hashing their contents, which
+        is far too slow to repeat for every cache lookup.
+        """
+        sources = self._model_sources()
+        cached = self._model_version
+        
+        if cached is None or any(old is not new for old, new in zip(cached[0], sources)):
+            cached = self._model_version = (sources, self._model_keys())
+        
+        return cached[1]
+    
+    def result_version(self, confidence_threshold=0.7):
+        """Identify the models and settings that determine predict() results"""
+        settings = [type(self).__name__, *self._model_keys_cached(), self.detector_size, self.letterbox,
+                    self.tile_size, self.tile_overlap, self.nms_threshold, self.top_k,
+                    self.backend, self.target, confidence_threshold]
+        
+        return "|".join(str(setting) for setting in settings)
+    
+    def _read_image(self, image_path, confidence_threshold=0.7):
+        """Read an image and look up its cached results
+        
+        Returns (image, results, key). results is None unless the result
+        cache holds them, and key is None when caching is disabled. image is
+        None if the file can't be read.
+        """
+        # Identities depend on the faces seen so far, not only on the image,
+        # so results are not cached while a face index is in use
+        if self.result_cache is None or self.face_index is not None:
+            with self._stage("imread"):
+                return cv2.imread(image_path), None, None
+        
+        # The encoded bytes are needed for the key, so decode them directly
+        with self._stage("imread"):
+            try:
+                with open(image_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None, None, None
+            
+            image = decode_image(data)
+        
+        if image is None:
+            return None, None, None
+        
+        with self._stage("cache_lookup"):
+            key = content_key(data, self.result_version(confidence_threshold))
+            results = self.result_cache.get(key)
+        
+        return image, results, key
+    
+    def _identity_label(self, result):
+        """Suffix naming a face's identity in printed results"""
+        if result.identity is None:
+            return ""
+        
+        return f" [person {result.identity}, {result.identity_age_range} over all of their faces]"
     
     def process_image(self, image_path):
-        """Process a single image for age prediction"""
+        """Process a single image for age prediction
+        
+        With a result cache, images seen before skip both networks.
+        """
         # Read image
-        image = cv2.imread(image_path)
+        image, results, key = self._read_image(image_path)
         
         if image is None:
             print(f"Error: Could not load image from {image_path}")
             return None
         
-        # Make a copy for display
-        result_image = image.copy()
-        
-        # Detect faces
-        faces = self.detect_faces(image)
+        # Detect faces and predict ages
+        if results is None:
+            results = self.predict(image)
+            
+            if key is not None:
+                self.result_cache.put(key, results)
+                self.result_cache.flush()
         
-        if not faces:
+        if not results:
             print("No faces detected in the image")
-            return result_image
+            return image
         
-        print(f"Detected {len(faces)} face(s)")
+        print(f"Detected {len(results)} face(s)")
         
-        # Process each detected face
-        for i, (x1, y1, x2, y2) in enumerate(faces):
-            # Extract face region
-            face = image[y1:y2, x1:x2]
-            
-            if face.size == 0:
-                continue
+        for i, result in enumerate(results):
+            print(f"Face {i+1}: Predicted age range: {result.age_range} "
+                  f"(confidence: {result.age_confidence:.2f}){self._identity_label(result)}")
+        
+        # The image was only read for this call, so draw on it directly
+        return self.annotate(image, results)
+    
+    def predict_files(self, image_paths, confidence_threshold=0.7):
+        """Read several images and run predict() on them in one batch
+        
+        Returns one (image, results) pair per path, in the same order, with
+        (None, None) for images that could not be loaded. With a result
+        cache, only images that miss it go through the networks, and repeats
+        of the same image run once.
+        """
+        images = []
+        results = []
+        keys = []
+        for image_path in image_paths:
+            image, image_results, key = self._read_image(image_path, confidence_threshold)
             
-            # Predict age
-            predicted_age, confidence = self.predict_age(face)
+            images.append(image)
+            results.append(image_results)
+            keys.append(key)
+        
+        # Detect faces and predict ages for all uncached images at once
+        missing = {}
+        for index, image in enumerate(images):
+            if image is not None and results[index] is None:
+                missing.setdefault(keys[index] or index, []).append(index)
+        
+        indices = list(missing.values())
+        predictions = self.predict_batch([images[group[0]] for group in indices], confidence_threshold)
+        
+        for group, image_results in zip(indices, predictions):
+            for index in group:
+                results[index] = image_results
             
-            # Draw bounding box
-            cv2.rectangle(result_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            if keys[group[0]] is not None:
+                self.result_cache.put(keys[group[0]], image_results)
+        
+        # One commit for the whole batch
+        if self.result_cache is not None:
+            self.result_cache.flush()
+        
+        return list(zip(images, results))
+    
+    def iter_predictions(self, image_paths, confidence_threshold=0.7, prefetch=8, workers=2):
+        """Yield (path, results) for many images while holding only a few at a time
+        
+        Images are read and decoded at reduced size on background threads,
+        at most prefetch at once, and only their faces are kept at full
+        detail (see image_stream.iter_predictions). Results are yielded as
+        images finish, with None for images that can't be read.
+        """
+        # Imported here because image_stream builds on this module
+        from image_stream import iter_predictions
+        
+        return iter_predictions(self, image_paths, confidence_threshold, prefetch, workers)
+    
+    def process_batch(self, image_paths, batch_size=8):
+        """Process many images, batching both face detection and age prediction
+        
+        Returns one annotated image per path, in the same order, with None
+        for images that could not be loaded or processed. With a result
+        cache, only images that miss it go through the networks. If a batch
+        fails, its images are retried one at a time so one bad file doesn't
+        lose the others.
+        """
+        batch_size = max(1, int(batch_size))
+        annotated = []
+        
+        for start in range(0, len(image_paths), batch_size):
+            paths = image_paths[start:start + batch_size]
             
-            # Add age prediction text
-            label = f"Age: {predicted_age}"
-            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
+            predictions = self._predict_files_safe(paths)
             
-            # Draw background rectangle for text
-            cv2.rectangle(result_image, (x1, y1 - label_size[1] - 10), 
-                         (x1 + label_size[0], y1), (0, 255, 0), -1)
+            for image_path, (image, image_results) in zip(paths, predictions):
+                if image is None:
+                    if image_results is None:
+                        print(f"Error: Could not load image from {image_path}")
+                    annotated.append(None)
+                    continue
+                
+                print(f"{image_path}: Detected {len(image_results)} face(s)")
+                
+                for result in image_results:
+                    print(f"{image_path}: Predicted age range: {result.age_range} "
+                          f"(confidence: {result.age_confidence:.2f}){self._identity_label(result)}")
+                
+                # The image was only read for this call, so draw on it directly
+                annotated.append(self.annotate(image, image_results))
+        
+        return annotated
+    
+    def _predict_files_safe(self, image_paths, confidence_threshold=0.7):
+        """predict_files() that retries a failing batch one image at a time
+        
+        Returns the same (image, results) pairs, except that an image that
+        raised gets (None, exception), so callers can tell it apart from one
+        that could not be loaded and report why it failed.
+        """
+        try:
+            return self.predict_files(image_paths, confidence_threshold)
+        except Exception as e:
+            print(f"Error: Batch failed ({e}), processing its images one at a time")
+        
+        return [self._predict_file(image_path, confidence_threshold) for image_path in image_paths]
+    
+    def _predict_file(self, image_path, confidence_threshold=0.7):
+        """predict_files() for a single path, returning (None, exception) if it raises"""
+        try:
+            return self.predict_files([image_path], confidence_threshold)[0]
+        except Exception as e:
+            print(f"Error: Could not process {image_path}: {e}")
+            return None, e
+    
+    def _draw_face(self, image, box, predicted_age):
+        """Draw a face bounding box and its age label onto an image"""
+        x1, y1, x2, y2 = box
+        
+        # Draw bounding box
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        
+        # Add age prediction text
+        label = f"Age: {predicted_age}"
+        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)[0]
+        
+        # Draw background rectangle for text
+        cv2.rectangle(image, (x1, y1 - label_size[1] - 10), 
+                     (x1 + label_size[0], y1), (0, 255, 0), -1)
+        
+        # Draw text
+        cv2.putText(image, label, (x1, y1 - 5), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    
+    def _draw_video_face(self, frame, box, predicted_age):
+        """Draw a lightweight face box and age label onto a video frame"""
+        x1, y1, x2, y2 = box
+        
+        # Draw bounding box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        
+        # Add age prediction text
+        label = f"Age: {predicted_age}"
+        cv2.putText(frame, label, (x1, y1 - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    
+    def _crop_faces(self, image, faces):
+        """Extract the non-empty face regions of an image along with their boxes"""
+        boxes = []
+        face_images = []
+        for x1, y1, x2, y2 in faces:
+            face = image[y1:y2, x1:x2]
             
-            # Draw text
-            cv2.putText(result_image, label, (x1, y1 - 5), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+            if face.size == 0:
+                continue
             
-            print(f"Face {i+1}: Predicted age range: {predicted_age} (confidence: {confidence:.2f})")
+            boxes.append((x1, y1, x2, y2))
+            face_images.append(face)
         
-        return result_image
+        return boxes, face_images
     
-    def process_video(self, video_path=0):
-        """Process video stream for real-time age prediction"""
+    def process_video(self, video_path=0, pipeline=False, detect_every=1, age_every=1,
+                      output_path=None, results_path=None, display=True,
+                      target_fps=None, latency_budget=None):
+        """Process video stream for real-time age prediction
+        
+        With pipeline=True, capture, detection, age prediction and display run
+        on separate threads (see video_pipeline.VideoPipeline). The pipeline
+        detects faces in every frame, so detect_every and age_every are ignored.
+        
+        With detect_every or age_every above one, faces are tracked across
+        frames (see face_tracker.FaceTracker). Faces are only detected every
+        detect_every frames, and each tracked face has its age re-predicted
+        every age_every frames and smoothed over time.
+        
+        Annotated frames can be written to output_path and per-frame results
+        to results_path as JSON Lines; set display=False to run headless.
+        
+        With target_fps or latency_budget (seconds per frame), processing
+        follows the source clock: late frames are dropped and detection and
+        age prediction are made cheaper while frames exceed the budget (see
+        realtime_scheduler.RealtimeScheduler).
+        
+        Returns a throughput summary (see video_output.VideoOutput.close),
+        with the real-time summary under "realtime" when scheduling is on.
+        """
+        if pipeline and (detect_every > 1 or age_every > 1):
+            print("Face tracking (detect_every/age_every) is not supported with the pipeline, ignoring it")
+        
+        if pipeline and (target_fps or latency_budget):
+            print("Real-time scheduling is not supported with the pipeline, ignoring it")
+            target_fps = latency_budget = None
+        
+        if pipeline:
+            return VideoPipeline(self, output_path=output_path, results_path=results_path,
+                                 display=display).run(video_path)
+        
         cap = cv2.VideoCapture(video_path)
         
         if not cap.isOpened():
             print("Error: Could not open video source")
-            return
+            return None
         
-        print("Press 'q' to quit")
+        source_fps = cap.get(cv2.CAP_PROP_FPS)
+        output = VideoOutput(output_path, results_path, display, fps=source_fps)
         
-        while True:
-            ret, frame = cap.read()
-            
-            if not ret:
-                break
+        if display:
+            print("Press 'q' to quit")
+        
+        tracker = None
+        scheduler = None
+        detector_size = self.detector_size
+        
+        if target_fps or latency_budget:
+            # Imported here because realtime_scheduler builds on this module
+            from realtime_scheduler import RealtimeScheduler, print_realtime_summary
             
-            # Detect faces
-            faces = self.detect_faces(frame)
+            # The scheduler adapts the tracker, so real-time mode always tracks
+            tracker = FaceTracker(self, detect_every=detect_every, age_every=age_every)
+            scheduler = RealtimeScheduler(self, tracker, target_fps, latency_budget, source_fps)
+            frames = scheduler.frames(cap)
+        else:
+            if detect_every > 1 or age_every > 1:
+                tracker = FaceTracker(self, detect_every=detect_every, age_every=age_every)
+            frames = self._read_frames(cap)
+        
+        for index, frame in frames:
+            faces = []
             
-            # Process each detected face
-            for x1, y1, x2, y2 in faces:
-                # Extract face region
-                face = frame[y1:y2, x1:x2]
-                
-                if face.size == 0:
-                    continue
-                
-                # Predict age
-                predicted_age, confidence = self.predict_age(face)
-                
-                # Draw bounding box
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                
-                # Add age prediction text
-                label = f"Age: {predicted_age}"
-                cv2.putText(frame, label, (x1, y1 - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            if tracker is not None:
+                # Follow faces between detector runs, reusing their cached ages
+                for track in tracker.update(frame):
+                    predicted_age, confidence, _ = track.age
+                    faces.append((track.box, predicted_age, confidence, track.track_id))
+            else:
+                # Detect faces and predict ages for all of them at once
+                for result in self.predict(frame):
+                    faces.append((result.box, result.age_range, result.age_confidence, None))
             
-            # Display frame
-            cv2.imshow('Age Prediction', frame)
+            # Draw only when the annotated frame is shown or saved
+            if output.needs_frames:
+                with self._stage("draw"):
+                    for box, predicted_age, _, _ in faces:
+                        self._draw_video_face(frame, box, predicted_age)
             
-            # Break on 'q' key press
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if not output.write(index, frame, faces):
                 break
         
         cap.release()
-        cv2.destroyAllWindows()
+        summary = output.close()
+        
+        if scheduler is not None:
+            summary["realtime"] = scheduler.summary()
+            print_realtime_summary(summary["realtime"])
+            
+            # The scheduler may have shrunk the detector for this stream only
+            self.detector_size = detector_size
+        
+        return summary
+    
+    def process_streams(self, sources, output_path=None, results_path=None, display=True,
+                        confidence_threshold=0.7):
+        """Process several video sources at once with shared, batched inference
+        
+        Every round takes the newest frame of each source and runs them
+        through both networks together (see multi_stream.MultiStreamProcessor).
+        Stream i writes to output_path and results_path with -i inserted
+        before the extension. Returns per-stream and overall summaries.
+        """
+        return MultiStreamProcessor(self, output_path, results_path, display,
+                                    confidence_threshold).run(sources)
+    
+    def _read_frames(self, cap):
+        """Yield (index, frame) for every frame of a capture"""
+        index = 0
+        
+        while True:
+            with self._stage("video_read"):
+                ret, frame = cap.read()
+            
+            if not ret:
+                return
+            
+            yield index, frame
+            index += 1
+
+def create_predictor(engine="opencv", **options):
+    """Create a predictor running on the given inference engine
+    
+    "opencv" uses cv2.dnn. "onnx" runs the models written by export_onnx.py
+    on ONNX Runtime, and "onnx-int8" does the same with the INT8 age model
+    written by quantize_age_model.py.
+    """
+    if engine in ("onnx", "onnx-int8"):
+        # Imported here because onnx_predictor builds on this module
+        from onnx_predictor import OnnxAgePredictor
+        
+        if engine == "onnx-int8":
+            from quantize_age_model import AGE_INT8_ONNX
+            options.setdefault("age_onnx", AGE_INT8_ONNX)
+        
+        return OnnxAgePredictor(**options)
+    
+    return AgePredictor(**options)
+
+def is_result_image(image_path):
+    """Whether a file is an annotated image written by this program"""
+    return os.path.basename(image_path).startswith(RESULT_PREFIX)
+
+def find_image_files(directory=".", include_results=False):
+    """Find all image files in a directory, sorted by name
+    
+    Annotated results written by an earlier run are skipped unless
+    include_results is set, so re-running on a folder doesn't process them.
+    """
+    image_files = set()
+    
+    for ext in IMAGE_EXTENSIONS:
+        image_files.update(glob.glob(os.path.join(directory, ext)))
+        image_files.update(glob.glob(os.path.join(directory, ext.upper())))
+    
+    if not include_results:
+        image_files = {path for path in image_files if not is_result_image(path)}
+    
+    return sorted(image_files)
+
+def result_path(image_path, output_dir):
+    """Build the output path for the annotated version of an image"""
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir, f"{RESULT_PREFIX}{name}.jpg")
+
+# Per-process predictor used by ParallelAgePredictor workers
+_worker_predictor = None
+
+def _init_worker(predictor_options, threads_per_worker):
+    """Load the models once when a worker process starts"""
+    global _worker_predictor
+    
+    # Keep workers from oversubscribing the available cores
+    cv2.setNumThreads(threads_per_worker)
+    
+    predictor = create_predictor(**predictor_options)
+    
+    if predictor.load_models():
+        _worker_predictor = predictor
+
+def _process_chunk(task):
+    """Process a chunk of image paths inside a worker process"""
+    image_paths, batch_size, output_dir = task
+    
+    if _worker_predictor is None:
+        return [None] * len(image_paths)
+    
+    results = _worker_predictor.process_batch(image_paths, batch_size)
+    
+    if output_dir is None:
+        return results
+    
+    # Save results in the worker instead of sending images back
+    saved = []
+    for image_path, result in zip(image_paths, results):
+        if result is None:
+            saved.append(None)
+            continue
+        
+        output_path = result_path(image_path, output_dir)
+        cv2.imwrite(output_path, result)
+        saved.append(output_path)
+    
+    return saved
+
+class ParallelAgePredictor:
+    """Spread image processing across a pool of worker processes
+    
+    cv2.dnn nets cannot be shared between threads, so every worker loads its
+    own AgePredictor once and keeps it for the lifetime of the pool.
+    """
+    
+    def __init__(self, workers=None, threads_per_worker=None, **predictor_options):
+        self.workers = workers or os.cpu_count() or 1
+        
+        # Split the cores evenly between workers by default
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+        
+        # Keyword arguments for the AgePredictor created in each worker
+        self.predictor_options = predictor_options
+        
+        self.pool = None
+    
+    def start(self):
+        """Start the worker processes and load the models in each of them"""
+        if self.pool is None:
+            context = multiprocessing.get_context("spawn")
+            self.pool = context.Pool(self.workers, initializer=_init_worker,
+                                     initargs=(self.predictor_options, self.threads_per_worker))
+        return self
+    
+    def close(self):
+        """Stop the worker processes"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def process_batch(self, image_paths, batch_size=8, output_dir=None):
+        """Process images across all workers, returning results in input order
+        
+        With output_dir set, each worker writes its annotated images there and
+        the saved paths are returned instead of the images themselves.
+        """
+        self.start()
+        
+        batch_size = max(1, int(batch_size))
+        chunks = [image_paths[start:start + batch_size]
+                  for start in range(0, len(image_paths), batch_size)]
+        
+        # imap keeps chunks in submission order
+        results = []
+        tasks = [(chunk, batch_size, output_dir) for chunk in chunks]
+        for chunk_results in self.pool.imap(_process_chunk, tasks):
+            results.extend(chunk_results)
+        
+        return results
+
+def load_face_index(path):
+    """Load a face index file, or start a new index if it doesn't exist yet"""
+    if os.path.exists(path):
+        return FaceIndex.load(path)
+    
+    return FaceIndex()
+
+def save_face_index(face_index, path):
+    """Save a face index and summarize the identities it holds"""
+    face_index.save(path)
+    print(f"{face_index.identities} identities among {sum(face_index.counts)} face(s) "
+          f"saved to {path}")
+
+def report_metrics(predictor, path):
+    """Print a per-stage timing summary and write it to a Prometheus text file"""
+    stats = predictor.stats()
+    
+    print("\nStage timings (ms):")
+    for stage, timing in stats.get("stages", {}).items():
+        print(f"  {stage:<15} n={timing['count']:<6} mean={timing['mean_ms']:8.2f} "
+              f"p50={timing['p50_ms']:8.2f} p95={timing['p95_ms']:8.2f} p99={timing['p99_ms']:8.2f}")
+    
+    for net, layers in stats.get("layers", {}).items():
+        slowest = sorted(layers.items(), key=lambda item: item[1], reverse=True)[:3]
+        print(f"  slowest {net} layers: " +
+              ", ".join(f"{layer} {ms:.2f}" for layer, ms in slowest))
+    
+    if predictor.write_metrics(path):
+        print(f"Metrics saved to {path}")
+
+def autotune_backend(predictor_options, image):
+    """Time every available DNN backend and target on an image and return the fastest
+    
+    Returns a (backend, target) pair, or None if no combination worked.
+    """
+    def make_predictor(backend, target):
+        predictor = create_predictor(**dict(predictor_options, backend=backend, target=target,
+                                            instrument=False))
+        predictor.load_models()
+        return predictor
+    
+    best, results = autotune(make_predictor, image)
+    
+    print("\nBackend self-test:")
+    for result in results:
+        timing = f"{result['median_ms']:8.2f} ms" if result['median_ms'] is not None else "     n/a   "
+        note = f"  ({result['error']})" if result['error'] else ""
+        print(f"  {result['backend']:<10} {result['target']:<12} {timing}{note}")
+    
+    if best is None:
+        print("No backend and target combination could run the models")
+    else:
+        print(f"Using backend {best[0]} with target {best[1]}\n")
+    
+    return best
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        # "age_predictor.py serve ..." runs the HTTP server (see server.py)
+        from server import main as serve_main
+        serve_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(description='Age Prediction using OpenCV')
     parser.add_argument('--image', type=str, help='Path to input image')
     parser.add_argument('--video', type=str, help='Path to input video (use 0 for webcam)')
-    parser.add_argument('--output', type=str, help='Path to save output image')
+    parser.add_argument('--streams', type=str, nargs='+',
+                        help='Several video files, cameras or stream URLs processed together with '
+                             'batched inference; --output and --results get -N added per stream')
+    parser.add_argument('--output', type=str,
+                        help='Path to save output image, annotated video, or directory for --dir results')
+    parser.add_argument('--results', type=str, help='Path to save per-frame video results as JSON Lines')
+    parser.add_argument('--no-display', action='store_true',
+                        help='Do not open a window while processing video')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Maximum number of faces per age network forward pass')
+    parser.add_argument('--nms-threshold', type=float,
+                        help='Suppress overlapping face detections above this IoU')
+    parser.add_argument('--top-k', type=int, help='Keep at most this many faces per image')
+    parser.add_argument('--detector-size', type=int, default=300,
+                        help=f'Face detector input resolution, e.g. 300 or 512 (at least {MIN_DETECTOR_SIZE})')
+    parser.add_argument('--letterbox', action='store_true',
+                        help='Pad images to a square for the face detector instead of stretching them')
+    parser.add_argument('--engine', choices=['opencv', 'onnx', 'onnx-int8'], default='opencv',
+                        help='Run the networks with cv2.dnn or, after export_onnx.py, with ONNX Runtime '
+                             '(onnx-int8 also needs quantize_age_model.py)')
+    parser.add_argument('--backend', choices=list(BACKENDS),
+                        help='DNN backend used to run the networks')
+    parser.add_argument('--target', choices=[name for name, value in TARGETS.items() if value is not None],
+                        help='DNN target device and precision, e.g. cpu or opencl_fp16')
+    parser.add_argument('--threads', type=int, help='Number of threads OpenCV may use')
+    parser.add_argument('--autotune', action='store_true',
+                        help='Time every available backend and target and use the fastest')
+    parser.add_argument('--metrics', type=str,
+                        help='Collect per-stage timings and write them to this file in Prometheus format')
+    parser.add_argument('--cache-mb', type=float,
+                        help=f'Cache results of repeated images in memory, up to this many MB '
+                             f'(default {DEFAULT_CACHE_MB} with --cache-db)')
+    parser.add_argument('--cache-db', type=str,
+                        help='Also keep cached results in this SQLite file across runs')
+    parser.add_argument('--face-index', type=str,
+                        help='Group faces into identities using this index file, created if missing, '
+                             'and report the mean age of each identity (--image and --dir)')
+    parser.add_argument('--tile-size', type=int,
+                        help='Also search images larger than this in overlapping tiles of this size')
+    parser.add_argument('--dir', type=str, help='Directory of images to process')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes for --dir, not combined with --face-index or --metrics')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Run video capture, detection, age prediction and display on separate threads')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='Run the face detector every N video frames and track faces in between')
+    parser.add_argument('--age-every', type=int, default=1,
+                        help='Re-predict the age of each tracked face every N video frames')
+    parser.add_argument('--target-fps', type=float,
+                        help='Process video in real time at this frame rate, dropping late frames and '
+                             'detecting and classifying less often while over budget')
+    parser.add_argument('--latency-budget-ms', type=float,
+                        help='Real-time mode with this per-frame processing budget instead of or '
+                             'as well as --target-fps')
     
     args = parser.parse_args()
     
+    # Worker processes would each keep their own face index and timings
+    if args.dir and args.workers > 1:
+        if args.face_index:
+            parser.error("--face-index needs a single worker, drop --workers")
+        if args.metrics:
+            parser.error("--metrics needs a single worker, drop --workers")
+    
+    # Options shared by every AgePredictor created below
+    predictor_options = {
+        'engine': args.engine,
+        'max_batch_size': args.batch_size,
+        'nms_threshold': args.nms_threshold,
+        'top_k': args.top_k,
+        'detector_size': args.detector_size,
+        'letterbox': args.letterbox,
+        'tile_size': args.tile_size,
+        'instrument': args.metrics is not None,
+        'backend': args.backend,
+        'target': args.target,
+        'threads': args.threads,
+        'cache_mb': args.cache_mb,
+        'cache_db': args.cache_db,
+    }
+    
+    if args.autotune:
+        image = cv2.imread(args.image or AUTOTUNE_IMAGE)
+        
+        if image is None:
+            print("Error: Could not load image for the backend self-test")
+            return
+        
+        best = autotune_backend(predictor_options, image)
+        
+        if best is None:
+            return
+        
+        predictor_options['backend'], predictor_options['target'] = best
+    
+    if args.dir:
+        # Process a whole directory, saving results next to the inputs by default
+        image_files = find_image_files(args.dir)
+        output_dir = args.output or args.dir
+        os.makedirs(output_dir, exist_ok=True)
+        
+        print(f"Found {len(image_files)} image file(s) in {args.dir}")
+        
+        if args.workers > 1:
+            with ParallelAgePredictor(workers=args.workers, **predictor_options) as parallel:
+                saved = parallel.process_batch(image_files, output_dir=output_dir)
+        else:
+            predictor = create_predictor(**predictor_options)
+            
+            if not predictor.load_models():
+                return
+            
+            if args.face_index:
+                predictor.face_index = load_face_index(args.face_index)
+            
+            saved = []
+            for image_path, result in zip(image_files, predictor.process_batch(image_files)):
+                if result is None:
+                    saved.append(None)
+                    continue
+                
+                output_path = result_path(image_path, output_dir)
+                cv2.imwrite(output_path, result)
+                saved.append(output_path)
+            
+            if predictor.result_cache is not None:
+                print_cache_stats(predictor.result_cache)
+            
+            if args.face_index:
+                save_face_index(predictor.face_index, args.face_index)
+            
+            if args.metrics:
+                report_metrics(predictor, args.metrics)
+        
+        print(f"Saved {sum(path is not None for path in saved)} result(s) to {output_dir}")
+        return
+    
     # Initialize age predictor
-    predictor = AgePredictor()
+    predictor = create_predictor(**predictor_options)
     
     # Load models
     if not predictor.load_models():
         return
     
     if args.image:
+        if args.face_index:
+            predictor.face_index = load_face_index(args.face_index)
+        
         # Process single image
         result = predictor.process_image(args.image)
         
+        if args.face_index:
+            save_face_index(predictor.face_index, args.face_index)
+        
         if result is not None:
             # Display result
             cv2.imshow('Age Prediction Result', result)
@@ -215,17 +1477,33 @@ def main():
                 cv2.imwrite(args.output, result)
                 print(f"Result saved to {args.output}")
     
+    elif args.streams:
+        sources = [int(source) if source.isdigit() else source for source in args.streams]
+        predictor.process_streams(sources, output_path=args.output, results_path=args.results,
+                                  display=not args.no_display)
+    
     elif args.video is not None:
         # Process video
         video_source = 0 if args.video == '0' else args.video
-        predictor.process_video(video_source)
+        predictor.process_video(video_source, pipeline=args.pipeline,
+                                detect_every=args.detect_every, age_every=args.age_every,
+                                output_path=args.output, results_path=args.results,
+                                display=not args.no_display, target_fps=args.target_fps,
+                                latency_budget=args.latency_budget_ms / 1000 if args.latency_budget_ms else None)
     
     else:
-        print("Please specify either --image or --video argument")
+        print("Please specify either --image, --dir, --video or --streams argument")
         print("Example usage:")
         print("  python age_predictor.py --image path/to/image.jpg")
+        print("  python age_predictor.py --dir path/to/images --workers 4")
         print("  python age_predictor.py --video 0  # for webcam")
         print("  python age_predictor.py --video path/to/video.mp4")
+        print("  python age_predictor.py --streams cam1.mp4 cam2.mp4 --no-display")
+        print("  python age_predictor.py serve --port 8000  # HTTP server")
+        return
+    
+    if args.metrics:
+        report_metrics(predictor, args.metrics)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
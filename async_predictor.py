@@ -0,0 +1,229 @@
+"""
+asyncio front end for the age predictor
+
+AsyncAgePredictor lets an asyncio service await predictions without
+blocking its event loop. Inference runs on a bounded thread pool where each
+thread owns its own nets, since a cv2.dnn.Net must not be used by two
+threads at once. Faces from requests that arrive within a short window are
+gathered into a single age-net forward pass.
+
+Usage:
+    async with AsyncAgePredictor(workers=2) as predictor:
+        results = await predictor.predict(image, timeout=1.0)
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from age_predictor import FaceResult, create_predictor
+
+class _AgeRequest:
+    """Face crops of one request waiting for the age network"""
+
+    __slots__ = ("faces", "future")
+
+    def __init__(self, faces, future):
+        self.faces = faces
+        self.future = future
+
+class AsyncAgePredictor:
+    """Awaitable AgePredictor with micro-batched age prediction
+
+    workers is the number of inference threads, each with a private
+    predictor created from predictor_options (see create_predictor).
+    max_pending bounds how many predict() calls run at once; further calls
+    wait for a slot. Face crops that arrive within batch_window seconds of
+    each other share one age-net forward pass of up to max_batch_size faces.
+
+    Cancelling a predict() call, or letting its timeout expire, drops its
+    faces from the next age batch. A forward pass that has already started
+    runs to completion and its result is discarded.
+    """
+
+    def __init__(self, workers=2, max_pending=None, batch_window=0.005, max_batch_size=32,
+                 timeout=None, **predictor_options):
+        self.workers = max(1, int(workers))
+        self.max_pending = max_pending or 4 * self.workers
+        self.batch_window = batch_window
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.timeout = timeout
+
+        # Keyword arguments for the predictor created in each thread
+        self.predictor_options = dict(predictor_options, max_batch_size=self.max_batch_size,
+                                      shared_models=False)
+
+        self.executor = None
+        self.local = threading.local()
+        self.requests = None
+        self.pending = None
+        self.batch_slots = None
+        self.batcher = None
+        self.batches = set()
+
+    async def start(self):
+        """Start the inference threads and the age batcher on the running loop"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="age-predictor")
+            self.requests = asyncio.Queue()
+            self.pending = asyncio.Semaphore(self.max_pending)
+
+            # At most one age batch per thread is in flight; while they all are,
+            # new faces keep queueing and the next batch grows
+            self.batch_slots = asyncio.Semaphore(self.workers)
+            self.batcher = asyncio.ensure_future(self._batch_loop())
+
+        return self
+
+    async def close(self):
+        """Stop the batcher and wait for the inference threads to finish"""
+        if self.executor is None:
+            return
+
+        self.batcher.cancel()
+        for task in [self.batcher, *self.batches]:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+        # Fail requests still waiting for a batch
+        while not self.requests.empty():
+            request = self.requests.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("AsyncAgePredictor was closed"))
+
+        executor, self.executor = self.executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _predictor(self):
+        """Predictor owned by the calling inference thread, loaded on first use"""
+        predictor = getattr(self.local, "predictor", None)
+
+        if predictor is None:
+            predictor = create_predictor(**self.predictor_options)
+            if not predictor.load_models():
+                raise RuntimeError("Models are not available")
+            self.local.predictor = predictor
+
+        return predictor
+
+    def _detect(self, image, confidence_threshold):
+        """Detect faces on an inference thread and crop them"""
+        predictor = self._predictor()
+        faces, confidences = predictor.detect_faces(image, confidence_threshold, return_confidences=True)
+
+        boxes = []
+        crops = []
+        for box, confidence in zip(faces, confidences):
+            x1, y1, x2, y2 = box.tolist()
+            face = image[y1:y2, x1:x2]
+
+            if face.size == 0:
+                continue
+
+            boxes.append(((x1, y1, x2, y2), float(confidence)))
+            crops.append(face)
+
+        return boxes, crops
+
+    def _predict_ages(self, faces):
+        """Run one age batch on an inference thread"""
+        return self._predictor().predict_ages(faces)
+
+    async def predict(self, image, confidence_threshold=0.7, timeout=None):
+        """Detect faces and predict their ages without blocking the event loop
+
+        Returns a list of FaceResult, one per detected face. Raises
+        asyncio.TimeoutError if timeout seconds (default: the timeout given to
+        the constructor) pass first.
+        """
+        await self.start()
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return await asyncio.wait_for(self._predict(image, confidence_threshold), timeout)
+
+    async def _predict(self, image, confidence_threshold):
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            boxes, crops = await loop.run_in_executor(self.executor, self._detect,
+                                                      image, confidence_threshold)
+
+            if not crops:
+                return []
+
+            # Hand the faces to the batcher and wait for their ages
+            request = _AgeRequest(crops, loop.create_future())
+            self.requests.put_nowait(request)
+
+            try:
+                predictions = await request.future
+            finally:
+                # Lets the batcher skip the faces of cancelled requests
+                request.future.cancel()
+
+        return [FaceResult(box, confidence, int(probs.argmax()), predicted_age, probs)
+                for (box, confidence), (predicted_age, _, probs) in zip(boxes, predictions)]
+
+    async def _batch_loop(self):
+        """Group queued face crops into age batches and run them"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.requests.get()]
+            count = len(batch[0].faces)
+            deadline = loop.time() + self.batch_window
+
+            # Keep collecting until the window closes or the batch is full
+            while count < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+
+                try:
+                    request = await asyncio.wait_for(self.requests.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+                batch.append(request)
+                count += len(request.faces)
+
+            batch = [request for request in batch if not request.future.done()]
+            if not batch:
+                continue
+
+            await self.batch_slots.acquire()
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def _run_batch(self, batch):
+        """Predict ages for a batch of requests and hand each its own results"""
+        try:
+            faces = [face for request in batch for face in request.faces]
+            loop = asyncio.get_running_loop()
+
+            try:
+                predictions = await loop.run_in_executor(self.executor, self._predict_ages, faces)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                return
+
+            start = 0
+            for request in batch:
+                end = start + len(request.faces)
+                if not request.future.done():
+                    request.future.set_result(predictions[start:end])
+                start = end
+        finally:
+            self.batch_slots.release()
@@ -0,0 +1,131 @@
+"""
+Compare face detector input sizes and tiling on the bundled sample images
+
+Prints a Markdown table with the median detect_faces latency, the recall
+and the number of extra boxes of each configuration. There is no
+hand-labelled ground truth, so a face counts as real when at least half of
+the configurations find it (boxes matching with IoU >= 0.3 count as the
+same face).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from age_predictor import AgePredictor
+from face_tracker import box_iou
+
+SAMPLE_IMAGES = ["sample_person1.jpg", "sample_person3.jpg", "Sunil.png", "Sunbyte.png"]
+
+CONFIGS = [
+    ("300x300", {"detector_size": 300}),
+    ("384x384", {"detector_size": 384}),
+    ("512x512", {"detector_size": 512}),
+    ("640x640", {"detector_size": 640}),
+    ("300x300 letterbox", {"detector_size": 300, "letterbox": True}),
+    ("300x300 + 800px tiles", {"detector_size": 300, "tile_size": 800}),
+]
+
+def load_images():
+    """Load the sample images plus a high-resolution group shot built from them"""
+    images = {}
+    for name in SAMPLE_IMAGES:
+        image = cv2.imread(name)
+
+        if image is not None:
+            images[name] = image
+
+    # Small faces in a large frame: the samples as a 2x2 grid inside a 3200x2400 canvas
+    tiles = [cv2.resize(image, (400, 400)) for image in images.values()][:4]
+    if len(tiles) == 4:
+        grid = np.vstack([np.hstack(tiles[:2]), np.hstack(tiles[2:])])
+        canvas = np.zeros((2400, 3200, 3), dtype=np.uint8)
+        canvas[400:2000, 800:2400] = cv2.resize(grid, (1600, 1600))
+        images["group 3200x2400"] = canvas
+
+    return images
+
+def time_detection(predictor, image, repeats):
+    """Return the median detect_faces latency in milliseconds and the faces found"""
+    faces = predictor.detect_faces(image)
+    timings = []
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictor.detect_faces(image)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return float(np.median(timings)), faces
+
+def matches(reference, faces):
+    """Flag the reference faces that overlap any of the given faces"""
+    if not len(reference) or not len(faces):
+        return np.zeros(len(reference), dtype=bool)
+
+    return box_iou(reference, faces).max(axis=1) >= 0.3
+
+def consensus_faces(face_lists):
+    """Keep the faces found by at least half of the configurations"""
+    candidates = []
+    for faces in face_lists:
+        for face in faces:
+            if not matches([face], candidates).any():
+                candidates.append(face)
+
+    votes = sum(matches(candidates, faces).astype(int) for faces in face_lists)
+
+    return [face for face, count in zip(candidates, np.atleast_1d(votes))
+            if count * 2 >= len(face_lists)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Face detector resolution benchmark')
+    parser.add_argument('--repeats', type=int, default=10, help='Timed runs per image')
+    args = parser.parse_args()
+
+    images = load_images()
+
+    if not images:
+        print("No sample images found. Run this from the repository root.")
+        return
+
+    results = {}
+
+    for label, options in CONFIGS:
+        # Only the face detector is used, and it is loaded once on first use
+        predictor = AgePredictor(**options)
+        results[label] = {name: time_detection(predictor, image, args.repeats)
+                          for name, image in images.items()}
+
+    # Reference faces for each image, agreed on by the configurations
+    reference = {name: consensus_faces([results[label][name][1] for label in results])
+                 for name in images}
+
+    names = list(images)
+    print("| Detector | " + " | ".join(f"{name} (ms)" for name in names) + " | Recall | Extra boxes |")
+    print("|---" * (len(names) + 3) + "|")
+
+    for label in results:
+        found = 0
+        total = 0
+        extra = 0
+        cells = []
+
+        for name in names:
+            latency, faces = results[label][name]
+            cells.append(f"{latency:.1f}")
+
+            total += len(reference[name])
+            found += int(matches(reference[name], faces).sum())
+            extra += int((~matches(faces, reference[name])).sum())
+
+        recall = found / total if total else 0.0
+        print(f"| {label} | " + " | ".join(cells) + f" | {found}/{total} ({recall:.0%}) | {extra} |")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Load generator for the age predictor HTTP server
+
+Sends an image to POST /predict from several concurrent clients for a fixed
+duration, then reports throughput and latency percentiles. Each client
+keeps one HTTP/1.1 connection open, so connection setup is not measured.
+
+Usage:
+    python age_predictor.py serve --port 8000 --workers 2
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 8 --duration 20
+"""
+
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def client(url, body, deadline, latencies, errors, lock):
+    """Send requests back to back until the deadline, recording each latency"""
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+    headers = {"Content-Type": "application/octet-stream"}
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+
+        try:
+            connection.request("POST", "/predict", body, headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            ok = False
+
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(elapsed)
+
+    connection.close()
+
+def run_load(url, body, concurrency=4, duration=10.0):
+    """Run concurrent clients against a server and summarize the results"""
+    url = urlparse(url)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = [threading.Thread(target=client, args=(url, body, deadline, latencies, errors, lock))
+               for _ in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.asarray(latencies) * 1000
+
+    report = {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "qps": len(latencies) / elapsed,
+    }
+
+    if len(latencies_ms):
+        report.update({
+            "mean_ms": float(latencies_ms.mean()),
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "max_ms": float(latencies_ms.max()),
+        })
+
+    return report
+
+def print_report(report):
+    """Print the load test results"""
+    print(f"\n{report['requests']} request(s), {report['errors']} error(s) in {report['duration_s']:.1f} s "
+          f"with {report['concurrency']} client(s)")
+    print(f"  Throughput: {report['qps']:.1f} requests/s")
+
+    if "p50_ms" in report:
+        print(f"  Latency:    p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms, "
+              f"p99 {report['p99_ms']:.1f} ms, max {report['max_ms']:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the age predictor HTTP server')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='Server base URL')
+    parser.add_argument('--image', type=str, default=os.path.join(ROOT, 'sample_person1.jpg'),
+                        help='Image sent with every request')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4],
+                        help='Number of concurrent clients; several values run one test each')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per test')
+    parser.add_argument('--output', type=str, help='Path to write the reports as JSON')
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body = f.read()
+
+    reports = []
+    for concurrency in args.concurrency:
+        report = run_load(args.url, body, concurrency, args.duration)
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
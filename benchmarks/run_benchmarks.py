@@ -0,0 +1,354 @@
+"""
+Benchmark suite for the age predictor hot paths
+
+Times model loading, face detection, age prediction, whole-image processing
+and video processing on CPU, and writes p50/p95/p99 latency, throughput and
+peak RSS to a JSON file. Everything runs offline: test images and the video
+clip are generated from the bundled sample images, and a random-weight age
+model is used when age_net.caffemodel is missing.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --quick --compare bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from age_predictor import AgePredictor
+from synthetic_models import write_synthetic_age_model
+
+# Sample image whose face is pasted into the generated test images
+FACE_SOURCE = "sample_person3.jpg"
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in megabytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def summarize(name, params, timings, items_per_call=1, unit="calls/s"):
+    """Turn a list of per-call timings in seconds into a result record"""
+    timings_ms = np.asarray(timings) * 1000
+    mean_seconds = float(np.mean(timings))
+
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(timings),
+        "mean_ms": float(timings_ms.mean()),
+        "p50_ms": float(np.percentile(timings_ms, 50)),
+        "p95_ms": float(np.percentile(timings_ms, 95)),
+        "p99_ms": float(np.percentile(timings_ms, 99)),
+        "throughput": items_per_call / mean_seconds if mean_seconds > 0 else 0.0,
+        "throughput_unit": unit,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def measure(function, repeats, warmup=1):
+    """Time repeated calls of function, after some untimed warm-up calls"""
+    for _ in range(warmup):
+        function()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the predictor's progress output while timing"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+class BenchmarkContext:
+    """Model paths and generated inputs shared by all benchmarks"""
+
+    def __init__(self, workdir, synthetic=False):
+        self.workdir = workdir
+
+        self.age_model = os.path.join(ROOT, "age_net.caffemodel")
+        self.synthetic = synthetic or not os.path.exists(self.age_model)
+        if self.synthetic:
+            self.age_model = write_synthetic_age_model(os.path.join(workdir, "age_net_synthetic.caffemodel"))
+
+        self.face = self._load_face()
+
+    def make_predictor(self, **options):
+        """Create an AgePredictor with absolute model paths, without loading it"""
+        predictor = AgePredictor(**options)
+        predictor.face_proto = os.path.join(ROOT, predictor.face_proto)
+        predictor.face_model = os.path.join(ROOT, predictor.face_model)
+        predictor.age_proto = os.path.join(ROOT, predictor.age_proto)
+        predictor.age_model = self.age_model
+        return predictor
+
+    def load_predictor(self, **options):
+        """Create an AgePredictor and load its models"""
+        predictor = self.make_predictor(**options)
+
+        with quiet():
+            if not predictor.load_models():
+                raise RuntimeError("Could not load models")
+
+        return predictor
+
+    def _load_face(self):
+        """Crop a face from a bundled sample image to paste into test images"""
+        image = cv2.imread(os.path.join(ROOT, FACE_SOURCE))
+
+        if image is None:
+            # Fall back to a flat patch; detection then finds nothing
+            return np.full((160, 160, 3), 128, dtype=np.uint8)
+
+        height, width = image.shape[:2]
+        return image[height // 8:height * 7 // 8, width // 8:width * 7 // 8]
+
+    def make_image(self, width, height, faces):
+        """Build a width x height image with a grid of the given number of faces"""
+        image = np.full((height, width, 3), 90, dtype=np.uint8)
+
+        if faces == 0:
+            return image
+
+        columns = int(np.ceil(np.sqrt(faces)))
+        rows = int(np.ceil(faces / columns))
+        cell_width, cell_height = width // columns, height // rows
+        side = int(min(cell_width, cell_height) * 0.9)
+        face = cv2.resize(self.face, (side, side))
+
+        for index in range(faces):
+            row, column = divmod(index, columns)
+            x = column * cell_width + (cell_width - side) // 2
+            y = row * cell_height + (cell_height - side) // 2
+            image[y:y + side, x:x + side] = face
+
+        return image
+
+    def write_image(self, width, height, faces):
+        """Save a generated image and return its path"""
+        path = os.path.join(self.workdir, f"faces{faces}_{width}x{height}.jpg")
+        cv2.imwrite(path, self.make_image(width, height, faces))
+        return path
+
+    def write_video(self, width, height, frames, faces):
+        """Write a short clip with the faces drifting sideways and return its path"""
+        path = os.path.join(self.workdir, f"clip_{width}x{height}.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (width, height))
+        image = self.make_image(width, height, faces)
+
+        for index in range(frames):
+            shift = np.float32([[1, 0, index % 40], [0, 1, 0]])
+            writer.write(cv2.warpAffine(image, shift, (width, height)))
+
+        writer.release()
+        return path
+
+def bench_load_models(context, config):
+    """Time loading both networks from disk, bypassing the shared model cache"""
+    def load():
+        context.load_predictor(shared_models=False)
+
+    return [summarize("load_models", {}, measure(load, config["load_repeats"], warmup=0))]
+
+def bench_detect_faces(context, config):
+    """Time face detection across image sizes"""
+    predictor = context.load_predictor()
+    results = []
+
+    for width, height in config["image_sizes"]:
+        image = context.make_image(width, height, 1)
+        timings = measure(lambda: predictor.detect_faces(image), config["repeats"])
+        results.append(summarize("detect_faces", {"width": width, "height": height},
+                                 timings, unit="images/s"))
+
+    return results
+
+def bench_predict_age(context, config):
+    """Time age prediction for one face and for batches of faces"""
+    predictor = context.load_predictor()
+    face = context.face
+    results = []
+
+    timings = measure(lambda: predictor.predict_age(face), config["repeats"])
+    results.append(summarize("predict_age", {}, timings, unit="faces/s"))
+
+    for batch_size in config["batch_sizes"]:
+        faces = [face] * batch_size
+        timings = measure(lambda: predictor.predict_ages(faces, batch_size), config["repeats"])
+        results.append(summarize("predict_ages", {"batch_size": batch_size}, timings,
+                                 items_per_call=batch_size, unit="faces/s"))
+
+    return results
+
+def bench_process_image(context, config):
+    """Time the full image path, from reading the file to the annotated result"""
+    predictor = context.load_predictor()
+    width, height = config["process_size"]
+    results = []
+
+    for faces in config["face_counts"]:
+        path = context.write_image(width, height, faces)
+
+        with quiet():
+            timings = measure(lambda: predictor.process_image(path), config["repeats"])
+            detected = len(predictor.predict(cv2.imread(path)))
+
+        results.append(summarize("process_image",
+                                 {"width": width, "height": height, "faces": faces,
+                                  "detected": detected},
+                                 timings, unit="images/s"))
+
+    return results
+
+def bench_process_video(context, config):
+    """Time headless video processing of a generated clip"""
+    predictor = context.load_predictor()
+    width, height = config["video_size"]
+    frames = config["video_frames"]
+    path = context.write_video(width, height, frames, 2)
+    results = []
+
+    for detect_every in (1, 5):
+        def run():
+            with quiet():
+                predictor.process_video(path, detect_every=detect_every, display=False)
+
+        timings = measure(run, config["video_repeats"], warmup=0)
+        results.append(summarize("process_video",
+                                 {"width": width, "height": height, "frames": frames,
+                                  "detect_every": detect_every},
+                                 timings, items_per_call=frames, unit="frames/s"))
+
+    return results
+
+BENCHMARKS = {
+    "load_models": bench_load_models,
+    "detect_faces": bench_detect_faces,
+    "predict_age": bench_predict_age,
+    "process_image": bench_process_image,
+    "process_video": bench_process_video,
+}
+
+FULL_CONFIG = {
+    "repeats": 30,
+    "load_repeats": 5,
+    "image_sizes": [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)],
+    "batch_sizes": [1, 4, 16, 32],
+    "face_counts": [1, 4, 16],
+    "process_size": (1280, 720),
+    "video_size": (1280, 720),
+    "video_frames": 60,
+    "video_repeats": 3,
+}
+
+QUICK_CONFIG = {
+    "repeats": 5,
+    "load_repeats": 2,
+    "image_sizes": [(640, 480), (1920, 1080)],
+    "batch_sizes": [1, 8],
+    "face_counts": [1, 4],
+    "process_size": (1280, 720),
+    "video_size": (640, 480),
+    "video_frames": 20,
+    "video_repeats": 1,
+}
+
+def result_key(result):
+    """Identify a result across runs by its benchmark name and parameters"""
+    params = {k: v for k, v in result["params"].items() if k != "detected"}
+    return result["name"], json.dumps(params, sort_keys=True)
+
+def print_results(results, baseline=None):
+    """Print a table of results, with the p50 change against a baseline run"""
+    previous = {}
+    if baseline is not None:
+        previous = {result_key(result): result for result in baseline["results"]}
+
+    for result in results:
+        params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+        line = (f"{result['name']:<14} {params:<48} p50 {result['p50_ms']:9.2f} ms  "
+                f"p95 {result['p95_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+                f"{result['throughput']:8.1f} {result['throughput_unit']}")
+
+        old = previous.get(result_key(result))
+        if old is not None and old["p50_ms"] > 0:
+            change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            line += f"  ({change:+.1f}% p50)"
+
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the age predictor on CPU')
+    parser.add_argument('--output', type=str, help='Path to write results as JSON')
+    parser.add_argument('--compare', type=str, help='Previous results JSON to compare against')
+    parser.add_argument('--quick', action='store_true', help='Fewer repeats and sizes')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Use a random-weight age model even if age_net.caffemodel exists')
+    parser.add_argument('--threads', type=int, help='OpenCV thread count (cv2.setNumThreads)')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    config = QUICK_CONFIG if args.quick else FULL_CONFIG
+
+    with tempfile.TemporaryDirectory() as workdir:
+        context = BenchmarkContext(workdir, synthetic=args.synthetic)
+
+        if context.synthetic:
+            print("Using a synthetic age model; age predictions are meaningless but timings are realistic")
+
+        results = []
+        for name in args.only or BENCHMARKS:
+            print(f"Running {name}...")
+            results.extend(BENCHMARKS[name](context, config))
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "opencv_threads": cv2.getNumThreads(),
+                "synthetic_age_model": context.synthetic,
+                "quick": args.quick,
+            },
+            "results": results,
+        }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print()
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
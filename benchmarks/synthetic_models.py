@@ -0,0 +1,62 @@
+"""
+Synthetic stand-in for the age model used when benchmarking offline
+
+Writes a Caffe model with random weights in the shape that
+age_deploy.prototxt expects, so timings match the real network when
+age_net.caffemodel has not been downloaded. Predictions from it are
+meaningless.
+"""
+
+import numpy as np
+
+# Weight shapes of the learnable layers in age_deploy.prototxt
+AGE_LAYER_SHAPES = {
+    "conv1": (96, 3, 7, 7),
+    "conv2": (256, 96, 5, 5),
+    "conv3": (384, 256, 3, 3),
+    "fc6": (512, 384 * 7 * 7),
+    "fc7": (512, 512),
+    "fc8": (8, 512),
+}
+
+def _varint(value):
+    """Encode an unsigned integer as a protobuf varint"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _field(number, payload):
+    """Encode a length-delimited protobuf field"""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+def _blob(array):
+    """Encode a BlobProto with its shape and float data"""
+    shape = b"".join(_varint(1 << 3) + _varint(dim) for dim in array.shape)
+    return _field(7, shape) + _field(5, array.astype("<f4").tobytes())
+
+def write_synthetic_age_model(path, seed=0):
+    """Write a random-weight Caffe model for age_deploy.prototxt to path"""
+    rng = np.random.default_rng(seed)
+    net = bytearray()
+
+    for name, shape in AGE_LAYER_SHAPES.items():
+        # He initialisation keeps activations in a realistic range
+        fan_in = int(np.prod(shape[1:]))
+        weights = rng.standard_normal(shape).astype(np.float32) * np.sqrt(2.0 / fan_in)
+        bias = np.zeros(shape[0], dtype=np.float32)
+
+        # LayerParameter: name (1) and blobs (7), inside NetParameter.layer (100)
+        layer = _field(1, name.encode()) + _field(7, _blob(weights)) + _field(7, _blob(bias))
+        net += _field(100, layer)
+
+    with open(path, "wb") as f:
+        f.write(net)
+
+    return path
@@ -0,0 +1,123 @@
+"""
+DNN backend and target selection for the age predictor
+
+Maps readable names to the cv2.dnn backend and target constants, lists the
+combinations this OpenCV build supports, and times each of them on the
+real networks so the fastest one can be picked for the host.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+# Inference backends by name
+BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+    "vulkan": cv2.dnn.DNN_BACKEND_VKCOM,
+}
+
+# Inference targets by name; the _fp16 variants run in half precision
+TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "cpu_fp16": getattr(cv2.dnn, "DNN_TARGET_CPU_FP16", None),
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "myriad": cv2.dnn.DNN_TARGET_MYRIAD,
+    "cuda": cv2.dnn.DNN_TARGET_CUDA,
+    "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+    "vulkan": cv2.dnn.DNN_TARGET_VULKAN,
+}
+
+# Largest mean absolute difference in age probabilities from the reference
+# run that still counts as the same result (fp16 targets differ slightly)
+MAX_PROBABILITY_ERROR = 0.02
+
+def available_combinations():
+    """List the (backend, target) name pairs this OpenCV build can run"""
+    target_names = {value: name for name, value in TARGETS.items() if value is not None}
+    combinations = []
+
+    for backend, backend_id in BACKENDS.items():
+        if backend == "default":
+            continue
+
+        try:
+            targets = cv2.dnn.getAvailableTargets(backend_id)
+        except cv2.error:
+            continue
+
+        for target_id in targets:
+            if int(target_id) in target_names:
+                combinations.append((backend, target_names[int(target_id)]))
+
+    return combinations
+
+def configure_net(net, backend=None, target=None):
+    """Set a net's preferable backend and target, given by name"""
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown DNN backend: {backend}")
+        net.setPreferableBackend(BACKENDS[backend])
+
+    if target is not None:
+        if TARGETS.get(target) is None:
+            raise ValueError(f"Unknown or unsupported DNN target: {target}")
+        net.setPreferableTarget(TARGETS[target])
+
+    return net
+
+def autotune(predictor_factory, image, repeats=5, combinations=None):
+    """Time predict() on an image with every backend and target combination
+
+    predictor_factory(backend, target) must return a loaded AgePredictor.
+    The first combination is the reference; any other combination whose age
+    probabilities drift from it by more than MAX_PROBABILITY_ERROR, or that
+    fails to run, is reported but never chosen.
+
+    Returns (best, results) where best is a (backend, target) pair, or None if
+    nothing ran, and results is a list of dicts with the median latency.
+    """
+    if combinations is None:
+        combinations = available_combinations()
+
+    reference = None
+    results = []
+
+    for backend, target in combinations:
+        result = {"backend": backend, "target": target, "median_ms": None, "error": None}
+        results.append(result)
+
+        try:
+            predictor = predictor_factory(backend, target)
+
+            # The first call also compiles the net for the target, so don't time it
+            faces = predictor.predict(image)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                predictor.predict(image)
+                timings.append((time.perf_counter() - start) * 1000)
+        except cv2.error as e:
+            result["error"] = str(e).strip().splitlines()[-1]
+            continue
+
+        result["median_ms"] = float(np.median(timings))
+        probabilities = [face.probabilities for face in faces]
+
+        if reference is None:
+            reference = probabilities
+        elif len(probabilities) != len(reference):
+            result["error"] = "detected a different number of faces"
+        elif probabilities and np.mean(np.abs(np.subtract(probabilities, reference))) > MAX_PROBABILITY_ERROR:
+            result["error"] = "age probabilities differ from the reference"
+
+    valid = [result for result in results if result["error"] is None]
+    if not valid:
+        return None, results
+
+    best = min(valid, key=lambda result: result["median_ms"])
+    return (best["backend"], best["target"]), results
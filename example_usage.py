@@ -51,20 +51,19 @@ def example_batch_processing():
         "image3.jpg"
     ]
     
-    for i, image_path in enumerate(image_paths):
-        print(f"\nProcessing image {i+1}: {image_path}")
-        
-        try:
-            result = predictor.process_image(image_path)
-            
-            if result is not None:
-                # Save result with numbered filename
-                output_path = f"result_{i+1}.jpg"
-                cv2.imwrite(output_path, result)
-                print(f"Result saved as {output_path}")
-                
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}")
+    try:
+        # Images are detected and classified in batches rather than one by one
+        results = predictor.process_batch(image_paths, batch_size=8)
+    except Exception as e:
+        print(f"Error processing images: {e}")
+        return
+    
+    for i, (image_path, result) in enumerate(zip(image_paths, results)):
+        if result is not None:
+            # Save result with numbered filename
+            output_path = f"result_{i+1}.jpg"
+            cv2.imwrite(output_path, result)
+            print(f"Result saved as {output_path} ({image_path})")
 
 def example_webcam_processing():
     """Example of real-time webcam processing"""
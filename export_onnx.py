@@ -0,0 +1,563 @@
+"""
+Convert the face detector and the age network to ONNX
+
+The network structure is read from the OpenCV text graph
+(opencv_face_detector.pbtxt) and the Caffe prototxt (age_deploy.prototxt),
+and the weights from the nets as loaded by cv2.dnn, so neither TensorFlow
+nor Caffe is needed. Both models get a dynamic batch dimension; the detector
+also accepts any input height and width.
+
+ONNX has no equivalent of the SSD PriorBox and DetectionOutput layers, so the
+exported detector stops at the box regressions and class scores. The prior
+box and detection output settings are stored in the model metadata, and
+onnx_predictor.OnnxAgePredictor decodes the detections with NumPy.
+
+Usage:
+    python export_onnx.py                      # writes face_detector.onnx and age_net.onnx
+    python export_onnx.py --check              # also compares them with cv2.dnn
+"""
+
+import argparse
+import json
+import re
+
+import cv2
+import numpy as np
+
+from face_index import EMBEDDING_LAYER
+
+try:
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+except ImportError:
+    onnx = None
+
+# Output files written by default
+FACE_ONNX = "face_detector.onnx"
+AGE_ONNX = "age_net.onnx"
+
+# Opset and IR version understood by ONNX Runtime 1.14 and later
+OPSET = 13
+IR_VERSION = 8
+
+_TOKEN = re.compile(r'\s*(?:(#[^\n]*)|("(?:[^"\\]|\\.)*")|([{}:])|([^\s{}:"]+))')
+
+def parse_text_proto(text):
+    """Parse a protobuf text format message into a list of (key, value) pairs
+
+    Nested messages become lists of pairs as well; scalars become str, int,
+    float or bool.
+    """
+    tokens = []
+    for comment, string, symbol, word in _TOKEN.findall(text):
+        if comment:
+            continue
+        if string:
+            tokens.append(("string", string[1:-1]))
+        elif symbol:
+            tokens.append((symbol, symbol))
+        elif word:
+            tokens.append(("word", word))
+
+    def scalar(word):
+        if word in ("true", "false"):
+            return word == "true"
+
+        for convert in (int, float):
+            try:
+                return convert(word)
+            except ValueError:
+                pass
+
+        return word
+
+    def message(position):
+        pairs = []
+
+        while position < len(tokens) and tokens[position][0] != "}":
+            key = tokens[position][1]
+            position += 1
+
+            if tokens[position][0] == ":":
+                position += 1
+
+            kind, value = tokens[position]
+            if kind == "{":
+                value, position = message(position + 1)
+            elif kind == "word":
+                value = scalar(value)
+
+            pairs.append((key, value))
+            position += 1
+
+        return pairs, position
+
+    return message(0)[0]
+
+def _field(message, key, default=None):
+    """First value of a field in a parsed message"""
+    for name, value in message:
+        if name == key:
+            return value
+
+    return default
+
+def _fields(message, key):
+    """All values of a repeated field in a parsed message"""
+    return [value for name, value in message if name == key]
+
+def _attr(node, key, default=None):
+    """Value of a TensorFlow node attribute, unwrapped from its AttrValue"""
+    for attr in _fields(node, "attr"):
+        if _field(attr, "key") != key:
+            continue
+
+        value = _field(attr, "value")
+        if _field(value, "list") is not None:
+            return _fields(_field(value, "list"), "i")
+        if _field(value, "tensor") is not None:
+            tensor = _field(value, "tensor")
+            return _fields(tensor, "float_val") or _fields(tensor, "int_val")
+
+        return value[0][1]
+
+    return default
+
+def _varint(data, position):
+    """Decode a protobuf varint, returning it and the position after it"""
+    result = 0
+    shift = 0
+
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return result, position
+
+def _wire_fields(data):
+    """Yield (field number, value) for each field of an encoded protobuf message"""
+    position = 0
+
+    while position < len(data):
+        key, position = _varint(data, position)
+        number, wire_type = key >> 3, key & 7
+
+        if wire_type == 0:
+            value, position = _varint(data, position)
+        elif wire_type == 1:
+            value, position = data[position:position + 8], position + 8
+        elif wire_type == 2:
+            length, position = _varint(data, position)
+            value, position = data[position:position + length], position + length
+        elif wire_type == 5:
+            value, position = data[position:position + 4], position + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+        yield number, value
+
+def read_int_constants(path):
+    """Read the int32 Const nodes of a binary TensorFlow graph by name
+
+    Some of the detector's shape constants only exist in the .pb file.
+    """
+    constants = {}
+
+    with open(path, "rb") as f:
+        graph = f.read()
+
+    for number, node in _wire_fields(graph):
+        # GraphDef.node is field 1; NodeDef.name is 1, op is 2 and attr is 5
+        if number != 1:
+            continue
+
+        fields = list(_wire_fields(node))
+        if dict(fields).get(2) != b"Const":
+            continue
+
+        name = bytes(dict(fields)[1]).decode()
+        for field_number, attr in fields:
+            if field_number != 5:
+                continue
+
+            attr = dict(_wire_fields(attr))
+            if attr.get(1) != b"value":
+                continue
+
+            # AttrValue.tensor is field 8; TensorProto.dtype is 1 (DT_INT32 = 3),
+            # tensor_content is 4 and int_val is 7
+            tensor = list(_wire_fields(dict(_wire_fields(attr[2]))[8]))
+            if dict(tensor).get(1) != 3:
+                continue
+
+            content = dict(tensor).get(4)
+            if content is not None:
+                values = np.frombuffer(bytes(content), dtype="<i4").tolist()
+            else:
+                values = []
+                for field_number, value in tensor:
+                    if field_number != 7:
+                        continue
+                    if isinstance(value, int):
+                        values.append(value)
+                    else:
+                        packed = 0
+                        while packed < len(value):
+                            item, packed = _varint(value, packed)
+                            values.append(item)
+
+            # Negative int_val entries are stored as 64-bit two's complement
+            constants[name] = [value - (1 << 64) if value >= 1 << 63 else
+                               value - (1 << 32) if value >= 1 << 31 else value for value in values]
+
+    return constants
+
+class _GraphBuilder:
+    """Collects ONNX nodes and initializers while a network is converted"""
+
+    def __init__(self, net):
+        self.net = net
+        self.layer_names = set(net.getLayerNames())
+        self.nodes = []
+        self.initializers = []
+
+    def constant(self, name, array):
+        """Add a weight tensor and return its name"""
+        self.initializers.append(numpy_helper.from_array(np.ascontiguousarray(array), name))
+        return name
+
+    def param(self, layer, index):
+        """Weights of a cv2.dnn layer"""
+        return self.net.getParam(layer, index)
+
+    def add(self, op, inputs, output, **attributes):
+        """Add a node and return the name of its output"""
+        self.nodes.append(helper.make_node(op, inputs, [output], name=output, **attributes))
+        return output
+
+    def conv(self, layer, source, output, **attributes):
+        """Add a convolution with the weights and bias of a cv2.dnn layer"""
+        blobs = self.net.getLayer(layer).blobs
+        inputs = [source, self.constant(f"{layer}/weights", blobs[0])]
+
+        if len(blobs) > 1:
+            inputs.append(self.constant(f"{layer}/bias", blobs[1].ravel()))
+
+        return self.add("Conv", inputs, output,
+                        kernel_shape=list(blobs[0].shape[2:]), **attributes)
+
+    def model(self, inputs, outputs, metadata=None):
+        """Build, check and return the ONNX model"""
+        graph = helper.make_graph(self.nodes, "graph", inputs, outputs, self.initializers)
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", OPSET)],
+                                  ir_version=IR_VERSION, producer_name="age-predictor")
+
+        for key, value in (metadata or {}).items():
+            entry = model.metadata_props.add()
+            entry.key = key
+            entry.value = value
+
+        onnx.checker.check_model(model)
+        return model
+
+def _batch_input(name, channels, height, width):
+    """Float NCHW graph input with a dynamic batch dimension"""
+    return helper.make_tensor_value_info(name, TensorProto.FLOAT, ["batch", channels, height, width])
+
+def convert_face_detector(model_path, config_path):
+    """Convert the TensorFlow SSD face detector to an ONNX model
+
+    The model takes an NCHW blob made like the one for cv2.dnn and returns,
+    in order, the box regressions, the softmaxed class scores and
+    feature_shapes (the height and width of each PriorBox source).
+    """
+    net = cv2.dnn.readNetFromTensorflow(model_path, config_path)
+
+    with open(config_path) as f:
+        graph = parse_text_proto(f.read())
+
+    nodes = _fields(graph, "node")
+    by_name = {_field(node, "name"): node for node in nodes}
+    constants = read_int_constants(model_path)
+    constants.update({_field(node, "name"): _attr(node, "value")
+                      for node in nodes if _field(node, "op") == "Const"})
+
+    consumers = {}
+    for node in nodes:
+        for source in _fields(node, "input"):
+            consumers.setdefault(source.split(":")[0], []).append(node)
+
+    builder = _GraphBuilder(net)
+    tensors = {}
+    priors = []
+    shape_outputs = []
+
+    def source(node, index=0):
+        return tensors[_fields(node, "input")[index].split(":")[0]]
+
+    for node in nodes:
+        name = _field(node, "name")
+        op = _field(node, "op")
+        inputs = _fields(node, "input")
+
+        if op == "Placeholder":
+            tensors[name] = name
+        elif op == "Const":
+            continue
+        elif op == "FusedBatchNorm":
+            mean, variance, scale, bias = [blob.ravel() for blob in net.getLayer(name).blobs]
+            tensors[name] = builder.add(
+                "BatchNormalization",
+                [source(node), builder.constant(f"{name}/scale", scale),
+                 builder.constant(f"{name}/bias", bias), builder.constant(f"{name}/mean", mean),
+                 builder.constant(f"{name}/variance", variance)],
+                name, epsilon=float(_attr(node, "epsilon", 1e-5)))
+        elif op in ("Mul", "BiasAdd") and name in builder.layer_names:
+            # Per-channel scale or shift, imported by cv2.dnn as a Scale layer
+            values = net.getLayer(name).blobs[0].reshape(1, -1, 1, 1)
+            tensors[name] = builder.add("Mul" if op == "Mul" else "Add",
+                                        [source(node), builder.constant(f"{name}/value", values)], name)
+        elif op in ("BiasAdd", "BatchToSpaceND"):
+            # Biases were merged into the convolution and padding is applied
+            # by the convolution, so these pass their input through
+            tensors[name] = source(node)
+        elif op == "SpaceToBatchND":
+            # Padding, or dilation when the block shape is above one; both are
+            # attributes of the following convolution
+            tensors[name] = source(node)
+        elif op == "Conv2D":
+            attributes = {"strides": _attr(node, "strides")[1:3]}
+            padding = _attr(node, "padding")
+
+            producer = by_name.get(inputs[0].split(":")[0])
+            if producer is not None and _field(producer, "op") == "SpaceToBatchND":
+                block = constants[_fields(producer, "input")[1]]
+                pads = np.reshape(constants[_fields(producer, "input")[2]], (2, 2))
+
+                # Crops after the convolution reduce the padding before it
+                for consumer in consumers.get(name, []):
+                    if _field(consumer, "op") == "BatchToSpaceND" and len(_fields(consumer, "input")) == 3:
+                        pads = pads - np.reshape(constants[_fields(consumer, "input")[2]], (2, 2))
+
+                attributes["dilations"] = [int(value) for value in block]
+                attributes["pads"] = [int(pads[0, 0]), int(pads[1, 0]), int(pads[0, 1]), int(pads[1, 1])]
+            elif padding == "SAME":
+                attributes["auto_pad"] = "SAME_UPPER"
+
+            tensors[name] = builder.conv(name, source(node), name, **attributes)
+        elif op == "Relu":
+            tensors[name] = builder.add("Relu", [source(node)], name)
+        elif op == "Add":
+            tensors[name] = builder.add("Add", [source(node, 0), source(node, 1)], name)
+        elif op == "MaxPool":
+            attributes = {"kernel_shape": _attr(node, "ksize")[1:3],
+                          "strides": _attr(node, "strides")[1:3]}
+            if _attr(node, "padding") == "SAME":
+                attributes["auto_pad"] = "SAME_UPPER"
+            tensors[name] = builder.add("MaxPool", [source(node)], name, **attributes)
+        elif op == "L2Normalize":
+            tensors[name] = builder.add("LpNormalization", [source(node)], name, axis=1, p=2)
+        elif op == "Flatten":
+            producer = by_name[inputs[0].split(":")[0]]
+
+            if _field(producer, "op") == "Softmax":
+                tensors[name] = builder.add("Flatten", [source(node)], name, axis=1)
+            else:
+                # TensorFlow flattens feature maps in NHWC order
+                transposed = builder.add("Transpose", [source(node)], f"{name}/nhwc", perm=[0, 2, 3, 1])
+                tensors[name] = builder.add("Flatten", [transposed], name, axis=1)
+        elif op == "ConcatV2":
+            if any(source.split(":")[0] not in tensors for source in inputs[:-1]):
+                continue
+            tensors[name] = builder.add("Concat", [tensors[source.split(":")[0]] for source in inputs[:-1]],
+                                        name, axis=1)
+        elif op == "Reshape":
+            shape = builder.constant(f"{name}/shape", np.array(constants[inputs[1]], dtype=np.int64))
+            tensors[name] = builder.add("Reshape", [source(node), shape], name)
+        elif op == "Softmax":
+            tensors[name] = builder.add("Softmax", [source(node)], name, axis=-1)
+        elif op == "PriorBox":
+            shape = builder.add("Shape", [source(node)], f"{name}/shape")
+            shape_outputs.append(builder.add(
+                "Slice", [shape, builder.constant(f"{name}/start", np.array([2], dtype=np.int64)),
+                          builder.constant(f"{name}/end", np.array([4], dtype=np.int64))],
+                f"{name}/size"))
+            priors.append({
+                "min_size": float(_attr(node, "min_size")),
+                "max_size": float(_attr(node, "max_size")),
+                "aspect_ratios": [float(value) for value in _attr(node, "aspect_ratio", [])],
+                "flip": bool(_attr(node, "flip", True)),
+                "clip": bool(_attr(node, "clip", False)),
+                "step": float(_attr(node, "step", 0)),
+                "offset": float(_attr(node, "offset", 0.5)),
+                "variance": [float(value) for value in _attr(node, "variance")],
+            })
+        elif op == "DetectionOutput":
+            detection_output = {key: _attr(node, key) for key in
+                                ("num_classes", "background_label_id", "confidence_threshold",
+                                 "nms_threshold", "top_k", "keep_top_k", "clip")}
+            loc, conf = tensors[inputs[0]], tensors[inputs[1]]
+        else:
+            raise ValueError(f"Unsupported TensorFlow op {op} in node {name}")
+
+    builder.add("Concat", shape_outputs, "feature_shapes", axis=0)
+
+    return builder.model(
+        [_batch_input("data", 3, "height", "width")],
+        [helper.make_tensor_value_info(loc, TensorProto.FLOAT, ["batch", "boxes"]),
+         helper.make_tensor_value_info(conf, TensorProto.FLOAT, ["batch", "scores"]),
+         helper.make_tensor_value_info("feature_shapes", TensorProto.INT64, [2 * len(priors)])],
+        {"priors": json.dumps(priors), "detection_output": json.dumps(detection_output)})
+
+def convert_age_net(config_path, model_path):
+    """Convert the Caffe age network to an ONNX model taking 227x227 NCHW blobs"""
+    net = cv2.dnn.readNetFromCaffe(config_path, model_path)
+
+    with open(config_path) as f:
+        prototxt = parse_text_proto(f.read())
+
+    builder = _GraphBuilder(net)
+    input_name = _field(prototxt, "input", "data")
+    input_dims = _fields(prototxt, "input_dim") or [1, 3, 227, 227]
+    tensors = {input_name: input_name}
+    output = input_name
+    embedding_sizes = {}
+
+    # Old (V1) prototxt files use "layers" and upper-case type names
+    layers = _fields(prototxt, "layer") or _fields(prototxt, "layers")
+
+    for layer in layers:
+        name = _field(layer, "name")
+        kind = str(_field(layer, "type")).upper()
+        bottom = tensors[_field(layer, "bottom")]
+        top = _field(layer, "top")
+
+        if kind == "CONVOLUTION":
+            param = _field(layer, "convolution_param")
+            pad = _field(param, "pad", 0)
+            output = builder.conv(name, bottom, name,
+                                  strides=[_field(param, "stride", 1)] * 2,
+                                  pads=[pad] * 4, group=_field(param, "group", 1))
+        elif kind == "RELU":
+            output = builder.add("Relu", [bottom], name)
+        elif kind == "POOLING":
+            param = _field(layer, "pooling_param")
+            pad = _field(param, "pad", 0)
+            # Caffe rounds pooled sizes up
+            output = builder.add("MaxPool" if _field(param, "pool", "MAX") == "MAX" else "AveragePool",
+                                 [bottom], name,
+                                 kernel_shape=[_field(param, "kernel_size")] * 2,
+                                 strides=[_field(param, "stride", 1)] * 2,
+                                 pads=[pad] * 4, ceil_mode=1)
+        elif kind == "LRN":
+            param = _field(layer, "lrn_param")
+            output = builder.add("LRN", [bottom], name, size=_field(param, "local_size", 5),
+                                 alpha=float(_field(param, "alpha", 1.0)),
+                                 beta=float(_field(param, "beta", 0.75)),
+                                 bias=float(_field(param, "k", 1.0)))
+        elif kind in ("INNER_PRODUCT", "INNERPRODUCT"):
+            flat = builder.add("Flatten", [bottom], f"{name}/flatten", axis=1)
+            weights = builder.param(name, 0)
+            output = builder.add("Gemm", [flat, builder.constant(f"{name}/weights", weights),
+                                          builder.constant(f"{name}/bias", builder.param(name, 1).ravel())],
+                                 name, transB=1)
+            embedding_sizes[name] = weights.shape[0]
+        elif kind == "DROPOUT":
+            output = bottom
+        elif kind == "SOFTMAX":
+            output = builder.add("Softmax", [bottom], name, axis=1)
+        else:
+            raise ValueError(f"Unsupported Caffe layer type {kind} in layer {name}")
+
+        tensors[top] = output
+
+    # The descriptor layer is also an output so faces can be indexed (see face_index)
+    outputs = [helper.make_tensor_value_info(output, TensorProto.FLOAT, ["batch", "classes"])]
+    if EMBEDDING_LAYER in embedding_sizes:
+        outputs.append(helper.make_tensor_value_info(EMBEDDING_LAYER, TensorProto.FLOAT,
+                                                     ["batch", embedding_sizes[EMBEDDING_LAYER]]))
+
+    return builder.model([_batch_input(input_name, *input_dims[1:])], outputs)
+
+def export_models(face_model, face_proto, age_proto, age_model, face_output=FACE_ONNX, age_output=AGE_ONNX):
+    """Convert both networks and save them, returning True on success"""
+    if onnx is None:
+        print("Error: the onnx package is required, install it with 'pip install onnx'")
+        return False
+
+    try:
+        onnx.save(convert_face_detector(face_model, face_proto), face_output)
+        print(f"Face detector saved to {face_output}")
+
+        onnx.save(convert_age_net(age_proto, age_model), age_output)
+        print(f"Age network saved to {age_output}")
+        return True
+
+    except Exception as e:
+        print(f"Error exporting models: {e}")
+        return False
+
+def check_parity(face_output=FACE_ONNX, age_output=AGE_ONNX, images=None):
+    """Compare OnnxAgePredictor with the cv2.dnn AgePredictor on sample images
+
+    Returns True when both find the same faces and agree on their ages.
+    """
+    from age_predictor import AgePredictor
+    from onnx_predictor import OnnxAgePredictor
+
+    reference = AgePredictor()
+    candidate = OnnxAgePredictor(face_onnx=face_output, age_onnx=age_output)
+
+    if not reference.load_models() or not candidate.load_models():
+        return False
+
+    images = images or ["sample_person1.jpg", "sample_person3.jpg", "Sunil.png", "Sunbyte.png"]
+    passed = True
+
+    for path in images:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+
+        expected = reference.predict(image)
+        actual = candidate.predict(image)
+
+        same_faces = len(expected) == len(actual) and all(
+            np.abs(np.subtract(a.box, b.box)).max() <= 2 for a, b in zip(expected, actual))
+        error = max((float(np.abs(a.probabilities - b.probabilities).max())
+                     for a, b in zip(expected, actual)), default=0.0) if same_faces else None
+
+        ok = same_faces and error <= 1e-3
+        passed = passed and ok
+
+        detail = f"max probability difference {error:.2e}" if same_faces else \
+            f"{len(expected)} vs {len(actual)} faces or boxes differ"
+        print(f"{'✓' if ok else '✗'} {path}: {len(actual)} face(s), {detail}")
+
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the face detector and age network to ONNX')
+    parser.add_argument('--face-output', type=str, default=FACE_ONNX, help='Path for the face detector model')
+    parser.add_argument('--age-output', type=str, default=AGE_ONNX, help='Path for the age network model')
+    parser.add_argument('--check', action='store_true',
+                        help='Compare the exported models with cv2.dnn on the sample images')
+    args = parser.parse_args()
+
+    from age_predictor import AgePredictor
+    predictor = AgePredictor()
+
+    if not export_models(predictor.face_model, predictor.face_proto, predictor.age_proto,
+                         predictor.age_model, args.face_output, args.age_output):
+        return
+
+    if args.check:
+        print("\nChecking parity with cv2.dnn...")
+        print("✓ Parity check passed" if check_parity(args.face_output, args.age_output)
+              else "✗ Parity check failed")
+
+if __name__ == "__main__":
+    main()
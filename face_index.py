@@ -0,0 +1,435 @@
+"""
+Nearest-neighbour index of face descriptors
+
+Each detected face gets a descriptor from the age network's penultimate
+layer, which is computed in the same forward pass as its age, so it costs
+no extra inference. FaceIndex groups the descriptors into identities with
+brute-force cosine similarity (a single matrix product), which answers
+"same person" queries and lets every appearance of a person share one
+aggregated age estimate.
+
+The activations share a large common component, so raw descriptors of
+different people are nearly parallel (cosine above 0.9). Similarities are
+therefore taken between descriptors with the dataset mean subtracted. The
+mean and the threshold depend on the model and are calibrated on known
+people: the bundled sample photos by default, or your own with
+
+    python face_index.py --calibrate people/ --output album_faces.npz
+
+where people/ holds one folder of photos per person.
+"""
+
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+# Age network layer whose activations describe a face
+EMBEDDING_LAYER = "fc7"
+
+# Cosine similarity between mean-centered descriptors above which two faces
+# are the same person, used until an index is calibrated
+DEFAULT_THRESHOLD = 0.1
+
+# Bundled photos of different people, used to calibrate an index that was
+# not calibrated on the user's own photos
+CALIBRATION_IMAGES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                      for name in ("sample_person1.jpg", "sample_person3.jpg", "Sunil.png")]
+
+# Same-person views used for calibration: crop shift (fraction of the face
+# size), scale, brightness gain and mirroring
+AUGMENTATIONS = [
+    (0.0, 0.0, 1.0, 1.0, False),
+    (0.05, 0.0, 1.0, 1.0, False),
+    (-0.05, 0.05, 1.0, 1.0, False),
+    (0.0, 0.0, 1.1, 1.0, False),
+    (0.0, 0.0, 0.9, 1.0, False),
+    (0.0, 0.0, 1.0, 1.2, False),
+    (0.0, 0.0, 1.0, 0.8, False),
+    (0.0, 0.0, 1.0, 1.0, True),
+]
+
+def normalize(embeddings):
+    """L2-normalize descriptors so dot products are cosine similarities"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def descriptors(embeddings):
+    """Face descriptors from EMBEDDING_LAYER outputs: the activations after its ReLU
+
+    The layer output is read before its in-place ReLU, whose negative part
+    carries little identity information.
+    """
+    return np.maximum(np.asarray(embeddings, dtype=np.float32), 0.0)
+
+class FaceIndex:
+    """Face descriptors grouped into identities
+
+    A face joins the identity of its most similar stored descriptor when
+    the cosine similarity is at least threshold, and starts a new identity
+    otherwise. Each identity keeps at most max_per_identity descriptors, so
+    a person seen in hundreds of photos doesn't grow the index, but all of
+    their age probabilities are averaged.
+
+    Similarities are between descriptors minus mean: the one fitted by
+    calibrate(), or else the running mean of every face added so far. The
+    running mean is a fallback; it is unreliable while the index holds only
+    a few faces.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_per_identity=8, mean=None):
+        self.threshold = threshold
+        self.max_per_identity = max_per_identity
+
+        # Fitted descriptor mean, or None to use the running mean
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.descriptor_sum = None
+        self.descriptor_count = 0
+
+        # Rows of uncentered descriptors, grown by doubling; only the first
+        # size rows are in use
+        self.embeddings = None
+        self.owners = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+        # The same rows centered on the fitted mean and normalized; the first
+        # centered_size are up to date
+        self.centered = None
+        self.centered_size = 0
+
+        # Per identity: number of stored descriptors, faces seen and the sum
+        # of their age probabilities
+        self.stored = []
+        self.counts = []
+        self.age_sums = []
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def identities(self):
+        """Number of distinct identities"""
+        return len(self.counts)
+
+    def center(self, embeddings):
+        """Mean-centered, normalized descriptors, ready for cosine similarities"""
+        embeddings = descriptors(np.atleast_2d(embeddings))
+
+        mean = self.mean
+        if mean is None and self.descriptor_count:
+            mean = self.descriptor_sum / self.descriptor_count
+
+        return normalize(embeddings if mean is None else embeddings - mean)
+
+    def search(self, embeddings, k=1):
+        """Find the k most similar stored descriptors for each query
+
+        Returns (similarities, identities), both shaped (queries, k), best
+        first. Missing neighbours have similarity -inf and identity -1.
+        """
+        queries = self.center(embeddings)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        identities = np.full((len(queries), k), -1, dtype=np.int64)
+
+        if self.size == 0:
+            return similarities, identities
+
+        scores = queries @ self._centered_rows().T
+        count = min(k, self.size)
+
+        # argpartition finds the top k without sorting every score
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+
+        similarities[:, :count] = np.take_along_axis(top_scores, order, axis=1)
+        identities[:, :count] = self.owners[np.take_along_axis(top, order, axis=1)]
+        return similarities, identities
+
+    def _centered_rows(self):
+        """Stored descriptors, centered and normalized
+
+        With a fitted mean, rows are centered once and cached. The running
+        mean moves with every face, so without one they are centered again
+        for every search.
+        """
+        if self.mean is None:
+            return self.center(self.embeddings[:self.size])
+
+        if self.centered_size < self.size:
+            self.centered[self.centered_size:self.size] = self.center(self.embeddings[self.centered_size:self.size])
+            self.centered_size = self.size
+
+        return self.centered[:self.size]
+
+    def match(self, embedding):
+        """Identity of the most similar known face, or None below the threshold"""
+        similarities, identities = self.search(embedding)
+
+        if similarities[0, 0] < self.threshold:
+            return None
+
+        return int(identities[0, 0])
+
+    def same_person(self, first, second):
+        """Whether two descriptors are similar enough to be the same identity"""
+        first, second = self.center(first)[0], self.center(second)[0]
+        return float(first @ second) >= self.threshold
+
+    def add(self, embedding, probabilities=None, identity=None):
+        """Store a face under an identity, creating one if identity is None
+
+        Returns the identity.
+        """
+        if identity is None:
+            identity = len(self.counts)
+            self.stored.append(0)
+            self.counts.append(0)
+            self.age_sums.append(None)
+
+        embedding = descriptors(embedding)
+        self.descriptor_sum = embedding.copy() if self.descriptor_sum is None else self.descriptor_sum + embedding
+        self.descriptor_count += 1
+
+        self.counts[identity] += 1
+        if probabilities is not None:
+            probabilities = np.asarray(probabilities, dtype=np.float64)
+            current = self.age_sums[identity]
+            self.age_sums[identity] = probabilities.copy() if current is None else current + probabilities
+
+        if self.stored[identity] < self.max_per_identity:
+            self._append(embedding, identity)
+            self.stored[identity] += 1
+
+        return identity
+
+    def _append(self, embedding, identity):
+        """Add one descriptor row, growing the arrays when full"""
+        if self.embeddings is None:
+            self.embeddings = np.zeros((16, embedding.shape[-1]), dtype=np.float32)
+            self.centered = np.zeros_like(self.embeddings)
+            self.owners = np.zeros(16, dtype=np.int64)
+        elif self.size == len(self.embeddings):
+            self.embeddings = np.concatenate([self.embeddings, np.zeros_like(self.embeddings)])
+            self.centered = np.concatenate([self.centered, np.zeros_like(self.centered)])
+            self.owners = np.concatenate([self.owners, np.zeros_like(self.owners)])
+
+        self.embeddings[self.size] = embedding
+        self.owners[self.size] = identity
+        self.size += 1
+
+    def assign(self, embeddings, probabilities=None):
+        """Match each face to a known identity or a new one, and record it
+
+        Faces are assigned in order, so two faces in the same call can
+        match each other. Returns the list of identities.
+        """
+        identities = []
+
+        for index, embedding in enumerate(embeddings):
+            face_probabilities = None if probabilities is None else probabilities[index]
+            identities.append(self.add(embedding, face_probabilities, self.match(embedding)))
+
+        return identities
+
+    def calibrate(self, embeddings, labels):
+        """Fit the descriptor mean and threshold on faces of known people
+
+        labels holds one person label per embedding; at least one person
+        needs two faces and there must be two people. Every pair of faces is
+        compared, and the threshold is set in the middle of the range that
+        best separates same-person pairs from different-person pairs
+        (balanced accuracy). Returns a summary of both similarity
+        distributions and the accuracy reached.
+
+        Raises ValueError, leaving the index unchanged, when the faces can't
+        calibrate it.
+        """
+        labels = np.asarray(labels)
+        embeddings = descriptors(embeddings) if len(embeddings) else np.zeros((0, 0), dtype=np.float32)
+        if not embeddings.size or not np.isfinite(embeddings).all():
+            raise ValueError("Calibration needs finite descriptors of at least two faces")
+
+        mean = embeddings.mean(axis=0)
+        centered = normalize(embeddings - mean)
+        scores = centered @ centered.T
+        pairs = np.triu(np.ones_like(scores, dtype=bool), k=1)
+        same_person = labels[:, None] == labels[None, :]
+
+        same = scores[pairs & same_person]
+        different = scores[pairs & ~same_person]
+        if not len(same) or not len(different):
+            raise ValueError("Calibration needs two people and two faces of at least one of them")
+
+        values = np.unique(np.concatenate([same, different]))
+        candidates = np.concatenate([[values[0] - 1e-3], (values[:-1] + values[1:]) / 2, [values[-1] + 1e-3]])
+        accuracy = np.array([(np.mean(same >= t) + np.mean(different < t)) / 2 for t in candidates])
+
+        # Middle of the best plateau, as far as possible from both classes
+        best = np.flatnonzero(accuracy == accuracy.max())
+        self.mean = mean
+        self.centered_size = 0
+        self.threshold = float(candidates[best[len(best) // 2]])
+
+        return {
+            "same_pairs": int(len(same)),
+            "different_pairs": int(len(different)),
+            "same_min": float(same.min()),
+            "same_mean": float(same.mean()),
+            "different_max": float(different.max()),
+            "different_mean": float(different.mean()),
+            "threshold": self.threshold,
+            "balanced_accuracy": float(accuracy.max()),
+        }
+
+    def age_probabilities(self, identity):
+        """Mean age probabilities over every face of an identity, or None"""
+        total = self.age_sums[identity]
+        if total is None:
+            return None
+
+        return (total / self.counts[identity]).astype(np.float32)
+
+    def save(self, path):
+        """Write the index to a file in NumPy .npz format"""
+        width = next((len(sums) for sums in self.age_sums if sums is not None), 0)
+        age_sums = np.zeros((len(self.counts), width))
+        has_ages = np.zeros(len(self.counts), dtype=bool)
+
+        for identity, sums in enumerate(self.age_sums):
+            if sums is not None:
+                age_sums[identity] = sums
+                has_ages[identity] = True
+
+        embeddings = self.embeddings[:self.size] if self.size else np.zeros((0, 0), dtype=np.float32)
+        empty = np.zeros(0, dtype=np.float32)
+
+        # A file object keeps np.savez from appending .npz to the path
+        with open(path, "wb") as f:
+            np.savez(f, threshold=self.threshold, max_per_identity=self.max_per_identity,
+                     mean=empty if self.mean is None else self.mean,
+                     descriptor_sum=empty if self.descriptor_sum is None else self.descriptor_sum,
+                     descriptor_count=self.descriptor_count,
+                     embeddings=embeddings, owners=self.owners[:self.size],
+                     stored=np.asarray(self.stored, dtype=np.int64),
+                     counts=np.asarray(self.counts, dtype=np.int64),
+                     age_sums=age_sums, has_ages=has_ages)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()"""
+        data = np.load(path)
+        index = cls(float(data["threshold"]), int(data["max_per_identity"]),
+                    data["mean"] if len(data["mean"]) else None)
+
+        if data["descriptor_count"]:
+            index.descriptor_sum = data["descriptor_sum"]
+            index.descriptor_count = int(data["descriptor_count"])
+
+        for embedding, owner in zip(data["embeddings"], data["owners"]):
+            index._append(embedding, int(owner))
+
+        index.stored = data["stored"].tolist()
+        index.counts = data["counts"].tolist()
+        index.age_sums = [sums if has_ages else None
+                          for sums, has_ages in zip(data["age_sums"], data["has_ages"])]
+        return index
+
+def augmented_faces(image, box):
+    """Crops of one face with small shifts, rescaling, relighting and mirroring"""
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = box
+    face_width, face_height = x2 - x1, y2 - y1
+
+    faces = []
+    for shift_x, shift_y, scale, gain, mirror in AUGMENTATIONS:
+        center_x = (x1 + x2) / 2 + shift_x * face_width
+        center_y = (y1 + y2) / 2 + shift_y * face_height
+        half_width, half_height = face_width * scale / 2, face_height * scale / 2
+
+        face = image[max(0, int(center_y - half_height)):min(height, int(center_y + half_height)),
+                     max(0, int(center_x - half_width)):min(width, int(center_x + half_width))]
+        if face.size == 0:
+            continue
+
+        face = cv2.convertScaleAbs(face, alpha=gain)
+        faces.append(face[:, ::-1].copy() if mirror else face)
+
+    return faces
+
+def calibration_descriptors(predictor, image_paths):
+    """Descriptors of several views of the most confident face in each image
+
+    Returns (embeddings, owners) where owners holds the position in
+    image_paths each row came from. Images without a face are skipped.
+    """
+    embeddings = []
+    owners = []
+    for position, path in enumerate(image_paths):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+
+        faces = predictor.detect_faces(image)
+        if not len(faces):
+            continue
+
+        _, rows = predictor.predict_ages(augmented_faces(image, faces[0].tolist()), return_embeddings=True)
+        embeddings.extend(rows)
+        owners.extend([position] * len(rows))
+
+    return embeddings, owners
+
+def print_calibration(report):
+    """Print the summary returned by FaceIndex.calibrate()"""
+    print(f"Same person:      {report['same_pairs']} pair(s), similarity mean {report['same_mean']:.3f}, "
+          f"min {report['same_min']:.3f}")
+    print(f"Different people: {report['different_pairs']} pair(s), similarity mean "
+          f"{report['different_mean']:.3f}, max {report['different_max']:.3f}")
+    print(f"Threshold {report['threshold']:.3f} ({report['balanced_accuracy']:.1%} balanced accuracy)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the face index on photos of known people')
+    parser.add_argument('--calibrate', type=str, required=True,
+                        help='Folder with one subfolder of photos per person')
+    parser.add_argument('--output', type=str, default='face_index.npz',
+                        help='Calibrated, empty index to pass to age_predictor.py --face-index')
+    parser.add_argument('--engine', choices=['opencv', 'onnx', 'onnx-int8'], default='opencv',
+                        help='Inference engine, as for the age_predictor.py CLI')
+    args = parser.parse_args()
+
+    # Imported here because age_predictor imports this module
+    from age_predictor import create_predictor, find_image_files
+
+    predictor = create_predictor(args.engine)
+    if not predictor.load_models():
+        return
+
+    embeddings = []
+    labels = []
+    for person in sorted(os.listdir(args.calibrate)):
+        folder = os.path.join(args.calibrate, person)
+        if not os.path.isdir(folder):
+            continue
+
+        paths = find_image_files(folder)
+        rows, owners = calibration_descriptors(predictor, paths)
+        embeddings.extend(rows)
+        labels.extend([person] * len(rows))
+        print(f"{person}: {len(set(owners))} of {len(paths)} photo(s) with a face")
+
+    index = FaceIndex()
+    try:
+        report = index.calibrate(embeddings, labels)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    print_calibration(report)
+    index.save(args.output)
+    print(f"Calibrated index saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Lightweight face tracking between face detector runs
+
+Faces are detected every few frames and followed in between with template
+matching, so each face keeps a stable ID. Age predictions are cached per
+track, refreshed every few frames or when the face changes noticeably, and
+smoothed over time so labels don't flicker between neighbouring ranges.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+def box_iou(boxes_a, boxes_b):
+    """Compute the IoU between every box in boxes_a and every box in boxes_b"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+class Track:
+    """A single face followed across frames"""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+
+        # Grayscale appearance of the face at its last detection
+        self.template = None
+
+        # Template matching score from the last propagated frame
+        self.score = 1.0
+
+        # Detector runs in a row that did not find this face
+        self.missed = 0
+
+        # (age range, confidence, probability vector) once classified,
+        # computed from the smoothed probabilities
+        self.age = None
+
+        # Exponential moving average of the age network output
+        self.probs = None
+
+        # Frames since the age network last saw this face
+        self.frames_since_age = 0
+
+        # Small grayscale thumbnail of the face at its last age prediction
+        self.thumbnail = None
+
+class FaceTracker:
+    """Detect faces every detect_every frames and track them in between
+
+    A detection round is also forced as soon as any track's template match
+    score falls below min_track_score.
+
+    A track's age is re-predicted every age_every frames, or sooner when its
+    thumbnail differs from the one last classified by more than
+    change_threshold (mean absolute difference, 0-1). New probabilities are
+    blended into the track's running average with weight age_smoothing.
+    """
+
+    def __init__(self, predictor, detect_every=5, min_track_score=0.5,
+                 iou_threshold=0.3, max_missed=2, search_margin=0.5,
+                 age_every=10, age_smoothing=0.3, change_threshold=0.15):
+        self.predictor = predictor
+        self.detect_every = max(1, int(detect_every))
+        self.min_track_score = min_track_score
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.search_margin = search_margin
+        self.age_every = max(1, int(age_every))
+        self.age_smoothing = age_smoothing
+        self.change_threshold = change_threshold
+
+        self.tracks = []
+        self.next_id = 1
+        self.frame_index = 0
+        self.force_detection = True
+
+        # Seconds the last update() spent detecting, tracking and classifying
+        self.timings = {"detect": 0.0, "track": 0.0, "age": 0.0}
+
+    def update(self, frame):
+        """Advance the tracker by one frame and return the current tracks"""
+        start = time.perf_counter()
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detected = self.force_detection or self.frame_index % self.detect_every == 0
+
+        if detected:
+            self._detect(frame, gray)
+        else:
+            self._propagate(gray)
+
+        located = time.perf_counter()
+        self._classify_tracks(frame, gray)
+
+        self.timings["detect"] = located - start if detected else 0.0
+        self.timings["track"] = 0.0 if detected else located - start
+        self.timings["age"] = time.perf_counter() - located
+
+        self.frame_index += 1
+
+        return self.tracks
+
+    def _clip_box(self, box, width, height):
+        """Clip a box to the frame, returning None if nothing is left"""
+        x1, y1, x2, y2 = box
+        x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+        y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return None
+
+        return (int(x1), int(y1), int(x2), int(y2))
+
+    def _detect(self, frame, gray):
+        """Run the face detector and associate its boxes with existing tracks"""
+        height, width = gray.shape[:2]
+
+        boxes = []
+        for face in self.predictor.detect_faces(frame):
+            box = self._clip_box(face, width, height)
+
+            if box is not None:
+                boxes.append(box)
+
+        matched_tracks = set()
+        matched_boxes = set()
+
+        if self.tracks and boxes:
+            ious = box_iou([track.box for track in self.tracks], boxes)
+
+            # Greedily pair the most overlapping track and detection first
+            for flat_index in np.argsort(ious, axis=None)[::-1]:
+                track_index, box_index = np.unravel_index(flat_index, ious.shape)
+
+                if ious[track_index, box_index] < self.iou_threshold:
+                    break
+
+                if track_index in matched_tracks or box_index in matched_boxes:
+                    continue
+
+                matched_tracks.add(track_index)
+                matched_boxes.add(box_index)
+
+                track = self.tracks[track_index]
+                track.box = boxes[box_index]
+                track.missed = 0
+
+        tracks = []
+        detected = []
+        for track_index, track in enumerate(self.tracks):
+            if track_index in matched_tracks:
+                tracks.append(track)
+                detected.append(track)
+                continue
+
+            # Forget tracks the detector keeps missing
+            track.missed += 1
+            if track.missed > self.max_missed:
+                continue
+
+            # Follow a missed face with the template from its last detection,
+            # and drop it once that no longer matches either
+            self._match_template(track, gray)
+            if track.score >= self.min_track_score:
+                tracks.append(track)
+
+        # Start tracks for new faces
+        for box_index, box in enumerate(boxes):
+            if box_index not in matched_boxes:
+                track = Track(self.next_id, box)
+                tracks.append(track)
+                detected.append(track)
+                self.next_id += 1
+
+        # Refresh templates only where the detector saw the face, so a
+        # template never comes from a position the face has left
+        for track in detected:
+            x1, y1, x2, y2 = track.box
+            track.template = gray[y1:y2, x1:x2].copy()
+            track.score = 1.0
+
+        self.tracks = tracks
+        self.force_detection = False
+
+    def _match_template(self, track, gray):
+        """Move a track to the best match of its template near its previous box"""
+        height, width = gray.shape[:2]
+        x1, y1, x2, y2 = track.box
+        template_height, template_width = track.template.shape[:2]
+
+        # Search a window around the previous position
+        margin_x = int((x2 - x1) * self.search_margin)
+        margin_y = int((y2 - y1) * self.search_margin)
+        sx1, sy1 = max(0, x1 - margin_x), max(0, y1 - margin_y)
+        sx2, sy2 = min(width, x2 + margin_x), min(height, y2 + margin_y)
+
+        if sx2 - sx1 < template_width or sy2 - sy1 < template_height:
+            track.score = 0.0
+            return
+
+        result = cv2.matchTemplate(gray[sy1:sy2, sx1:sx2], track.template,
+                                   cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(result)
+
+        track.score = score
+        track.box = (sx1 + location[0], sy1 + location[1],
+                     sx1 + location[0] + template_width,
+                     sy1 + location[1] + template_height)
+
+    def _propagate(self, gray):
+        """Move every track to the best template match near its previous box"""
+        for track in self.tracks:
+            self._match_template(track, gray)
+
+        # Lost faces trigger a detection round on the next frame
+        if any(track.score < self.min_track_score for track in self.tracks):
+            self.force_detection = True
+
+    def _thumbnail(self, gray, box):
+        """Shrink a face to a fixed size so its appearance can be compared cheaply"""
+        x1, y1, x2, y2 = box
+        face = gray[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+
+        if face.size == 0:
+            return None
+
+        return cv2.resize(face, (32, 32), interpolation=cv2.INTER_AREA)
+
+    def _needs_age(self, track, gray):
+        """Decide whether a track's cached age prediction should be refreshed"""
+        if track.probs is None or track.frames_since_age >= self.age_every:
+            return True
+
+        thumbnail = self._thumbnail(gray, track.box)
+
+        if thumbnail is None or track.thumbnail is None:
+            return False
+
+        change = cv2.absdiff(thumbnail, track.thumbnail).mean() / 255.0
+        return change > self.change_threshold
+
+    def _classify_tracks(self, frame, gray):
+        """Predict ages for tracks whose cached prediction is missing or stale, in one batch"""
+        pending = []
+        for track in self.tracks:
+            if self._needs_age(track, gray):
+                pending.append(track)
+            else:
+                track.frames_since_age += 1
+
+        if not pending:
+            return
+
+        face_images = []
+        for track in pending:
+            x1, y1, x2, y2 = track.box
+            face_images.append(frame[y1:y2, x1:x2])
+
+        for track, (_, _, probs) in zip(pending, self.predictor.predict_ages(face_images)):
+            # Smooth the probabilities over time rather than the labels
+            if track.probs is None:
+                track.probs = probs.copy()
+            else:
+                track.probs = (1.0 - self.age_smoothing) * track.probs + self.age_smoothing * probs
+
+            age_index = track.probs.argmax()
+            track.age = (self.predictor.age_ranges[age_index], track.probs[age_index], track.probs)
+            track.frames_since_age = 0
+            track.thumbnail = self._thumbnail(gray, track.box)
@@ -0,0 +1,237 @@
+"""
+Memory-bounded streaming predictions over large image sets
+
+Holding whole images at native resolution is what makes memory grow with
+50 MP photos and long file lists. iter_predictions() keeps a bounded
+window of images in flight, and none of them at full resolution:
+
+    load    (background thread) read the file and decode it just large
+            enough for the detector, using reduced JPEG decoding
+    detect  (caller's thread) run the detector over every loaded image
+    crop    (background thread) decode each image with faces again, at the
+            smallest scale that keeps its faces at least as large as the age
+            network input, and keep only the faces resized to that input
+    age     (caller's thread) classify every cropped face at once
+
+The networks only run on the caller's thread, so the predictor's nets are
+never shared between threads. Results are yielded as images finish, which
+is not necessarily the input order.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from age_predictor import (AGE_INPUT_SIZE, FaceResult, content_key, decode_image, decoded_size,
+                           jpeg_size, reduced_scale)
+
+class _Item:
+    """One image on its way through the stages"""
+
+    __slots__ = ("path", "key", "image", "size", "boxes", "confidences", "faces", "results")
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.image = None
+        self.size = None
+        self.boxes = None
+        self.confidences = None
+        self.faces = None
+        self.results = None
+
+def _read(path):
+    """Encoded bytes of a file, or None if it can't be read"""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _load(predictor, path, confidence_threshold):
+    """Read an image and keep the smallest version the detector can use
+
+    Cache hits come back with results set; unreadable images with neither
+    results nor an image.
+    """
+    item = _Item(path)
+    data = _read(path)
+    if data is None:
+        return item
+
+    # Identities depend on the faces seen so far, so a face index bypasses the cache
+    if predictor.result_cache is not None and predictor.face_index is None:
+        item.key = content_key(data, predictor.result_version(confidence_threshold))
+        item.results = predictor.result_cache.get(item.key)
+        if item.results is not None:
+            return item
+
+    # Tiled detection searches the full resolution
+    detector_size = predictor.detector_size
+    scale = 1 if predictor.tile_size else reduced_scale(data, detector_size)
+
+    image = decode_image(data, scale)
+    if image is None:
+        return item
+
+    item.size = decoded_size(data, image, scale)
+
+    # The detector resizes its input to detector_size anyway
+    height, width = image.shape[:2]
+    if not predictor.tile_size and min(height, width) > detector_size:
+        factor = detector_size / min(height, width)
+        image = cv2.resize(image, (max(1, round(width * factor)), max(1, round(height * factor))),
+                           interpolation=cv2.INTER_AREA)
+
+    item.image = image
+    return item
+
+def _crop(item):
+    """Decode an image again and keep only its faces at the age network input size"""
+    data = _read(item.path)
+    if data is None:
+        return item
+
+    # Largest reduced decode that keeps the smallest face at least as big as the age input
+    boxes = np.asarray(item.boxes)
+    smallest = min((boxes[:, 2:] - boxes[:, :2]).min(), min(item.size))
+    scale = 1
+    if jpeg_size(data) is not None:
+        scale = next((scale for scale in (8, 4, 2) if smallest // scale >= max(AGE_INPUT_SIZE)), 1)
+
+    image = decode_image(data, scale)
+    del data
+    if image is None:
+        return item
+
+    height, width = image.shape[:2]
+    x_factor, y_factor = width / item.size[0], height / item.size[1]
+
+    item.faces = []
+    for x1, y1, x2, y2 in item.boxes:
+        face = image[int(y1 * y_factor):int(np.ceil(y2 * y_factor)),
+                     int(x1 * x_factor):int(np.ceil(x2 * x_factor))]
+        item.faces.append(cv2.resize(face, AGE_INPUT_SIZE) if face.size else None)
+
+    return item
+
+def _detect(predictor, items, confidence_threshold):
+    """Detect faces in loaded images, with boxes in full-resolution pixels
+
+    Returns the items with at least one face; the others get empty results.
+    """
+    detections = predictor.detect_faces_batch([item.image for item in items], confidence_threshold,
+                                              return_confidences=True)
+
+    with_faces = []
+    for item, (faces, confidences) in zip(items, detections):
+        height, width = item.image.shape[:2]
+        full_width, full_height = item.size
+        item.image = None
+
+        # Empty boxes are dropped together with their confidences
+        boxes = []
+        kept_confidences = []
+        for (x1, y1, x2, y2), confidence in zip(faces.tolist(), confidences):
+            box = (int(x1 * full_width / width), int(y1 * full_height / height),
+                   min(full_width, int(np.ceil(x2 * full_width / width))),
+                   min(full_height, int(np.ceil(y2 * full_height / height))))
+            if box[2] > box[0] and box[3] > box[1]:
+                boxes.append(box)
+                kept_confidences.append(confidence)
+
+        if boxes:
+            item.boxes = boxes
+            item.confidences = kept_confidences
+            with_faces.append(item)
+        else:
+            item.results = []
+
+    return with_faces
+
+def _classify(predictor, items):
+    """Predict ages for the cropped faces of several images at once"""
+    owners = []
+    face_images = []
+    for item in items:
+        # The second read failed, e.g. because the file was removed
+        if item.faces is None:
+            continue
+
+        item.results = []
+
+        for box, confidence, face in zip(item.boxes, item.confidences, item.faces):
+            if face is not None:
+                owners.append((item, box, float(confidence)))
+                face_images.append(face)
+
+        item.faces = None
+
+    if predictor.face_index is None:
+        predictions = predictor.predict_ages(face_images)
+        identities = [None] * len(predictions)
+    else:
+        predictions, embeddings = predictor.predict_ages(face_images, return_embeddings=True)
+        identities = predictor._assign_identities(predictions, embeddings)
+
+    for (item, box, confidence), (predicted_age, _, probs), identity in zip(owners, predictions, identities):
+        item.results.append(FaceResult(box, confidence, int(probs.argmax()), predicted_age, probs, identity,
+                                       predictor._identity_age_range(identity)))
+
+def iter_predictions(predictor, paths, confidence_threshold=0.7, prefetch=8, workers=2):
+    """Yield (path, results) for every image path, holding at most prefetch images at once
+
+    results is a list of FaceResult with boxes in full-resolution pixels,
+    or None if the image can't be read. paths may be any iterable, including
+    a generator over a directory tree; it is consumed lazily.
+    """
+    paths = iter(paths)
+    prefetch = max(1, int(prefetch))
+    exhausted = False
+
+    try:
+        with ThreadPoolExecutor(max(1, int(workers)), thread_name_prefix="image-stream") as executor:
+            loading = set()
+            cropping = set()
+
+            while True:
+                # Keep the window full
+                while not exhausted and len(loading) + len(cropping) < prefetch:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                        break
+                    loading.add(executor.submit(_load, predictor, path, confidence_threshold))
+
+                if not loading and not cropping:
+                    return
+
+                done, _ = wait(loading | cropping, return_when=FIRST_COMPLETED)
+                loaded = [future.result() for future in done & loading]
+                cropped = [future.result() for future in done & cropping]
+                loading -= done
+                cropping -= done
+
+                finished = [item for item in loaded if item.image is None]
+                pending = [item for item in loaded if item.image is not None]
+
+                if pending:
+                    with_faces = _detect(predictor, pending, confidence_threshold)
+                    cropping.update(executor.submit(_crop, item) for item in with_faces)
+                    finished.extend(item for item in pending if item.results is not None)
+
+                if cropped:
+                    _classify(predictor, cropped)
+                    finished.extend(cropped)
+
+                for item in finished:
+                    # Only items that were decoded have a size; the others were cache hits or errors
+                    if item.key is not None and item.size is not None and item.results is not None:
+                        predictor.result_cache.put(item.key, item.results)
+
+                    yield item.path, item.results
+    finally:
+        # Commit cached results that are still pending, also when the caller stops early
+        if predictor.result_cache is not None:
+            predictor.result_cache.flush()
@@ -0,0 +1,278 @@
+"""
+Sharded, resumable bulk processing of image archives
+
+A job is a manifest listing one image path per line. Each machine runs one
+shard of it: paths are assigned to shards by a hash of the path, so every
+machine agrees on the split without coordination and editing the manifest
+doesn't move already assigned paths.
+
+Each shard appends one JSON line per image to its own results file and
+flushes it after every batch. The results file is the checkpoint: a killed
+job is restarted with the same command and skips every path already
+recorded. A small progress file next to it is rewritten atomically after
+each batch for monitoring. With --retry-errors, failed paths run again and
+a new line is appended; the last line for a path is its current result.
+
+Usage:
+    python job_runner.py --build-manifest archive/ --manifest archive.txt
+    python job_runner.py --manifest archive.txt --output-dir results/ --shard 0 --shards 4
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import time
+
+import cv2
+
+from age_predictor import IMAGE_EXTENSIONS, RESULT_PREFIX, create_predictor, is_result_image
+
+def build_manifest(directory, manifest_path):
+    """Write a manifest of every image under a directory, returning the count
+
+    Annotated results written by this program are left out.
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if any(fnmatch.fnmatch(name.lower(), pattern) for pattern in IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                if not is_result_image(path):
+                    paths.append(path)
+
+    paths.sort()
+    with open(manifest_path, "w") as f:
+        f.writelines(path + "\n" for path in paths)
+
+    return len(paths)
+
+def read_manifest(manifest_path):
+    """Read the image paths of a manifest, skipping blank lines and # comments"""
+    with open(manifest_path) as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+def _path_digest(path):
+    """Stable 64-bit hash of a manifest path"""
+    return hashlib.blake2b(path.encode(), digest_size=8).digest()
+
+def shard_of(path, shards):
+    """Shard a path belongs to, stable across machines and manifest edits"""
+    return int.from_bytes(_path_digest(path), "big") % shards
+
+def shard_name(shard, shards):
+    """File name stem shared by a shard's outputs"""
+    return f"shard-{shard:05d}-of-{shards:05d}"
+
+def read_done(results_path, retry_errors=False):
+    """Paths already recorded in a results file
+
+    A line cut short by a killed job is removed so appending can continue
+    from a clean line boundary. With retry_errors, paths that failed are
+    not counted as done.
+    """
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+
+    valid_bytes = 0
+    with open(results_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+
+            valid_bytes += len(line)
+            if record["status"] == "ok" or not retry_errors:
+                done.add(record["path"])
+
+    if valid_bytes < os.path.getsize(results_path):
+        with open(results_path, "r+b") as f:
+            f.truncate(valid_bytes)
+
+    return done
+
+class JobRunner:
+    """Process one shard of a manifest, resuming from earlier runs
+
+    Paths outside the shard, paths already in the results file and images
+    this program generated (result_* files and anything under output_dir)
+    are skipped. With save_images, annotated images are written to
+    output_dir/images as well.
+    """
+
+    def __init__(self, manifest_path, output_dir, shard=0, shards=1, batch_size=8,
+                 confidence_threshold=0.7, save_images=False, retry_errors=False, **predictor_options):
+        if not 0 <= shard < shards:
+            raise ValueError(f"Shard {shard} is outside 0..{shards - 1}")
+
+        self.manifest_path = manifest_path
+        self.output_dir = output_dir
+        self.shard = shard
+        self.shards = shards
+        self.batch_size = max(1, int(batch_size))
+        self.confidence_threshold = confidence_threshold
+        self.save_images = save_images
+        self.retry_errors = retry_errors
+        self.predictor_options = predictor_options
+
+        name = shard_name(shard, shards)
+        self.results_path = os.path.join(output_dir, f"{name}.jsonl")
+        self.progress_path = os.path.join(output_dir, f"{name}.progress.json")
+        self.images_dir = os.path.join(output_dir, "images")
+
+    def _generated(self, path):
+        """Whether an input is an output of this or an earlier job"""
+        output_dir = os.path.abspath(self.output_dir)
+        return (is_result_image(path)
+                or os.path.commonpath([os.path.abspath(path), output_dir]) == output_dir)
+
+    def pending(self):
+        """Paths of this shard that still need processing, in manifest order
+
+        Returns (pending, total) where total is the shard's size.
+        """
+        shard_paths = [path for path in read_manifest(self.manifest_path)
+                       if shard_of(path, self.shards) == self.shard and not self._generated(path)]
+        done = read_done(self.results_path, self.retry_errors)
+
+        # A path listed twice in the manifest is processed once
+        pending = list(dict.fromkeys(path for path in shard_paths if path not in done))
+        return pending, len(set(shard_paths))
+
+    def _write_progress(self, progress):
+        """Atomically replace the progress file"""
+        temp_path = f"{self.progress_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(progress, f, indent=2)
+        os.replace(temp_path, self.progress_path)
+
+    def _records(self, paths, predictions):
+        """JSON lines for one batch, saving annotated images when asked"""
+        lines = []
+        for path, (image, results) in zip(paths, predictions):
+            record = {"path": path, "time": round(time.time(), 3)}
+
+            if image is None:
+                # Images that raised come back with the exception instead of results
+                error = "could not read image" if results is None else str(results)
+                record.update(status="error", error=error)
+            else:
+                record.update(status="ok", faces=[result.as_dict() for result in results])
+
+                if self.save_images:
+                    # Archives repeat file names across folders, so add a hash of the path
+                    name = os.path.splitext(os.path.basename(path))[0]
+                    output_path = os.path.join(self.images_dir,
+                                               f"{RESULT_PREFIX}{name}-{_path_digest(path).hex()[:8]}.jpg")
+                    cv2.imwrite(output_path, self.predictor.annotate(image, results))
+                    record["image"] = output_path
+
+            lines.append(json.dumps(record) + "\n")
+
+        return lines
+
+    def run(self):
+        """Process every pending path of the shard and return a progress summary"""
+        os.makedirs(self.images_dir if self.save_images else self.output_dir, exist_ok=True)
+
+        pending, total = self.pending()
+        progress = {
+            "manifest": self.manifest_path,
+            "shard": self.shard,
+            "shards": self.shards,
+            "total": total,
+            "done": total - len(pending),
+            "errors_this_run": 0,
+            "images_per_second": 0.0,
+            "finished": not pending,
+        }
+
+        print(f"[{shard_name(self.shard, self.shards)}] {progress['done']}/{total} already done, "
+              f"{len(pending)} to process")
+
+        if not pending:
+            self._write_progress(progress)
+            return progress
+
+        self.predictor = create_predictor(**self.predictor_options)
+        if not self.predictor.load_models():
+            return None
+
+        start_time = time.perf_counter()
+        processed = 0
+
+        with open(self.results_path, "a") as results_file:
+            for start in range(0, len(pending), self.batch_size):
+                paths = pending[start:start + self.batch_size]
+                # A failing batch is retried image by image, so one bad file can't
+                # stop the job or fail again on every resume
+                predictions = self.predictor._predict_files_safe(paths, self.confidence_threshold)
+                lines = self._records(paths, predictions)
+
+                # Results must be on disk before the batch counts as done
+                results_file.writelines(lines)
+                results_file.flush()
+                os.fsync(results_file.fileno())
+
+                processed += len(paths)
+                elapsed = time.perf_counter() - start_time
+                progress["done"] += len(paths)
+                progress["errors_this_run"] += sum(image is None for image, _ in predictions)
+                progress["images_per_second"] = processed / elapsed if elapsed > 0 else 0.0
+                progress["finished"] = progress["done"] >= total
+                self._write_progress(progress)
+
+                remaining = (len(pending) - processed) * elapsed / processed
+                print(f"[{shard_name(self.shard, self.shards)}] {progress['done']}/{total} "
+                      f"({progress['images_per_second']:.1f} images/s, {remaining / 60:.1f} min left)")
+
+        return progress
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one shard of a bulk age prediction job')
+    parser.add_argument('--manifest', type=str, required=True, help='File listing one image path per line')
+    parser.add_argument('--build-manifest', type=str, metavar='DIR',
+                        help='Write the manifest from every image under DIR and exit')
+    parser.add_argument('--output-dir', type=str, default='job_results', help='Directory for shard outputs')
+    parser.add_argument('--shard', type=int, default=0, help='Index of the shard to run')
+    parser.add_argument('--shards', type=int, default=1, help='Total number of shards')
+    parser.add_argument('--batch-size', type=int, default=8, help='Images per batch and checkpoint')
+    parser.add_argument('--confidence', type=float, default=0.7, help='Face detection confidence threshold')
+    parser.add_argument('--save-images', action='store_true', help='Also save annotated images')
+    parser.add_argument('--retry-errors', action='store_true', help='Process images that failed before again')
+    parser.add_argument('--engine', choices=['opencv', 'onnx', 'onnx-int8'], default='opencv',
+                        help='Inference engine, as for the age_predictor.py CLI')
+    parser.add_argument('--detector-size', type=int, default=300, help='Face detector input resolution')
+    parser.add_argument('--threads', type=int, help='Number of threads OpenCV may use')
+    parser.add_argument('--cache-db', type=str, help='SQLite result cache shared between runs and shards')
+    args = parser.parse_args()
+
+    if args.build_manifest:
+        count = build_manifest(args.build_manifest, args.manifest)
+        print(f"Wrote {count} image path(s) to {args.manifest}")
+        return
+
+    runner = JobRunner(args.manifest, args.output_dir, args.shard, args.shards, args.batch_size,
+                       args.confidence, args.save_images, args.retry_errors,
+                       engine=args.engine, detector_size=args.detector_size, threads=args.threads,
+                       cache_db=args.cache_db)
+
+    try:
+        progress = runner.run()
+    except KeyboardInterrupt:
+        print("\nStopped; run the same command again to resume")
+        return
+
+    if progress is not None:
+        print(f"Results in {runner.results_path} ({progress['done']}/{progress['total']} done, "
+              f"{progress['errors_this_run']} error(s) this run)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Opt-in timing instrumentation for the age predictor
+
+Collects per-stage timings and per-layer network timings, keeps rolling
+windows for percentiles plus cumulative histograms, and can dump
+everything in the Prometheus text exposition format.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class _StageTimer:
+    """Context manager recording the duration of one stage"""
+
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.stage, time.perf_counter_ns() - self.start)
+
+class StageMetrics:
+    """Rolling timing statistics for named processing stages
+
+    Each stage keeps its last window samples for percentiles, and running
+    totals and histogram buckets since creation for Prometheus.
+    """
+
+    def __init__(self, window=1000, layer_profiling=True):
+        self.window = window
+        self.layer_profiling = layer_profiling
+
+        self.samples = {}
+        self.counts = {}
+        self.totals = {}
+        self.buckets = {}
+
+        # Mean per-layer time in nanoseconds, per network
+        self.layer_totals = {}
+        self.layer_counts = {}
+
+        # Stages may be recorded from pipeline threads
+        self.lock = threading.Lock()
+
+    def time(self, stage):
+        """Return a context manager that records how long its block takes"""
+        return _StageTimer(self, stage)
+
+    def record(self, stage, duration_ns):
+        """Record one duration in nanoseconds for a stage"""
+        seconds = duration_ns / 1e9
+
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+                self.totals[stage] = 0
+                self.buckets[stage] = [0] * len(BUCKETS)
+
+            self.samples[stage].append(duration_ns)
+            self.counts[stage] += 1
+            self.totals[stage] += duration_ns
+
+            buckets = self.buckets[stage]
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+
+    def record_layers(self, name, net):
+        """Record per-layer timings of the last forward pass of a cv2.dnn net"""
+        if not self.layer_profiling:
+            return
+
+        _, layer_ticks = net.getPerfProfile()
+        layer_ns = np.asarray(layer_ticks, dtype=np.float64).ravel() * (1e9 / cv2.getTickFrequency())
+
+        with self.lock:
+            if name not in self.layer_totals:
+                self.layer_totals[name] = dict.fromkeys(net.getLayerNames(), 0.0)
+                self.layer_counts[name] = 0
+
+            totals = self.layer_totals[name]
+            for layer, duration in zip(totals, layer_ns):
+                totals[layer] += duration
+            self.layer_counts[name] += 1
+
+    def stats(self):
+        """Summarize every stage in milliseconds, plus mean layer timings"""
+        with self.lock:
+            stages = {}
+            for stage, samples in self.samples.items():
+                window = np.asarray(samples, dtype=np.float64) / 1e6
+                stages[stage] = {
+                    "count": self.counts[stage],
+                    "mean_ms": self.totals[stage] / self.counts[stage] / 1e6,
+                    "p50_ms": float(np.percentile(window, 50)),
+                    "p95_ms": float(np.percentile(window, 95)),
+                    "p99_ms": float(np.percentile(window, 99)),
+                    "max_ms": float(window.max()),
+                }
+
+            layers = {}
+            for name, totals in self.layer_totals.items():
+                count = self.layer_counts[name]
+                layers[name] = {layer: total / count / 1e6 for layer, total in totals.items()}
+
+        return {"stages": stages, "layers": layers}
+
+    def prometheus_text(self, prefix="age_predictor"):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each processing stage",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+
+        with self.lock:
+            for stage in self.samples:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, self.buckets[stage]):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self.counts[stage]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {self.totals[stage] / 1e9:.9f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {self.counts[stage]}')
+
+            if self.layer_totals:
+                lines.append(f"# HELP {prefix}_layer_seconds Mean forward time of each network layer")
+                lines.append(f"# TYPE {prefix}_layer_seconds gauge")
+
+                for name, totals in self.layer_totals.items():
+                    count = self.layer_counts[name]
+                    for layer, total in totals.items():
+                        lines.append(f'{prefix}_layer_seconds{{net="{name}",layer="{layer}"}} '
+                                     f'{total / count / 1e9:.9f}')
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="age_predictor"):
+        """Write the metrics to a file, e.g. for the node exporter textfile collector"""
+        temp_path = f"{path}.tmp"
+
+        with open(temp_path, "w") as f:
+            f.write(self.prometheus_text(prefix))
+
+        # Replace atomically so scrapers never see a partial file
+        os.replace(temp_path, path)
+
+# Shared no-op context used when instrumentation is disabled
+NO_TIMING = contextlib.nullcontext()
@@ -0,0 +1,132 @@
+"""
+Process-wide cache of loaded networks
+
+Parsing the face detector graph and the age model from disk takes a
+noticeable share of a short CLI run, so every AgePredictor in a process
+shares the nets loaded here instead of reading the files again. Models can
+be given as file paths or as in-memory buffers (bytes, bytearray, mmap or a
+uint8 array), and how long each load took is recorded.
+
+A cv2.dnn.Net keeps per-call state, so a shared net must not be used by two
+threads at the same time. Pass shared_models=False to AgePredictor, or use
+a separate ModelRegistry, to get private copies.
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from dnn_backends import configure_net
+
+# Functions that build a net from (model, config) buffers, by framework
+_READERS = {
+    "tensorflow": lambda model, config: cv2.dnn.readNetFromTensorflow(model, config),
+    "caffe": lambda model, config: cv2.dnn.readNetFromCaffe(config, model),
+}
+
+def _buffer_key(buffer):
+    """Identify an in-memory model by its contents"""
+    return "buffer:" + hashlib.blake2b(buffer, digest_size=16).hexdigest()
+
+def _path_key(path):
+    """Identify a model file by its path and modification time"""
+    path = os.path.abspath(path)
+    return f"{path}@{os.path.getmtime(path)}"
+
+def _as_array(buffer):
+    """View a bytes-like buffer as the uint8 array cv2.dnn expects"""
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+def _map_file(path):
+    """Memory-map a model file so it is read once, straight into the parser"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class ModelRegistry:
+    """Load each network once and hand the same instance to every caller"""
+
+    def __init__(self):
+        self.nets = {}
+        self.load_times = {}
+        self.lock = threading.Lock()
+
+    def key(self, framework, model, config=None):
+        """Cache key of a model, from its paths or its buffer contents"""
+        parts = [framework]
+        for source in (model, config):
+            if source is None:
+                parts.append("")
+            elif isinstance(source, (str, os.PathLike)):
+                parts.append(_path_key(source))
+            else:
+                parts.append(_buffer_key(source))
+
+        return "|".join(parts)
+
+    def _cache_key(self, framework, model, config, key, backend, target):
+        """Key of one configured copy of a net"""
+        if key is None:
+            key = self.key(framework, model, config)
+
+        return f"{key}|{backend or ''}|{target or ''}"
+
+    def get(self, framework, model, config=None, key=None, backend=None, target=None):
+        """Return the net for a model, loading it on first use
+
+        framework is "tensorflow" or "caffe". model and config are file paths
+        or bytes-like buffers. Buffers are identified by hashing their
+        contents; pass key to skip the hashing. Each backend and target
+        combination (see dnn_backends) gets its own copy of the net.
+        """
+        if framework not in _READERS:
+            raise ValueError(f"Unknown model framework: {framework}")
+
+        key = self._cache_key(framework, model, config, key, backend, target)
+
+        # Loading under the lock means concurrent callers wait for a single load
+        with self.lock:
+            net = self.nets.get(key)
+
+            if net is None:
+                net = configure_net(self.load(framework, model, config, key), backend, target)
+                self.nets[key] = net
+
+        return net
+
+    def load(self, framework, model, config=None, key=None):
+        """Read a net without caching it, recording how long it took"""
+        start = time.perf_counter()
+
+        buffers = []
+        for source in (model, config):
+            if source is None:
+                buffers.append(np.empty(0, dtype=np.uint8))
+            elif isinstance(source, (str, os.PathLike)):
+                buffers.append(_as_array(_map_file(source)))
+            else:
+                buffers.append(_as_array(source))
+
+        net = _READERS[framework](*buffers)
+
+        self.load_times[key or self.key(framework, model, config)] = time.perf_counter() - start
+        return net
+
+    def load_time(self, framework, model, config=None, key=None, backend=None, target=None):
+        """Seconds it took to load a model, or None if it isn't loaded"""
+        return self.load_times.get(self._cache_key(framework, model, config, key, backend, target))
+
+    def clear(self):
+        """Forget all loaded nets, e.g. to measure cold start-up"""
+        with self.lock:
+            self.nets.clear()
+            self.load_times.clear()
+
+# Registry shared by every AgePredictor in the process
+default_registry = ModelRegistry()
@@ -0,0 +1,208 @@
+"""
+Several video streams through one set of networks
+
+Each source is read on its own capture thread. The main loop takes the
+newest frame of every stream that has one and runs them all through
+AgePredictor.predict_batch(), so the detector and the age network see one
+batch per round instead of one call per stream, and the models are loaded
+once for every stream. Annotated frames and per-frame results go back to
+each stream's own VideoOutput.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+from video_output import VideoOutput
+from video_pipeline import VideoPipeline
+
+class StreamReader:
+    """Read one video source on a background thread, holding its newest frame
+
+    A live source replaces a frame that wasn't taken yet, counting it as
+    dropped, so every round sees the most recent frame. A file waits until
+    its frame is taken, so no frame is skipped.
+    """
+
+    def __init__(self, source, live=None):
+        self.source = source
+        self.cap = cv2.VideoCapture(source)
+        self.live = VideoPipeline.is_live_source(source) if live is None else live
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+
+        self.condition = threading.Condition()
+        self.item = None
+        self.finished = False
+        self.stopped = False
+        self.dropped = 0
+
+        self.thread = None
+
+    def start(self, frame_ready):
+        """Start reading, setting frame_ready whenever a new frame is available"""
+        self.thread = threading.Thread(target=self._run, args=(frame_ready,),
+                                       name=f"capture-{self.source}", daemon=True)
+        self.thread.start()
+
+    def _run(self, frame_ready):
+        index = 0
+
+        while True:
+            ret, frame = self.cap.read()
+
+            with self.condition:
+                if self.live:
+                    if self.item is not None:
+                        self.dropped += 1
+                else:
+                    while self.item is not None and not self.stopped:
+                        self.condition.wait()
+
+                if not ret or self.stopped:
+                    self.finished = True
+                    break
+
+                self.item = (index, frame)
+
+            frame_ready.set()
+            index += 1
+
+        self.cap.release()
+        frame_ready.set()
+
+    def take(self):
+        """Return the held (index, frame) pair and release it, or None"""
+        with self.condition:
+            item = self.item
+            self.item = None
+            self.condition.notify()
+
+        return item
+
+    @property
+    def done(self):
+        """Whether the source has ended and its last frame was taken"""
+        return self.finished and self.item is None
+
+    def stop(self):
+        """Ask the capture thread to finish and wait for it"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+
+def stream_path(path, index):
+    """Per-stream output path, e.g. out.mp4 becomes out-0.mp4"""
+    if not path:
+        return None
+
+    base, extension = os.path.splitext(path)
+    return f"{base}-{index}{extension}"
+
+class MultiStreamProcessor:
+    """Run AgePredictor over several video sources with shared, batched inference
+
+    output_path and results_path are templates: stream i writes to the path
+    with -i inserted before the extension (see stream_path). With display,
+    every stream gets its own window.
+    """
+
+    def __init__(self, predictor, output_path=None, results_path=None, display=True,
+                 confidence_threshold=0.7):
+        self.predictor = predictor
+        self.output_path = output_path
+        self.results_path = results_path
+        self.display = display
+        self.confidence_threshold = confidence_threshold
+
+    def run(self, sources):
+        """Process every source until all have ended or 'q' is pressed
+
+        Returns a summary with per-stream frame, face and drop counts plus
+        the number of batches and their mean size, or None if a source
+        can't be opened.
+        """
+        readers = [StreamReader(source) for source in sources]
+
+        for reader in readers:
+            if not reader.cap.isOpened():
+                print(f"Error: Could not open video source {reader.source}")
+                for other in readers:
+                    other.cap.release()
+                return None
+
+        outputs = [VideoOutput(stream_path(self.output_path, index), stream_path(self.results_path, index),
+                               self.display, fps=reader.fps, window_name=f"Age Prediction {index}: {reader.source}")
+                   for index, reader in enumerate(readers)]
+
+        frame_ready = threading.Event()
+        for reader in readers:
+            reader.start(frame_ready)
+
+        if self.display:
+            print("Press 'q' to quit")
+
+        batches = 0
+        batched_frames = 0
+        start_time = time.perf_counter()
+        stopped = False
+
+        while not stopped and not all(reader.done for reader in readers):
+            # Clear before taking so a frame arriving meanwhile wakes the next wait
+            frame_ready.clear()
+
+            streams = []
+            for index, reader in enumerate(readers):
+                item = reader.take()
+                if item is not None:
+                    streams.append((index, *item))
+
+            if not streams:
+                frame_ready.wait(0.1)
+                continue
+
+            # One detector batch and one age batch for the newest frame of every stream
+            results = self.predictor.predict_batch([frame for _, _, frame in streams],
+                                                   self.confidence_threshold)
+            batches += 1
+            batched_frames += len(streams)
+
+            for (index, frame_index, frame), frame_results in zip(streams, results):
+                output = outputs[index]
+                # Frames aren't tracked, so faces have no track ID; identity is set with a face index
+                faces = [(result.box, result.age_range, result.age_confidence, None, result.identity)
+                         for result in frame_results]
+
+                if output.needs_frames:
+                    with self.predictor._stage("draw"):
+                        for box, predicted_age, *_ in faces:
+                            self.predictor._draw_video_face(frame, box, predicted_age)
+
+                if not output.write(frame_index, frame, faces):
+                    stopped = True
+
+        for reader in readers:
+            reader.stop()
+
+        elapsed = time.perf_counter() - start_time
+        summary = {"streams": [], "batches": batches,
+                   "mean_batch_frames": batched_frames / batches if batches else 0.0,
+                   "frames": batched_frames, "seconds": elapsed,
+                   "fps": batched_frames / elapsed if elapsed > 0 else 0.0}
+
+        for index, (reader, output) in enumerate(zip(readers, outputs)):
+            print(f"Stream {index} ({reader.source}):")
+            stats = output.close()
+            stats["source"] = str(reader.source)
+            stats["dropped"] = reader.dropped
+            summary["streams"].append(stats)
+
+        print(f"{len(readers)} stream(s): {batched_frames} frames in {batches} batches "
+              f"(mean {summary['mean_batch_frames']:.1f} frames per batch), "
+              f"{summary['fps']:.1f} FPS in total, {sum(reader.dropped for reader in readers)} dropped")
+
+        return summary
@@ -0,0 +1,252 @@
+"""
+ONNX Runtime engine for the age predictor
+
+OnnxAgePredictor runs the models written by export_onnx.py on ONNX Runtime's
+CPU provider with all graph optimizations enabled. It is a drop-in
+replacement for AgePredictor: only the two forward passes differ, so
+detection, batching, drawing and video processing behave the same.
+"""
+
+import json
+
+import numpy as np
+
+from age_predictor import AgePredictor
+from export_onnx import AGE_ONNX, FACE_ONNX
+from face_index import EMBEDDING_LAYER
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+def prior_boxes(feature_shapes, image_width, image_height, priors):
+    """Generate SSD prior boxes the way the Caffe/OpenCV PriorBox layer does
+
+    Returns (boxes, variances), both (P, 4), with boxes as normalized
+    x1, y1, x2, y2.
+    """
+    boxes = []
+    variances = []
+
+    for (rows, columns), prior in zip(feature_shapes, priors):
+        # Box sizes in pixels: the minimum size, the geometric mean of the
+        # minimum and maximum sizes, then each aspect ratio and its inverse
+        sizes = [(prior["min_size"], prior["min_size"])]
+        if prior["max_size"]:
+            side = np.sqrt(prior["min_size"] * prior["max_size"])
+            sizes.append((side, side))
+        for ratio in prior["aspect_ratios"]:
+            if abs(ratio - 1.0) < 1e-6:
+                continue
+            for r in ([ratio, 1.0 / ratio] if prior["flip"] else [ratio]):
+                sizes.append((prior["min_size"] * np.sqrt(r), prior["min_size"] / np.sqrt(r)))
+
+        step_x = prior["step"] or image_width / columns
+        step_y = prior["step"] or image_height / rows
+        center_x = (np.arange(columns) + prior["offset"]) * step_x
+        center_y = (np.arange(rows) + prior["offset"]) * step_y
+        center_x, center_y = np.meshgrid(center_x, center_y)
+
+        sizes = np.asarray(sizes, dtype=np.float64)
+        half_width = sizes[:, 0] / 2
+        half_height = sizes[:, 1] / 2
+
+        # Shape (rows, columns, sizes, 4), in the order the box regressions use
+        level = np.stack([
+            (center_x[..., None] - half_width) / image_width,
+            (center_y[..., None] - half_height) / image_height,
+            (center_x[..., None] + half_width) / image_width,
+            (center_y[..., None] + half_height) / image_height,
+        ], axis=-1).reshape(-1, 4)
+
+        if prior["clip"]:
+            level = np.clip(level, 0.0, 1.0)
+
+        boxes.append(level)
+        variances.append(np.tile(prior["variance"], (len(level), 1)))
+
+    return np.concatenate(boxes).astype(np.float32), np.concatenate(variances).astype(np.float32)
+
+def decode_boxes(locations, boxes, variances):
+    """Apply center-size box regressions to prior boxes"""
+    prior_width = boxes[:, 2] - boxes[:, 0]
+    prior_height = boxes[:, 3] - boxes[:, 1]
+    prior_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    prior_y = (boxes[:, 1] + boxes[:, 3]) / 2
+
+    center_x = variances[:, 0] * locations[:, 0] * prior_width + prior_x
+    center_y = variances[:, 1] * locations[:, 1] * prior_height + prior_y
+    width = np.exp(variances[:, 2] * locations[:, 2]) * prior_width
+    height = np.exp(variances[:, 3] * locations[:, 3]) * prior_height
+
+    return np.stack([center_x - width / 2, center_y - height / 2,
+                     center_x + width / 2, center_y + height / 2], axis=1)
+
+def non_max_suppression(boxes, scores, score_threshold, nms_threshold, top_k):
+    """Greedy NMS over normalized boxes, as in the Caffe SSD DetectionOutput layer
+
+    Unlike cv2.dnn.NMSBoxes, boxes that were clipped to zero area never
+    suppress each other. Returns the indices of the kept boxes, best first.
+    """
+    candidates = np.flatnonzero(scores > score_threshold)
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")][:top_k]
+
+    areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+    keep = []
+
+    for index in candidates:
+        if keep:
+            kept = np.asarray(keep)
+            width = np.minimum(boxes[kept, 2], boxes[index, 2]) - np.maximum(boxes[kept, 0], boxes[index, 0])
+            height = np.minimum(boxes[kept, 3], boxes[index, 3]) - np.maximum(boxes[kept, 1], boxes[index, 1])
+            intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+            union = areas[kept] + areas[index] - intersection
+
+            overlap = np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+            if (overlap > nms_threshold).any():
+                continue
+
+        keep.append(index)
+
+    return np.asarray(keep, dtype=np.int64)
+
+class OnnxAgePredictor(AgePredictor):
+    """AgePredictor running both networks on ONNX Runtime
+
+    Takes the same options as AgePredictor plus the paths of the exported
+    models. threads sets ONNX Runtime's intra-op thread count as well as
+    OpenCV's. Unlike cv2.dnn, the exported detector handles batches, so
+    detect_faces_batch() runs a single forward pass per batch.
+    """
+
+    def __init__(self, face_onnx=FACE_ONNX, age_onnx=AGE_ONNX, **options):
+        super().__init__(**options)
+
+        self.face_onnx = face_onnx
+        self.age_onnx = age_onnx
+        self.threads = options.get("threads")
+
+        self.face_session = None
+        self.age_session = None
+
+        # Prior boxes depend only on the detector input size, so cache them
+        self.prior_cache = {}
+
+    def _session(self, path):
+        """Create an ONNX Runtime CPU session with full graph optimization"""
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        if self.threads is not None:
+            session_options.intra_op_num_threads = self.threads
+
+        return onnxruntime.InferenceSession(path, session_options, providers=["CPUExecutionProvider"])
+
+    def load_models(self):
+        """Load the exported ONNX models"""
+        if onnxruntime is None:
+            print("Error: onnxruntime is required, install it with 'pip install onnxruntime'")
+            return False
+
+        try:
+            self.face_session = self._session(self.face_onnx)
+            self.age_session = self._session(self.age_onnx)
+
+            metadata = self.face_session.get_modelmeta().custom_metadata_map
+            self.priors = json.loads(metadata["priors"])
+            self.detection_output = json.loads(metadata["detection_output"])
+
+            print("ONNX models loaded successfully!")
+            return True
+
+        except Exception as e:
+            print(f"Error loading ONNX models: {e}")
+            print("Run 'python export_onnx.py' to create them")
+            return False
+
+    def _model_keys(self):
+        """Identify the exported ONNX models rather than the cv2.dnn ones"""
+        return [self.registry.key("onnx", self.face_onnx, self.age_onnx)]
+
+    def _model_sources(self):
+        """The ONNX model sources and their sessions"""
+        return (self.face_onnx, self.age_onnx, self.face_session, self.age_session)
+
+    def _ensure_loaded(self):
+        """Load the sessions on first use, like the cv2.dnn nets"""
+        if self.face_session is None and not self.load_models():
+            raise RuntimeError("ONNX models are not available")
+
+    def _forward_detector(self, blob):
+        """Run the face detector and decode its output like the DetectionOutput layer"""
+        self._ensure_loaded()
+
+        with self._stage("detect_forward"):
+            locations, scores, feature_shapes = self.face_session.run(None, {"data": blob})
+
+        height, width = blob.shape[2:]
+        key = (height, width)
+        if key not in self.prior_cache:
+            self.prior_cache[key] = prior_boxes(feature_shapes.reshape(-1, 2), width, height, self.priors)
+        boxes, variances = self.prior_cache[key]
+
+        with self._stage("detect_decode"):
+            rows = [self._detection_output(index, locations[index].reshape(-1, 4),
+                                           scores[index].reshape(-1, self.detection_output["num_classes"]),
+                                           boxes, variances)
+                    for index in range(len(blob))]
+
+        detections = np.concatenate(rows) if rows else np.zeros((0, 7), dtype=np.float32)
+        return detections[None, None]
+
+    def _detection_output(self, index, locations, scores, boxes, variances):
+        """Per-image score filtering and non-maximum suppression, one row per face"""
+        settings = self.detection_output
+        decoded = decode_boxes(locations, boxes, variances)
+
+        if settings["clip"]:
+            decoded = np.clip(decoded, 0.0, 1.0)
+
+        rows = []
+        for label in range(settings["num_classes"]):
+            if label == settings["background_label_id"]:
+                continue
+
+            confidences = scores[:, label]
+            keep = non_max_suppression(decoded, confidences, settings["confidence_threshold"],
+                                       settings["nms_threshold"], settings["top_k"])
+
+            if len(keep):
+                rows.append(np.column_stack([
+                    np.full(len(keep), index), np.full(len(keep), label),
+                    confidences[keep], decoded[keep]]))
+
+        if not rows:
+            return np.zeros((0, 7), dtype=np.float32)
+
+        rows = np.concatenate(rows)
+        rows = rows[np.argsort(-rows[:, 2], kind="stable")][:settings["keep_top_k"]]
+        return rows.astype(np.float32)
+
+    def _forward_age(self, blob):
+        """Run the age network and return one probability row per face"""
+        self._ensure_loaded()
+
+        with self._stage("age_forward"):
+            return self.age_session.run(None, {self.age_session.get_inputs()[0].name: blob})[0]
+
+    def _forward_age_embeddings(self, blob):
+        """Run the age network and return its probabilities and face descriptors"""
+        self._ensure_loaded()
+
+        outputs = [output.name for output in self.age_session.get_outputs()]
+        if EMBEDDING_LAYER not in outputs:
+            raise RuntimeError(f"{self.age_onnx} has no {EMBEDDING_LAYER} output, "
+                               "re-run 'python export_onnx.py' to add it")
+
+        with self._stage("age_forward"):
+            age_preds, embeddings = self.age_session.run(
+                [outputs[0], EMBEDDING_LAYER], {self.age_session.get_inputs()[0].name: blob})
+
+        return age_preds, embeddings
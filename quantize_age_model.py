@@ -0,0 +1,217 @@
+"""
+Build an INT8 version of the age network and report its accuracy and speed
+
+Statically quantizes the ONNX age model written by export_onnx.py with
+ONNX Runtime: weights become per-channel int8, and activation ranges are
+calibrated on faces detected in a local image folder. The report compares
+the INT8 model with the float model on the same faces: top-1 age range
+agreement, probability drift, per-face latency and file size.
+
+Usage:
+    python export_onnx.py
+    python quantize_age_model.py --calibration path/to/images --evaluation path/to/other/images
+    python age_predictor.py --image photo.jpg --engine onnx-int8
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from age_predictor import AGE_MODEL_MEAN_VALUES, AgePredictor, find_image_files
+from export_onnx import AGE_ONNX
+
+try:
+    import onnxruntime
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+except ImportError:
+    onnxruntime = None
+    CalibrationDataReader = object
+
+# Output file written by default and picked up by --engine onnx-int8
+AGE_INT8_ONNX = "age_net_int8.onnx"
+
+# Faces per forward pass when comparing the models; one 227x227 face is
+# about 0.6 MB of input before activations
+COMPARE_BATCH_SIZE = 32
+
+def collect_faces(directory, max_faces=500):
+    """Detect faces in the images of a folder and return the crops"""
+    predictor = AgePredictor()
+    if not predictor.load_models():
+        return []
+
+    faces = []
+    for path in find_image_files(directory):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+
+        _, crops = predictor._crop_faces(image, predictor.detect_faces(image))
+        faces.extend(crops)
+
+        if len(faces) >= max_faces:
+            break
+
+    return faces[:max_faces]
+
+def face_blob(faces):
+    """NCHW blob of faces, preprocessed like AgePredictor.predict_ages"""
+    return cv2.dnn.blobFromImages(faces, 1.0, (227, 227), AGE_MODEL_MEAN_VALUES, swapRB=False)
+
+class FaceCalibrationReader(CalibrationDataReader):
+    """Feeds face crops to the quantizer in small batches"""
+
+    def __init__(self, faces, input_name, batch_size=8):
+        # Blobs are built as the quantizer asks for them, not all up front
+        self.batches = (face_blob(faces[start:start + batch_size])
+                        for start in range(0, len(faces), batch_size))
+        self.input_name = input_name
+
+    def get_next(self):
+        blob = next(self.batches, None)
+        return None if blob is None else {self.input_name: blob}
+
+def _session(path):
+    """Single-model CPU session with full graph optimization"""
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def quantize_age_model(faces, float_model=AGE_ONNX, output=AGE_INT8_ONNX):
+    """Quantize the age model to INT8 using faces for calibration"""
+    input_name = _session(float_model).get_inputs()[0].name
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Shape inference and graph cleanup let more nodes be quantized; all
+        # shapes but the batch size are static, so ONNX shape inference is enough
+        prepared = os.path.join(directory, "age_net_prepared.onnx")
+        quant_pre_process(float_model, prepared, skip_symbolic_shape=True)
+
+        quantize_static(prepared, output, FaceCalibrationReader(faces, input_name),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=CalibrationMethod.MinMax)
+
+    return output
+
+def _probabilities(session, faces, batch_size=COMPARE_BATCH_SIZE):
+    """Age probabilities for every face, run in fixed-size batches"""
+    feed_name = session.get_inputs()[0].name
+    output_name = session.get_outputs()[0].name
+
+    return np.concatenate([session.run([output_name], {feed_name: face_blob(faces[start:start + batch_size])})[0]
+                           for start in range(0, len(faces), batch_size)])
+
+def _latency_ms(session, faces, batch_size, repeats):
+    """Median milliseconds per face of running batches of batch_size faces through a session
+
+    Each repeat runs the next batch of faces, wrapping around, and only one
+    batch is held at a time.
+    """
+    feed_name = session.get_inputs()[0].name
+    output_name = session.get_outputs()[0].name
+
+    def batch(index):
+        start = index * batch_size
+        return face_blob([faces[(start + offset) % len(faces)] for offset in range(batch_size)])
+
+    session.run([output_name], {feed_name: batch(0)})
+
+    timings = []
+    for index in range(repeats):
+        feed = {feed_name: batch(index)}
+        start = time.perf_counter()
+        session.run([output_name], feed)
+        timings.append((time.perf_counter() - start) * 1000 / batch_size)
+
+    return float(np.median(timings))
+
+def compare_models(faces, float_model=AGE_ONNX, int8_model=AGE_INT8_ONNX, repeats=10):
+    """Compare the INT8 model with the float model on a list of faces"""
+    float_session = _session(float_model)
+    int8_session = _session(int8_model)
+
+    float_probs = _probabilities(float_session, faces)
+    int8_probs = _probabilities(int8_session, faces)
+
+    report = {
+        "faces": len(faces),
+        "top1_agreement": float(np.mean(float_probs.argmax(axis=1) == int8_probs.argmax(axis=1))),
+        "mean_probability_error": float(np.abs(float_probs - int8_probs).mean()),
+        "max_probability_error": float(np.abs(float_probs - int8_probs).max()),
+        "float_size_mb": os.path.getsize(float_model) / 1e6,
+        "int8_size_mb": os.path.getsize(int8_model) / 1e6,
+    }
+
+    for batch_size in (1, 8):
+        report[f"float_ms_per_face_batch{batch_size}"] = _latency_ms(float_session, faces, batch_size, repeats)
+        report[f"int8_ms_per_face_batch{batch_size}"] = _latency_ms(int8_session, faces, batch_size, repeats)
+
+    return report
+
+def print_report(report):
+    """Print the comparison as a short table"""
+    print(f"\nINT8 vs float age model on {report['faces']} face(s):")
+    print(f"  Top-1 age range agreement: {report['top1_agreement']:.1%}")
+    print(f"  Probability error:         mean {report['mean_probability_error']:.4f}, "
+          f"max {report['max_probability_error']:.4f}")
+    print(f"  Model size:                {report['float_size_mb']:.1f} MB -> {report['int8_size_mb']:.1f} MB")
+
+    for batch_size in (1, 8):
+        float_ms = report[f"float_ms_per_face_batch{batch_size}"]
+        int8_ms = report[f"int8_ms_per_face_batch{batch_size}"]
+        print(f"  Latency, batch {batch_size}:          {float_ms:.2f} ms -> {int8_ms:.2f} ms per face "
+              f"({float_ms / int8_ms:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the age model to INT8 and compare it with float')
+    parser.add_argument('--calibration', type=str, required=True,
+                        help='Folder of images whose faces are used to calibrate activation ranges')
+    parser.add_argument('--evaluation', type=str,
+                        help='Folder of images to compare the models on (default: the calibration folder)')
+    parser.add_argument('--float-model', type=str, default=AGE_ONNX, help='Float ONNX age model from export_onnx.py')
+    parser.add_argument('--output', type=str, default=AGE_INT8_ONNX, help='Path for the INT8 model')
+    parser.add_argument('--max-faces', type=int, default=500, help='Maximum number of faces per folder')
+    parser.add_argument('--report', type=str, help='Path to save the comparison as JSON')
+    args = parser.parse_args()
+
+    if onnxruntime is None:
+        print("Error: onnxruntime is required, install it with 'pip install onnx onnxruntime'")
+        return
+
+    if not os.path.exists(args.float_model):
+        print(f"Error: {args.float_model} not found, run 'python export_onnx.py' first")
+        return
+
+    faces = collect_faces(args.calibration, args.max_faces)
+    if not faces:
+        print(f"Error: no faces found in {args.calibration}")
+        return
+
+    print(f"Calibrating on {len(faces)} face(s) from {args.calibration}")
+    quantize_age_model(faces, args.float_model, args.output)
+    print(f"INT8 age model saved to {args.output}")
+
+    if args.evaluation:
+        faces = collect_faces(args.evaluation, args.max_faces)
+        if not faces:
+            print(f"Error: no faces found in {args.evaluation}")
+            return
+
+    report = compare_models(faces, args.float_model, args.output)
+    print_report(report)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,15 @@ Quick test script for the age predictor
 
 import os
 import glob
-from age_predictor import AgePredictor
+from age_predictor import AgePredictor, is_result_image
+from result_cache import print_cache_stats
 import cv2
 
+# Results of images tested before are reused from here instead of re-running the models
+CACHE_DB = "age_predictor_cache.sqlite"
+
 def find_image_files():
-    """Find all image files in the current directory"""
+    """Find all image files in the current directory, skipping earlier results"""
     extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff']
     image_files = []
     
@@ -16,7 +20,7 @@ def find_image_files():
         image_files.extend(glob.glob(ext))
         image_files.extend(glob.glob(ext.upper()))
     
-    return image_files
+    return [path for path in image_files if not is_result_image(path)]
 
 def main():
     """Quick test with available images"""
@@ -25,7 +29,7 @@ def main():
     print("=" * 30)
     
     # Initialize predictor
-    predictor = AgePredictor()
+    predictor = AgePredictor(cache_db=CACHE_DB)
     
     if not predictor.load_models():
         print("Failed to load models!")
@@ -46,22 +50,23 @@ def main():
     print("\nProcessing all images...")
     print("-" * 30)
     
-    for img_file in image_files:
-        print(f"\nProcessing: {img_file}")
-        
-        try:
-            result = predictor.process_image(img_file)
-            
-            if result is not None:
-                # Save result
-                output_name = f"result_{os.path.splitext(img_file)[0]}.jpg"
-                cv2.imwrite(output_name, result)
-                print(f"  ✓ Result saved as: {output_name}")
-            else:
-                print(f"  ✗ Failed to process {img_file}")
-                
-        except Exception as e:
-            print(f"  ✗ Error processing {img_file}: {e}")
+    try:
+        # Detect faces and predict ages for several images per forward pass
+        results = predictor.process_batch(image_files, batch_size=8)
+    except Exception as e:
+        print(f"  ✗ Error processing images: {e}")
+        return
+    
+    for img_file, result in zip(image_files, results):
+        if result is not None:
+            # Save result
+            output_name = f"result_{os.path.splitext(img_file)[0]}.jpg"
+            cv2.imwrite(output_name, result)
+            print(f"  ✓ Result saved as: {output_name}")
+        else:
+            print(f"  ✗ Failed to process {img_file}")
+    
+    print_cache_stats(predictor.result_cache)
     
     print("\n🎉 Processing complete!")
     print("\nTo test with webcam, run:")
@@ -0,0 +1,260 @@
+"""
+Real-time budget scheduling for live video
+
+A live stream doesn't wait for the processing: a frame that takes longer
+than the frame interval leaves older frames queued behind it, and the
+displayed faces fall further behind reality. RealtimeScheduler keeps the
+processing on the source clock instead. Frames that are already late are
+dropped with grab(), which skips decoding them, and the measured cost of
+each stage is used to trade accuracy for speed until frames fit the
+budget again.
+"""
+
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from age_predictor import MIN_DETECTOR_SIZE
+
+# Processed frames averaged before each adjustment
+ADAPT_EVERY = 10
+
+# Once frames take less than this fraction of the budget, the last
+# adjustment is undone
+RECOVER_FRACTION = 0.6
+
+# Limits of the adjustments
+MAX_AGE_EVERY = 32
+MAX_DETECT_EVERY = 8
+
+# Detector input sizes stepped down through, ending at the smallest the
+# graph accepts. On a 720p frame the detector took 230, 110, 72 and 37 ms
+# at 640, 480, 352 and 288, and 45 ms at the default 300.
+DETECTOR_SIZES = (640, 480, 352, MIN_DETECTOR_SIZE)
+
+# A smaller detector input is kept only if it cuts the cost of a detector
+# run by at least this fraction
+MIN_DETECT_GAIN = 0.05
+
+# Frame costs kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+class RealtimeScheduler:
+    """Keep video processing within a per-frame time budget
+
+    The budget is 1 / target_fps or latency_budget seconds, whichever is
+    smaller. Frames behind the source clock, and frames above target_fps,
+    are dropped. Every adapt_every processed frames the mean frame cost is
+    compared with the budget. When it is over, the scheduler makes the
+    stage that costs most cheaper, one step at a time:
+
+        age      reuse the ages of labelled faces for more frames (age_every)
+        detect   run the detector less often and track in between (detect_every)
+                 or, once that is at its limit, step the detector input down
+                 through DETECTOR_SIZES
+
+    The graph doesn't accept inputs below MIN_DETECTOR_SIZE, so the input
+    size is a short lever. A size step that doesn't measurably lower the
+    detection cost in the next window is undone and not tried again.
+    Adjustments are undone in reverse order once frames cost less than
+    RECOVER_FRACTION of the budget.
+    """
+
+    def __init__(self, predictor, tracker, target_fps=None, latency_budget=None, source_fps=None,
+                 adapt_every=ADAPT_EVERY):
+        budgets = [budget for budget in (1.0 / target_fps if target_fps else None, latency_budget) if budget]
+        if not budgets:
+            raise ValueError("Real-time scheduling needs a target FPS or a latency budget")
+
+        self.predictor = predictor
+        self.tracker = tracker
+        self.budget = min(budgets)
+        self.target_fps = target_fps
+        self.source_fps = source_fps if source_fps and source_fps > 0 else 30.0
+        self.adapt_every = max(1, int(adapt_every))
+
+        # Stack of (setting, previous value) for every adjustment in force
+        self.adjustments = []
+
+        # Cost of a detector run before the last detector size step, until a
+        # later window with detections confirms the step helped
+        self.size_check = None
+        self.size_exhausted = False
+
+        # Per-stage seconds summed over the frames since the last adjustment
+        self.window = {"frame": 0.0, "detect": 0.0, "track": 0.0, "age": 0.0}
+        self.window_frames = 0
+        self.window_detections = 0
+
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.processed = 0
+        self.dropped = 0
+        self.over_budget = 0
+        self.changes = 0
+        self.start_time = None
+
+    def frames(self, capture):
+        """Yield (source frame index, frame) pairs to process from a capture
+
+        The time between one frame being yielded and the next request is
+        that frame's cost, so the caller should do all of its per-frame work,
+        drawing and output included, before asking for the next frame.
+        """
+        index = 0
+        last_time = None
+
+        self.start_time = time.perf_counter()
+
+        while True:
+            elapsed = time.perf_counter() - self.start_time
+
+            if last_time is not None:
+                # Frame currently on air, and the next one the target rate allows
+                wanted = math.floor(elapsed * self.source_fps)
+                if self.target_fps:
+                    wanted = max(wanted, math.ceil((last_time + 1.0 / self.target_fps) * self.source_fps - 1e-6))
+
+                # grab() advances the stream without decoding the frame
+                while index < wanted:
+                    if not capture.grab():
+                        return
+                    index += 1
+                    self.dropped += 1
+
+            with self.predictor._stage("video_read"):
+                ret, frame = capture.read()
+
+            if not ret:
+                return
+
+            started = time.perf_counter()
+            yield index, frame
+            self.record(time.perf_counter() - started)
+
+            last_time = index / self.source_fps
+            index += 1
+
+    def record(self, seconds):
+        """Account for one processed frame and adjust the settings when due"""
+        self.processed += 1
+        self.latencies.append(seconds)
+        if seconds > self.budget:
+            self.over_budget += 1
+
+        self.window["frame"] += seconds
+        for stage, stage_seconds in self.tracker.timings.items():
+            self.window[stage] += stage_seconds
+        self.window_frames += 1
+        if self.tracker.timings["detect"]:
+            self.window_detections += 1
+
+        if self.window_frames >= self.adapt_every:
+            self._adapt()
+
+    def _adapt(self):
+        """Degrade or restore one setting based on the last window of frames"""
+        frame_cost = self.window["frame"] / self.window_frames
+        stage_costs = {stage: self.window[stage] for stage in ("detect", "age")}
+        detect_cost = stage_costs["detect"] / self.window_detections if self.window_detections else None
+
+        self.window = dict.fromkeys(self.window, 0.0)
+        self.window_frames = 0
+        self.window_detections = 0
+
+        # Nothing else changes until a detector size step has been judged
+        if self.size_check is not None:
+            if detect_cost is None:
+                return
+
+            previous_cost, self.size_check = self.size_check, None
+            if detect_cost > previous_cost * (1.0 - MIN_DETECT_GAIN):
+                # The smaller input didn't pay for its lost accuracy
+                self.size_exhausted = True
+                setting, value = self.adjustments.pop()
+                self._apply(setting, value, frame_cost, "restored")
+                return
+
+        if frame_cost > self.budget:
+            # Make the most expensive stage cheaper; fall back to the other one
+            for stage in sorted(stage_costs, key=stage_costs.get, reverse=True):
+                if self._degrade(stage, frame_cost, detect_cost):
+                    return
+        elif frame_cost < self.budget * RECOVER_FRACTION and self.adjustments:
+            setting, value = self.adjustments.pop()
+            self._apply(setting, value, frame_cost, "restored")
+
+    def _degrade(self, stage, frame_cost, detect_cost):
+        """Make one stage cheaper, returning False when it is at its limit
+
+        detect_cost is the mean cost of a detector run in the last window, or
+        None if the detector didn't run.
+        """
+        tracker = self.tracker
+
+        if stage == "age" and tracker.age_every < MAX_AGE_EVERY:
+            change = ("age_every", min(MAX_AGE_EVERY, tracker.age_every * 2))
+        elif stage == "detect" and tracker.detect_every < MAX_DETECT_EVERY:
+            change = ("detect_every", min(MAX_DETECT_EVERY, tracker.detect_every * 2))
+        elif (stage == "detect" and detect_cost is not None and not self.size_exhausted
+              and self.predictor.detector_size > MIN_DETECTOR_SIZE):
+            size = next(size for size in DETECTOR_SIZES if size < self.predictor.detector_size)
+            change = ("detector_size", size)
+            self.size_check = detect_cost
+        else:
+            return False
+
+        setting, value = change
+        self.adjustments.append((setting, self._get(setting)))
+        self._apply(setting, value, frame_cost, "lowered")
+        return True
+
+    def _get(self, setting):
+        owner = self.predictor if setting == "detector_size" else self.tracker
+        return getattr(owner, setting)
+
+    def _apply(self, setting, value, frame_cost, action):
+        owner = self.predictor if setting == "detector_size" else self.tracker
+        setattr(owner, setting, value)
+        self.changes += 1
+
+        print(f"Real-time: {action} {setting} to {value} "
+              f"(frames took {frame_cost * 1000:.1f} ms, budget {self.budget * 1000:.1f} ms)")
+
+    def summary(self):
+        """Achieved throughput, drops, frame latency and the final settings"""
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.0
+        seen = self.processed + self.dropped
+        latencies_ms = np.asarray(self.latencies) * 1000
+
+        summary = {
+            "budget_ms": self.budget * 1000,
+            "achieved_fps": self.processed / elapsed if elapsed > 0 else 0.0,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "drop_rate": self.dropped / seen if seen else 0.0,
+            "over_budget": self.over_budget,
+            "adjustments": self.changes,
+            "detect_every": self.tracker.detect_every,
+            "age_every": self.tracker.age_every,
+            "detector_size": self.predictor.detector_size,
+        }
+
+        if len(latencies_ms):
+            summary["frame_p50_ms"] = float(np.percentile(latencies_ms, 50))
+            summary["frame_p95_ms"] = float(np.percentile(latencies_ms, 95))
+
+        return summary
+
+def print_realtime_summary(summary):
+    """Print the real-time summary returned by RealtimeScheduler.summary()"""
+    print(f"Real-time: {summary['achieved_fps']:.1f} FPS achieved for a {summary['budget_ms']:.1f} ms budget, "
+          f"{summary['dropped']} of {summary['processed'] + summary['dropped']} frame(s) dropped "
+          f"({summary['drop_rate']:.0%}), {summary['over_budget']} over budget")
+
+    if "frame_p50_ms" in summary:
+        print(f"  Frame cost: p50 {summary['frame_p50_ms']:.1f} ms, p95 {summary['frame_p95_ms']:.1f} ms")
+
+    print(f"  Final settings: detect every {summary['detect_every']}, age every {summary['age_every']}, "
+          f"detector size {summary['detector_size']}")
@@ -0,0 +1,264 @@
+"""
+Content-addressed cache of age prediction results
+
+Images that are processed again (reposts, retried thumbnails) are
+recognised by a hash of their encoded bytes, so both networks can be
+skipped. Keys also cover the models and detection settings that produced
+the results, so changing either never returns stale faces.
+
+Results live in an in-memory LRU tier bounded by size, and optionally in a
+SQLite file that survives restarts and can be shared between processes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import StageMetrics
+
+# Rough per-entry and per-face memory overhead of the Python objects held
+# for each cached result, on top of the probability arrays
+ENTRY_OVERHEAD_BYTES = 200
+FACE_OVERHEAD_BYTES = 300
+
+# Seconds SQLite waits for another process's lock before giving up; a
+# lookup that gives up counts as a miss and a write is skipped
+BUSY_TIMEOUT = 1.0
+
+# After a lock error the SQLite tier is left alone for this many seconds,
+# so a long-held lock doesn't cost BUSY_TIMEOUT on every call
+LOCK_BACKOFF = 5.0
+
+# Writes to the SQLite tier are committed in groups of this many, or once
+# the oldest uncommitted write is this many seconds old
+COMMIT_EVERY = 32
+COMMIT_INTERVAL = 1.0
+
+def content_key(data, version=""):
+    """Cache key for encoded image bytes produced under a model/settings version"""
+    digest = hashlib.blake2b(version.encode(), digest_size=16)
+    digest.update(data)
+    return digest.hexdigest()
+
+def _entry_size(key, results):
+    """Approximate memory held by one cached entry"""
+    return (ENTRY_OVERHEAD_BYTES + len(key)
+            + sum(FACE_OVERHEAD_BYTES + result.probabilities.nbytes for result in results))
+
+def _encode(results):
+    """Serialize a list of FaceResult for the SQLite tier"""
+    return json.dumps([[list(result.box), result.confidence, result.age_index, result.age_range,
+                        result.probabilities.tolist()] for result in results])
+
+def _decode(value):
+    """Rebuild the list of FaceResult written by _encode"""
+    # Imported here because age_predictor imports this module
+    from age_predictor import FaceResult
+
+    return [FaceResult(tuple(box), confidence, age_index, age_range, np.asarray(probabilities, dtype=np.float32))
+            for box, confidence, age_index, age_range, probabilities in json.loads(value)]
+
+class ResultCache:
+    """Two-tier cache of per-image FaceResult lists
+
+    max_bytes bounds the in-memory LRU tier; the least recently used
+    entries are evicted once it is exceeded. With path set, every result is
+    also stored in a SQLite database there and memory misses fall back to it.
+
+    The database may be shared by several processes. Writes are committed
+    in groups (see COMMIT_EVERY) and flushed by flush() and close(). When
+    another process holds the lock for longer than BUSY_TIMEOUT, the lookup
+    counts as a miss or the group of writes is skipped instead of failing,
+    and the database is not used again for LOCK_BACKOFF seconds.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+
+        # Rows written to the SQLite tier but not committed yet
+        self.pending = 0
+        self.pending_since = None
+        self.backoff_until = 0.0
+
+        # Lookup latency percentiles, reported by stats()
+        self.metrics = StageMetrics(layer_profiling=False)
+
+        # Lookups may come from several threads, e.g. the HTTP server
+        self.lock = threading.Lock()
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+
+            # WAL lets worker processes read while another one writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self.db.commit()
+
+    def get(self, key):
+        """Return the cached results for a key, or None on a miss"""
+        with self.metrics.time("cache_lookup"), self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return results
+
+            if self._disk_available():
+                try:
+                    row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                except sqlite3.OperationalError:
+                    # Locked by another process for too long; treat it as a miss
+                    self._back_off()
+                    row = None
+
+                if row is not None:
+                    results = _decode(row[0])
+                    self._remember(key, results)
+                    self.disk_hits += 1
+                    return results
+
+            self.misses += 1
+            return None
+
+    def put(self, key, results):
+        """Store the results for a key in both tiers"""
+        with self.lock:
+            self._remember(key, results)
+
+            if not self._disk_available():
+                return
+
+            try:
+                self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                (key, _encode(results), time.time()))
+            except sqlite3.OperationalError:
+                self._discard()
+                return
+
+            self.pending += 1
+            if self.pending_since is None:
+                self.pending_since = time.perf_counter()
+
+            if self.pending >= COMMIT_EVERY or time.perf_counter() - self.pending_since >= COMMIT_INTERVAL:
+                self._commit()
+
+    def flush(self):
+        """Commit writes to the SQLite tier that are still pending"""
+        with self.lock:
+            if self.db is not None and self.pending:
+                self._commit()
+
+    def _commit(self):
+        """Commit pending writes, discarding them on a lock error"""
+        try:
+            self.db.commit()
+        except sqlite3.OperationalError:
+            self._discard()
+            return
+
+        self.pending = 0
+        self.pending_since = None
+
+    def _discard(self):
+        """Drop uncommitted writes after a lock error; the memory tier keeps them"""
+        self._back_off()
+        try:
+            self.db.rollback()
+        except sqlite3.OperationalError:
+            pass
+
+        self.pending = 0
+        self.pending_since = None
+
+    def _back_off(self):
+        """Count a lock error and leave the SQLite tier alone for a while"""
+        self.disk_errors += 1
+        self.backoff_until = time.perf_counter() + LOCK_BACKOFF
+
+    def _disk_available(self):
+        """Whether the SQLite tier is open and not backing off after a lock error"""
+        return self.db is not None and time.perf_counter() >= self.backoff_until
+
+    def _remember(self, key, results):
+        """Add an entry to the memory tier and evict down to max_bytes"""
+        if key in self.entries:
+            self.memory_bytes -= _entry_size(key, self.entries.pop(key))
+
+        size = _entry_size(key, results)
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = results
+        self.memory_bytes += size
+
+        while self.memory_bytes > self.max_bytes:
+            old_key, old_results = self.entries.popitem(last=False)
+            self.memory_bytes -= _entry_size(old_key, old_results)
+
+    def stats(self):
+        """Hit rate, lookup latency and memory use"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        latency = self.metrics.stats()["stages"].get("cache_lookup", {})
+
+        stats = {
+            "lookups": lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "lookup_p50_ms": latency.get("p50_ms", 0.0),
+            "lookup_p99_ms": latency.get("p99_ms", 0.0),
+            "entries": len(self.entries),
+            "memory_bytes": self.memory_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+        if self.path is not None:
+            stats["disk_bytes"] = os.path.getsize(self.path)
+
+        return stats
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self.lock:
+            self.entries.clear()
+            self.memory_bytes = 0
+
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self._commit()
+
+    def close(self):
+        """Commit pending writes and close the SQLite database"""
+        self.flush()
+
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def print_cache_stats(cache):
+    """Print a one-line summary of a cache's effectiveness"""
+    stats = cache.stats()
+    print(f"Result cache: {stats['hit_rate']:.0%} hit rate "
+          f"({stats['memory_hits']} memory, {stats['disk_hits']} disk, {stats['misses']} miss), "
+          f"lookup p50 {stats['lookup_p50_ms']:.3f} ms, "
+          f"{stats['entries']} entries using {stats['memory_bytes'] / 1024:.0f} KiB")
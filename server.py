@@ -0,0 +1,303 @@
+"""
+Local HTTP inference server for the age predictor
+
+Loads the models once per worker process and serves:
+
+    POST /predict   JPEG/PNG bytes in, JSON faces out (?confidence=0.7)
+    GET  /health    liveness and worker information
+    GET  /metrics   Prometheus text for the worker that answers
+
+Concurrent requests are batched dynamically: a worker waits up to max_wait
+seconds for up to max_batch images and runs them through predict_batch()
+together. Several worker processes can share the listening socket.
+
+Usage:
+    python age_predictor.py serve --port 8000 --workers 2 --max-batch 8 --max-wait-ms 5
+    curl --data-binary @photo.jpg http://127.0.0.1:8000/predict
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --image photo.jpg
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from age_predictor import create_predictor, decode_image, decoded_size, reduced_scale, scale_results
+
+# Largest request body accepted by /predict
+MAX_BODY_BYTES = 20 * 1024 * 1024
+
+class BatchingPredictor:
+    """Run images submitted from many threads through one predictor in batches
+
+    A single batching thread owns the predictor, so its nets are never used
+    by two threads at once. Each batch holds up to max_batch images that
+    arrived within max_wait seconds of the first one.
+    """
+
+    def __init__(self, predictor, max_batch=8, max_wait=0.005, reduced_decode=False):
+        self.predictor = predictor
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait
+
+        # Decode large JPEGs at reduced resolution (see AgePredictor.predict_encoded)
+        self.reduced_decode = reduced_decode
+
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.batched_images = 0
+
+        self.thread = threading.Thread(target=self._run, name="batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, image, confidence_threshold=0.7):
+        """Queue an image and return a Future of its list of FaceResult"""
+        future = Future()
+        self.requests.put((image, confidence_threshold, future, time.perf_counter_ns()))
+        return future
+
+    def _collect(self):
+        """Wait for the next request, then gather the batch that forms around it"""
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            metrics = self.predictor.metrics
+
+            # Images with different thresholds can't share a predict_batch() call
+            groups = {}
+            for request in batch:
+                groups.setdefault(request[1], []).append(request)
+
+            for confidence_threshold, requests in groups.items():
+                now = time.perf_counter_ns()
+                for _, _, _, queued in requests:
+                    metrics.record("queue_wait", now - queued)
+
+                try:
+                    with metrics.time("batch"):
+                        results = self.predictor.predict_batch([request[0] for request in requests],
+                                                               confidence_threshold)
+                except Exception as e:
+                    for _, _, future, _ in requests:
+                        future.set_exception(e)
+                    continue
+
+                for (_, _, future, _), faces in zip(requests, results):
+                    future.set_result(faces)
+
+                self.batches += 1
+                self.batched_images += len(requests)
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """Request handler; the server attributes hold the batcher and start time"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # One log line per request would dominate the cost of small requests
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+
+        if path == "/health":
+            batcher = self.server.batcher
+            self._send(200, {
+                "status": "ok",
+                "pid": os.getpid(),
+                "uptime_s": time.time() - self.server.started,
+                "batches": batcher.batches,
+                "images": batcher.batched_images,
+            })
+        elif path == "/metrics":
+            self._send(200, self.server.metrics_text().encode(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+
+        if url.path != "/predict":
+            self._send(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send(400, {"error": "empty request body, send JPEG or PNG bytes"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send(413, {"error": f"request body larger than {MAX_BODY_BYTES} bytes"})
+            return
+
+        metrics = self.server.batcher.predictor.metrics
+        with metrics.time("request"):
+            body = self.rfile.read(length)
+
+            try:
+                confidence = float(parse_qs(url.query).get("confidence", ["0.7"])[0])
+            except ValueError:
+                self._send(400, {"error": "confidence must be a number"})
+                return
+
+            batcher = self.server.batcher
+            scale = reduced_scale(body, batcher.predictor.detector_size) if batcher.reduced_decode else 1
+
+            with metrics.time("decode"):
+                image = decode_image(body, scale)
+
+            if image is None:
+                self._send(400, {"error": "could not decode image"})
+                return
+
+            try:
+                faces = batcher.submit(image, confidence).result()
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+
+            faces = scale_results(faces, scale, decoded_size(body, image, scale))
+
+            self._send(200, {"faces": [face.as_dict() for face in faces]})
+
+class PredictionServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering from an already listening socket"""
+
+    daemon_threads = True
+
+    def __init__(self, sock, batcher):
+        super().__init__(sock.getsockname()[:2], PredictionHandler, bind_and_activate=False)
+
+        # Replace the unbound socket created by the base class
+        self.socket.close()
+        self.socket = sock
+
+        self.batcher = batcher
+        self.started = time.time()
+
+    def metrics_text(self):
+        """Stage timings of this worker plus its request and batch counters"""
+        batcher = self.batcher
+        lines = [
+            "# HELP age_predictor_server_batches_total Batches run by this worker",
+            "# TYPE age_predictor_server_batches_total counter",
+            f"age_predictor_server_batches_total {batcher.batches}",
+            "# HELP age_predictor_server_images_total Images predicted by this worker",
+            "# TYPE age_predictor_server_images_total counter",
+            f"age_predictor_server_images_total {batcher.batched_images}",
+        ]
+        return batcher.predictor.metrics.prometheus_text() + "\n".join(lines) + "\n"
+
+def listen(host, port, backlog=128):
+    """Create the listening socket shared by every worker"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+def run_worker(sock, predictor_options, max_batch, max_wait, reduced_decode=False):
+    """Load the models and serve requests on a listening socket until stopped"""
+    # Layer profiling adds a little work per forward pass; stage timings are enough here
+    predictor = create_predictor(instrument=True, **predictor_options)
+    predictor.metrics.layer_profiling = False
+
+    if not predictor.load_models():
+        return
+
+    # Workers race to accept each connection; the losers must not block in accept()
+    sock.setblocking(False)
+    server = PredictionServer(sock, BatchingPredictor(predictor, max_batch, max_wait, reduced_decode))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def serve(host="127.0.0.1", port=8000, workers=1, max_batch=8, max_wait=0.005, reduced_decode=False,
+          **predictor_options):
+    """Serve predictions over HTTP with one or more worker processes"""
+    sock = listen(host, port)
+    print(f"Serving on http://{host}:{sock.getsockname()[1]} with {workers} worker(s), "
+          f"max batch {max_batch}, max wait {max_wait * 1000:g} ms")
+
+    if workers <= 1:
+        run_worker(sock, predictor_options, max_batch, max_wait, reduced_decode)
+        return
+
+    # Each worker accepts connections from the same socket
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker,
+                                 args=(sock, predictor_options, max_batch, max_wait, reduced_decode))
+                 for _ in range(workers)]
+
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+    finally:
+        sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='age_predictor.py serve',
+                                     description='Serve age predictions over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--max-batch', type=int, default=8,
+                        help='Maximum number of images per batch in each worker')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='How long a batch waits for more images after the first arrives')
+    parser.add_argument('--reduced-decode', action='store_true',
+                        help='Decode large JPEGs at 1/2, 1/4 or 1/8 resolution when the detector allows it')
+    parser.add_argument('--engine', choices=['opencv', 'onnx', 'onnx-int8'], default='opencv',
+                        help='Inference engine, as for the age_predictor.py CLI')
+    parser.add_argument('--detector-size', type=int, default=300, help='Face detector input resolution')
+    parser.add_argument('--threads', type=int, help='Number of threads OpenCV may use in each worker')
+    args = parser.parse_args(argv)
+
+    serve(args.host, args.port, args.workers, args.max_batch, args.max_wait_ms / 1000, args.reduced_decode,
+          engine=args.engine, detector_size=args.detector_size, threads=args.threads)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ Test script to verify that all models load correctly
 from age_predictor import AgePredictor
 import cv2
 import numpy as np
+import os
+import tempfile
 
 def test_model_loading():
     """Test if all models can be loaded successfully"""
@@ -51,6 +53,76 @@ def test_with_sample_image():
     else:
         return False
 
+def test_onnx_parity():
+    """Test that the ONNX Runtime engine matches cv2.dnn on the sample images"""
+    print("\nTesting ONNX export parity...")
+    
+    from export_onnx import check_parity, export_models, onnx
+    from onnx_predictor import onnxruntime
+    
+    if onnx is None or onnxruntime is None:
+        print("- Skipped: onnx and onnxruntime are not installed")
+        return True
+    
+    predictor = AgePredictor()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        face_output = os.path.join(directory, "face_detector.onnx")
+        age_output = os.path.join(directory, "age_net.onnx")
+        
+        if not export_models(predictor.face_model, predictor.face_proto, predictor.age_proto,
+                             predictor.age_model, face_output, age_output):
+            return False
+        
+        if check_parity(face_output, age_output):
+            print("✓ ONNX Runtime results match cv2.dnn")
+            return True
+        
+        print("✗ ONNX Runtime results differ from cv2.dnn")
+        return False
+
+def _synthetic_people(rng, people, faces_per_person):
+    """Descriptors like the age network's: a large common part, a small per-person part and noise"""
+    common = rng.uniform(1.0, 2.0, 512)
+    descriptors = []
+    for _ in range(people):
+        person = rng.normal(0.0, 0.5, 512)
+        descriptors.append([common + person + rng.normal(0.0, 0.15, 512) for _ in range(faces_per_person)])
+    
+    return common, descriptors
+
+def test_face_identities():
+    """Test that the face index tells people apart that raw cosine similarity merges"""
+    print("\nTesting face identities...")
+    
+    from face_index import FaceIndex
+    
+    rng = np.random.default_rng(0)
+    common, people = _synthetic_people(rng, 12, 6)
+    calibration_people, held_out = people[:6], people[6:]
+    
+    # Without centering every person looks alike
+    raw = FaceIndex(mean=np.zeros(512), threshold=0.5)
+    assert len(set(raw.assign([faces[0] for faces in held_out]))) == 1
+    
+    # A fixed mean and threshold
+    index = FaceIndex(mean=common, threshold=0.5)
+    identities = [index.assign(faces) for faces in held_out]
+    assert all(len(set(faces)) == 1 for faces in identities), identities
+    assert len({faces[0] for faces in identities}) == len(held_out), identities
+    
+    # A threshold calibrated on other people
+    index = FaceIndex()
+    report = index.calibrate([face for faces in calibration_people for face in faces],
+                             [person for person, faces in enumerate(calibration_people) for _ in faces])
+    assert report["balanced_accuracy"] == 1.0, report
+    
+    identities = [index.assign(faces) for faces in held_out]
+    assert all(len(set(faces)) == 1 for faces in identities), identities
+    assert len({faces[0] for faces in identities}) == len(held_out), identities
+    
+    print(f"✓ {len(held_out)} held-out people recognized with threshold {index.threshold:.3f}")
+
 def main():
     print("Age Predictor Model Test")
     print("=" * 30)
@@ -59,8 +131,11 @@ def main():
     if not test_model_loading():
         return
     
-    # Test 2: Sample image processing
-    if test_with_sample_image():
+    # Test 2: Sample image processing, and test 3: ONNX engine parity
+    if test_with_sample_image() and test_onnx_parity():
+        # Test 4: face identities, which raises AssertionError on failure
+        test_face_identities()
+        
         print("\n🎉 All tests passed!")
         print("\nYou can now use the age predictor with your own images:")
         print("  python age_predictor.py --image your_photo.jpg")
@@ -0,0 +1,127 @@
+"""
+Output handling for processed video frames
+
+Annotated frames can be shown in a window, written to a video file, or
+both, and per-frame detections can be streamed to a JSON Lines file so
+video can be processed on headless machines.
+"""
+
+import json
+import os
+import time
+
+import cv2
+
+class VideoOutput:
+    """Display, record and log processed video frames
+
+    Each call to write() takes one frame and its faces as
+    (box, age range, confidence, track ID or None) tuples, optionally
+    followed by the face index identity.
+    """
+
+    def __init__(self, output_path=None, results_path=None, display=True, fps=None,
+                 window_name='Age Prediction'):
+        self.output_path = output_path
+        self.results_path = results_path
+        self.display = display
+        self.window_name = window_name
+        self.fps = fps if fps and fps > 0 else 30.0
+
+        self.writer = None
+        self.results_file = None
+
+        # Line buffered so results can be followed while the video is processed
+        if results_path:
+            self.results_file = open(results_path, "w", buffering=1)
+
+        self.frames = 0
+        self.faces = 0
+        self.start_time = time.perf_counter()
+
+    @property
+    def needs_frames(self):
+        """Whether annotated frames are shown or saved at all"""
+        return bool(self.display or self.output_path)
+
+    def _open_writer(self, frame):
+        """Create the video writer once the frame size is known"""
+        extension = os.path.splitext(self.output_path)[1].lower()
+        fourcc = cv2.VideoWriter_fourcc(*("MJPG" if extension == ".avi" else "mp4v"))
+        height, width = frame.shape[:2]
+
+        self.writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, (width, height))
+
+        if not self.writer.isOpened():
+            print(f"Error: Could not open {self.output_path} for writing")
+            self.output_path = None
+            self.writer = None
+
+    def _face_record(self, box, predicted_age, confidence, track_id, identity=None):
+        """JSON view of one face tuple"""
+        record = {
+            "box": [int(value) for value in box],
+            "age": predicted_age,
+            "confidence": round(float(confidence), 4),
+            "track_id": track_id,
+        }
+        if identity is not None:
+            record["identity"] = identity
+
+        return record
+
+    def write(self, index, frame, faces):
+        """Handle one processed frame, returning False once the user asks to quit"""
+        self.frames += 1
+        self.faces += len(faces)
+
+        if self.results_file is not None:
+            record = {
+                "frame": index,
+                "timestamp": round(index / self.fps, 3),
+                "faces": [self._face_record(*face) for face in faces],
+            }
+            self.results_file.write(json.dumps(record) + "\n")
+
+        if self.output_path:
+            if self.writer is None:
+                self._open_writer(frame)
+
+            if self.writer is not None:
+                self.writer.write(frame)
+
+        if self.display:
+            # Display frame
+            cv2.imshow(self.window_name, frame)
+
+            # Break on 'q' key press
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                return False
+
+        return True
+
+    def close(self):
+        """Release all outputs and print a throughput summary
+
+        Returns a dict with the number of frames and faces, the elapsed time
+        and the achieved frames per second.
+        """
+        elapsed = time.perf_counter() - self.start_time
+
+        if self.writer is not None:
+            self.writer.release()
+            print(f"Annotated video saved to {self.output_path}")
+
+        if self.results_file is not None:
+            self.results_file.close()
+            print(f"Results saved to {self.results_path}")
+
+        if self.display:
+            cv2.destroyAllWindows()
+
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        print(f"Processed {self.frames} frames with {self.faces} face(s) "
+              f"in {elapsed:.1f}s ({fps:.1f} FPS)")
+
+        return {"frames": self.frames, "faces": self.faces,
+                "seconds": elapsed, "fps": fps}
@@ -0,0 +1,214 @@
+"""
+Multi-threaded video pipeline for the age predictor
+
+Capture, face detection, age prediction and display each run on their own
+thread and hand frames to each other through bounded queues.
+"""
+
+import queue
+import threading
+
+import cv2
+
+from video_output import VideoOutput
+
+# Marks the end of the stream in the stage queues
+_END = object()
+
+class FrameQueue:
+    """Bounded queue linking two pipeline stages
+
+    When full, put() either blocks until the next stage catches up
+    (backpressure, used for video files) or discards the oldest queued frame
+    (used for live sources so latency stays bounded).
+    """
+
+    def __init__(self, maxsize, drop_oldest=False):
+        self.queue = queue.Queue(maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item, stop_event):
+        """Add an item, blocking or dropping depending on the queue policy"""
+        if self.drop_oldest:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    pass
+
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+        while not stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, stop_event):
+        """Take the next item, or _END once the pipeline is stopping"""
+        while not stop_event.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+        return _END
+
+class VideoPipeline:
+    """Run AgePredictor over a video source as a set of threaded stages
+
+    Each network is only ever used by a single stage thread, so the
+    predictor's nets are not shared between threads. Output (display,
+    video file and JSON Lines results, see video_output.VideoOutput) stays on
+    the calling thread because some platforms only allow GUI calls there.
+    """
+
+    def __init__(self, predictor, queue_size=4, live=None,
+                 output_path=None, results_path=None, display=True):
+        self.predictor = predictor
+        self.queue_size = queue_size
+        self.live = live
+        self.output_path = output_path
+        self.results_path = results_path
+        self.display = display
+
+        self.stop_event = threading.Event()
+        self.errors = []
+
+    @staticmethod
+    def is_live_source(video_path):
+        """Webcams and network streams are live; files can be read at any pace"""
+        if isinstance(video_path, int):
+            return True
+
+        return str(video_path).startswith(('rtsp://', 'rtmp://', 'http://', 'https://'))
+
+    def _run_stage(self, target, *args):
+        """Run a stage, stopping the whole pipeline if it fails"""
+        try:
+            target(*args)
+        except Exception as e:
+            self.errors.append(e)
+            self.stop_event.set()
+
+    def _capture(self, cap, output):
+        """Read frames from the video source"""
+        index = 0
+
+        while not self.stop_event.is_set():
+            ret, frame = cap.read()
+
+            if not ret:
+                break
+
+            output.put((index, frame), self.stop_event)
+            index += 1
+
+        cap.release()
+        output.put(_END, self.stop_event)
+
+    def _detect(self, input_queue, output):
+        """Detect faces in each frame"""
+        while True:
+            item = input_queue.get(self.stop_event)
+
+            if item is _END:
+                break
+
+            index, frame = item
+            faces = self.predictor.detect_faces(frame)
+            output.put((index, frame, faces), self.stop_event)
+
+        output.put(_END, self.stop_event)
+
+    def _classify(self, input_queue, output):
+        """Predict ages for all faces of each frame"""
+        while True:
+            item = input_queue.get(self.stop_event)
+
+            if item is _END:
+                break
+
+            index, frame, faces = item
+            boxes, face_images = self.predictor._crop_faces(frame, faces)
+            predictions = self.predictor.predict_ages(face_images)
+            output.put((index, frame, boxes, predictions), self.stop_event)
+
+        output.put(_END, self.stop_event)
+
+    def run(self, video_path=0):
+        """Process the video source until it ends or 'q' is pressed
+
+        Returns the VideoOutput summary plus the number of dropped frames, or
+        None if the source can't be opened.
+        """
+        cap = cv2.VideoCapture(video_path)
+
+        if not cap.isOpened():
+            print("Error: Could not open video source")
+            return None
+
+        live = self.is_live_source(video_path) if self.live is None else self.live
+
+        # Only the queue after capture drops frames; later stages always keep up
+        # with their input because they receive at most what was captured
+        frames = FrameQueue(self.queue_size, drop_oldest=live)
+        detected = FrameQueue(self.queue_size)
+        classified = FrameQueue(self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._capture, cap, frames), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._detect, frames, detected), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._classify, detected, classified), daemon=True),
+        ]
+
+        output = VideoOutput(self.output_path, self.results_path, self.display,
+                             fps=cap.get(cv2.CAP_PROP_FPS))
+
+        self.stop_event.clear()
+        self.errors = []
+
+        for thread in threads:
+            thread.start()
+
+        if self.display:
+            print("Press 'q' to quit")
+
+        while True:
+            item = classified.get(self.stop_event)
+
+            if item is _END:
+                break
+
+            index, frame, boxes, predictions = item
+
+            faces = []
+            for box, (predicted_age, confidence, _) in zip(boxes, predictions):
+                if output.needs_frames:
+                    self.predictor._draw_video_face(frame, box, predicted_age)
+
+                faces.append((box, predicted_age, confidence, None))
+
+            if not output.write(index, frame, faces):
+                break
+
+        # Unblock and wait for the remaining stages
+        self.stop_event.set()
+        for thread in threads:
+            thread.join()
+
+        for error in self.errors:
+            print(f"Error in video pipeline: {error}")
+
+        stats = output.close()
+        stats["dropped"] = frames.dropped
+        print(f"Dropped {frames.dropped} frames")
+
+        return stats